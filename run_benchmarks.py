@@ -0,0 +1,270 @@
+from src import *
+import argparse
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import time
+import multiprocessing as mp
+import numpy as np
+
+# benchmark suite for the simulation hot paths and the process pool sweep
+# usage:
+#   python run_benchmarks.py run [--sizes 50x10,200x10,200x20] [--output benchmarks/baseline.json]
+#   python run_benchmarks.py compare benchmarks/baseline.json benchmarks/current.json [--tolerance 0.1]
+# every measurement is the best of --repeats runs, to reduce noise from the rest of the system.
+
+# number of trial moves timed by the test_move/accept_move benchmark
+MOVE_BENCHMARK_STEPS = 20000
+
+# save intervals run by the run_monte_carlo job benchmark, much shorter than a real job (config.TIMES_TO_SAVE) to keep the suite quick
+# with config.ADAPTIVE_MOVE_SIZE, move size tuning is capped at config.MAX_TUNING_FRACTION of them, so most of the benchmark times the frozen move size of the sampling phase
+JOB_BENCHMARK_SAVES = 10
+
+# jobs per process for the weak scaling benchmark, and the total number of jobs for the strong scaling benchmark
+WEAK_SCALING_JOBS_PER_PROCESS = 2
+STRONG_SCALING_JOBS = 12
+
+# function to change the system size used by the simulation
+# the grafting surface is scaled with the number of chains to keep the original grafting density (50 chains on 10 x 10)
+# args: num_chains, chain_len - system size
+# no return value
+# stores: the size and the derived surface and density volume in config, and clears cached starting configurations of the previous size
+def set_system_size(num_chains, chain_len):
+    config.NUM_CHAINS = num_chains
+    config.CHAIN_LEN = chain_len
+    config.BASE_LEN_X = config.BASE_LEN_Y = math.ceil(math.sqrt(2 * num_chains))
+    config.DENSITY_VOLUME = config.BASE_LEN_X * config.BASE_LEN_Y * config.DENSITY_CALC_Z_BOUNDARY
+    initialize_configuration.cache_clear()
+
+# function to set up the configuration of a benchmark process
+# benchmarks never checkpoint, use cached results, keep trajectories or stop early, so every run does the same amount of work
+# args: num_chains, chain_len - system size
+# no return value
+def configure_benchmark(num_chains, chain_len):
+    set_system_size(num_chains, chain_len)
+    config.CHECKPOINTING = False
+    config.RESULT_CACHE = False
+    config.SAVE_TRAJECTORIES = False
+    config.TIMES_TO_SAVE = JOB_BENCHMARK_SAVES
+
+# function to time a function, keeping the best of several runs
+# args: function - callable with no arguments, repeats - number of runs
+# returns: shortest run time in seconds
+def best_time(function, repeats):
+    times = []
+    for repeat in range(repeats):
+        start_time = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start_time)
+    return min(times)
+
+# function to measure the trial move rate of Brush.test_move + accept_move at T = 1
+# args: repeats - number of timed runs
+# returns: steps per second
+def benchmark_moves(repeats):
+    rng = np.random.default_rng(0)
+    steps = list(zip(rng.integers(0, config.NUM_CHAINS, MOVE_BENCHMARK_STEPS).tolist(),
+                     rng.integers(0, config.CHAIN_LEN, MOVE_BENCHMARK_STEPS).tolist(),
+                     rng.integers(0, 3, MOVE_BENCHMARK_STEPS).tolist(),
+                     rng.uniform(-1, 1, MOVE_BENCHMARK_STEPS).tolist(),
+                     rng.random(MOVE_BENCHMARK_STEPS).tolist()))
+
+    # every run starts from the same brush, so every run makes the same moves
+    def run_moves():
+        test_brush = prepare_variant(initialize_configuration(0), 1, True)
+        for chain_idx, particle_idx, move_direction, move_magnitude, acceptance_uniform in steps:
+            if acceptance_uniform < np.exp(-test_brush.test_move(chain_idx, particle_idx, move_direction, move_magnitude)):
+                test_brush.accept_move()
+
+    # time the brush set up on its own, so it can be taken off the move time
+    setup_time = best_time(lambda: prepare_variant(initialize_configuration(0), 1, True), repeats)
+    return MOVE_BENCHMARK_STEPS / max(best_time(run_moves, repeats) - setup_time, 1e-9)
+
+# function to measure the time to initialize the energies of one brush, including finding its interacting pairs
+# args: repeats - number of timed runs
+# returns: seconds per initialization
+def benchmark_initialize_energies(repeats):
+    test_brush = prepare_variant(initialize_configuration(0), 1, True)
+    return best_time(test_brush.initialize_energies, repeats)
+
+# function to measure the time of one run_monte_carlo job of JOB_BENCHMARK_SAVES save intervals
+# args: repeats - number of timed runs
+# returns: seconds per job
+def benchmark_job(repeats):
+    job = {"config_index": 0, "temperature": 1, "c_int": 1, "is_block": True}
+    return best_time(lambda: monte_carlo.run_monte_carlo(prepare_variant(initialize_configuration(0), 1, True), 1, job_rng(job)), repeats)
+
+# function to time a list of jobs on a process pool, the same way start_simulation.main runs the sweep
+# args: jobs - job dictionaries, num_processes - pool size, num_chains, chain_len - system size set in every worker
+# returns: wall time in seconds
+def time_pool(jobs, num_processes, num_chains, chain_len):
+    start_time = time.perf_counter()
+    with mp.Pool(processes=num_processes, initializer=configure_benchmark, initargs=(num_chains, chain_len)) as pool:
+        for result in pool.imap_unordered(run_job, jobs, chunksize=1):
+            pass
+    return time.perf_counter() - start_time
+
+# function to measure strong and weak scaling of the process pool sweep
+# strong scaling: STRONG_SCALING_JOBS jobs on 1, 2, 4... processes. weak scaling: WEAK_SCALING_JOBS_PER_PROCESS jobs per process.
+# args: num_chains, chain_len - system size, max_processes - largest pool size
+# returns: dictionary of results (see run_benchmarks)
+def benchmark_scaling(num_chains, chain_len, max_processes):
+    process_counts = [2**power for power in range(int(math.log2(max_processes)) + 1)]
+    all_jobs = build_jobs(range(math.ceil(max(STRONG_SCALING_JOBS, WEAK_SCALING_JOBS_PER_PROCESS * max_processes) / 12)))
+    results = {}
+
+    strong_base = None
+    weak_base = None
+    for num_processes in process_counts:
+        strong_time = time_pool(all_jobs[:STRONG_SCALING_JOBS], num_processes, num_chains, chain_len)
+        weak_time = time_pool(all_jobs[:WEAK_SCALING_JOBS_PER_PROCESS * num_processes], num_processes, num_chains, chain_len)
+        strong_base = strong_base or strong_time
+        weak_base = weak_base or weak_time
+
+        # efficiency is 1 for perfect scaling, and drops as processes wait on each other or on the hardware
+        results[f"strong_scaling_efficiency/{num_processes}p"] = measurement(strong_base / (strong_time * num_processes), "fraction", True)
+        results[f"weak_scaling_efficiency/{num_processes}p"] = measurement(weak_base / weak_time, "fraction", True)
+        print(f"  {num_processes} processes: strong {strong_time:.2f}s, weak {weak_time:.2f}s")
+
+    return results
+
+# function to package one benchmark result
+# args: value, unit, higher_is_better - True if larger values are better (rates), False if smaller are better (times)
+# returns: dictionary {"value", "unit", "higher_is_better"}
+def measurement(value, unit, higher_is_better):
+    return {"value": value, "unit": unit, "higher_is_better": higher_is_better}
+
+# function to describe the machine and code the benchmarks ran on, stored with the results
+# returns: dictionary of metadata
+def environment_metadata():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpu_count": mp.cpu_count(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S")
+    }
+
+# function to run the whole benchmark suite and save the results
+# args: sizes - list of (num_chains, chain_len) to run the single process benchmarks at
+#       scaling_size - (num_chains, chain_len) to run the scaling benchmarks at, or None to skip them
+#       max_processes - largest pool size for the scaling benchmarks
+#       repeats - number of timed runs per measurement
+#       output - JSON file to write
+# returns: results dictionary
+#   {
+#     "metadata": {...},                    # see environment_metadata
+#     "results": {
+#       "<benchmark>/<NUM_CHAINS>x<CHAIN_LEN>": {"value": float, "unit": str, "higher_is_better": bool},
+#       ...
+#     }
+#   }
+# stores: the results dictionary as JSON at output
+def run_benchmarks(sizes, scaling_size, max_processes, repeats, output):
+    results = {}
+
+    for num_chains, chain_len in sizes:
+        configure_benchmark(num_chains, chain_len)
+        size = f"{num_chains}x{chain_len}"
+        print(f"Benchmarking {size}...")
+
+        results[f"move_steps_per_second/{size}"] = measurement(benchmark_moves(repeats), "steps/s", True)
+        results[f"initialize_energies_seconds/{size}"] = measurement(benchmark_initialize_energies(repeats), "s", False)
+        results[f"job_seconds/{size}"] = measurement(benchmark_job(repeats), "s", False)
+
+        for name in [f"move_steps_per_second/{size}", f"initialize_energies_seconds/{size}", f"job_seconds/{size}"]:
+            print(f"  {name}: {results[name]['value']:.6g} {results[name]['unit']}")
+
+    if scaling_size is not None:
+        num_chains, chain_len = scaling_size
+        print(f"Benchmarking scaling at {num_chains}x{chain_len}...")
+        for name, result in benchmark_scaling(num_chains, chain_len, max_processes).items():
+            results[f"{name}/{num_chains}x{chain_len}"] = result
+
+    benchmark_results = {"metadata": environment_metadata(), "results": results}
+
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w') as file:
+        json.dump(benchmark_results, file, indent=2)
+    print(f"Results saved to {output}")
+
+    return benchmark_results
+
+# function to compare benchmark results against a baseline and flag regressions
+# args: baseline_path, current_path - JSON files from run_benchmarks
+#       tolerance - relative change allowed before a result counts as a regression (0.1 = 10% slower)
+# returns: list of the names of regressed benchmarks
+def compare_benchmarks(baseline_path, current_path, tolerance):
+    with open(baseline_path) as file:
+        baseline = json.load(file)["results"]
+    with open(current_path) as file:
+        current = json.load(file)["results"]
+
+    regressions = []
+    print(f"{'benchmark':<48} {'baseline':>12} {'current':>12} {'change':>8}")
+    for name in sorted(set(baseline) & set(current)):
+        baseline_value = baseline[name]["value"]
+        current_value = current[name]["value"]
+
+        # relative change, positive when the result got better
+        change = (current_value - baseline_value) / baseline_value
+        if not current[name]["higher_is_better"]:
+            change = -change
+
+        flag = ""
+        if change < -tolerance:
+            regressions.append(name)
+            flag = "REGRESSION"
+        print(f"{name:<48} {baseline_value:>12.6g} {current_value:>12.6g} {change:>+8.1%} {flag}")
+
+    # benchmarks only in one file cannot be compared, e.g. after changing the size matrix
+    for name in sorted(set(baseline) ^ set(current)):
+        print(f"{name:<48} only in {'baseline' if name in baseline else 'current'}")
+
+    print(f"{len(regressions)} regression(s) beyond {tolerance:.0%}")
+    return regressions
+
+# function to parse a comma separated list of NUM_CHAINSxCHAIN_LEN sizes
+# args: text - e.g "50x10,200x20"
+# returns: list of (num_chains, chain_len)
+def parse_sizes(text):
+    return [tuple(int(value) for value in size.split('x')) for size in text.split(',')]
+
+# function to run the command line interface
+# no return value, exits with status 1 if compare finds a regression
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the polymer brush simulation")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="run the benchmark suite and save the results as JSON")
+    run_parser.add_argument("--sizes", type=parse_sizes, default=parse_sizes("50x10,200x10,200x20"), help="NUM_CHAINSxCHAIN_LEN sizes, comma separated")
+    run_parser.add_argument("--scaling-size", type=lambda text: parse_sizes(text)[0], default=(50, 10), help="NUM_CHAINSxCHAIN_LEN size of the scaling benchmarks")
+    run_parser.add_argument("--no-scaling", action="store_true", help="skip the process pool scaling benchmarks")
+    run_parser.add_argument("--max-processes", type=int, default=mp.cpu_count(), help="largest pool size for the scaling benchmarks")
+    run_parser.add_argument("--repeats", type=int, default=3, help="timed runs per measurement, the best is kept")
+    run_parser.add_argument("--output", default=f"{config.BENCHMARK_FOLDERNAME}/benchmark_{time.strftime('%Y%m%d_%H%M%S')}.json", help="JSON file to write")
+
+    compare_parser = commands.add_parser("compare", help="compare results against a baseline")
+    compare_parser.add_argument("baseline", help="baseline JSON file")
+    compare_parser.add_argument("current", help="JSON file to check")
+    compare_parser.add_argument("--tolerance", type=float, default=0.1, help="relative slowdown allowed before flagging a regression")
+
+    args = parser.parse_args()
+    if args.command == "run":
+        run_benchmarks(args.sizes, None if args.no_scaling else args.scaling_size, args.max_processes, args.repeats, args.output)
+    elif compare_benchmarks(args.baseline, args.current, args.tolerance):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    # Enable multiprocessing support for windows
+    mp.freeze_support()
+    main()
@@ -1,5 +1,26 @@
+import importlib
 from .config import *
 from .interactions import *
+from .cell_list import *
 from .brush import *
+from .checkpoint import *
+from .result_cache import *
+from .results_stream import *
+from .trajectory import *
+from .instrumentation import *
+from .moves import *
+from .equilibration import *
 from .monte_carlo import *
-from .results_analysis import *
\ No newline at end of file
+from .sweep import *
+from .work_queue import *
+
+# results_analysis imports matplotlib, which simulation workers never use, so it is only imported the first time one of its names is used.
+# importing the package (or any simulation module) stays headless, e.g. in pool workers and start_worker.py.
+_RESULTS_ANALYSIS_NAMES = ('results_analysis', 'plot_and_save_data', 'save_results_array', 'load_results', 'render_plots', 'render_plot', 'get_figure', 'steps_axis')
+
+def __getattr__(name):
+    if name not in _RESULTS_ANALYSIS_NAMES:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+    results_analysis = importlib.import_module('.results_analysis', __name__)
+    return results_analysis if name == 'results_analysis' else getattr(results_analysis, name)
@@ -1,6 +1,8 @@
+import warnings
 import numpy as np
 from . import interactions
 from . import config
+from . import cell_list
 
 #define class Brush, containing all information about the current state of the polymer brush, and methods to modify the state of the brush
 class Brush: 
@@ -24,9 +26,18 @@ class Brush:
         # Type A will be equivilant to 1, type B will be equivilant to -1
         self.particle_types = np.zeros((config.NUM_CHAINS, config.CHAIN_LEN), dtype= config.PRECISION)
 
-        # Initialize a List to store information about any pending moves
+        # Initialize a reference to the pending move, None when no move is waiting for accept_move()
         self.pending_move = None
 
+        # Preallocated storage for the pending move, reused for every test_move() so no new arrays or lists are created per move
+        self.move_buffer = PendingMove()
+
+        # Initialize a List to store information about any pending batch of moves
+        self.pending_batch = None
+
+        # Initialize a reference to the pending chain segment move (see test_segment_move), None when no segment move is waiting for accept_segment_move()
+        self.pending_segment_move = None
+
         # Initialize an interaction constant for this Brush
         self.c_int = 0
 
@@ -36,21 +47,51 @@ class Brush:
         # (chain number, particle in chain) 
         self.spring_energies = np.zeros((config.NUM_CHAINS, config.CHAIN_LEN), dtype= config.PRECISION)
 
-        # Initialize a 4d array to store the energy contribution that each particle contributes to each other particle
-        # i.e pairwise interaction energies
-        # Shape: (chain1, particle1, chain2, particle2)
-        # interaction_cache[i,j,k,l] represents energy contribution between 
-        # particle j in chain i and particle l in chain k
-        self.interaction_cache = np.zeros((config.NUM_CHAINS, config.CHAIN_LEN, 
-                                         config.NUM_CHAINS, config.CHAIN_LEN), 
-                                         dtype=config.PRECISION)
+        # Initialize a 2d array to store the total pairwise interaction energy of each particle with all other particles
+        # (chain number, particle in chain)
+        # interaction_energies[i,j] is the sum of the interaction energies between particle j in chain i and every other particle.
+        # only the per-particle totals are stored, so memory scales with the number of particles, not the number of pairs.
+        # the individual pair energies are recalculated from the cell list when a move is accepted.
+        self.interaction_energies = np.zeros((config.NUM_CHAINS, config.CHAIN_LEN), dtype=config.PRECISION)
 
         # Initialize a 2d array to store the energy of each particle's interaction with the surface.
         self.surface_energies = np.zeros((config.NUM_CHAINS, config.CHAIN_LEN), dtype= config.PRECISION)
 
         #initialise a variable to store the total energy of the system
+        # always a float64 accumulator, even when config.PRECISION stores the positions and caches in float32
         self.total_energy = 0.0
 
+        # largest difference found between total_energy and a recalculation from scratch (see check_energy_drift)
+        self.max_energy_drift = 0.0
+
+        """observables"""
+        # number of particles at or below config.DENSITY_CALC_Z_BOUNDARY, kept up to date by accept_move so the near-surface density is available at any step
+        self.near_surface_count = 0
+
+        """move statistics"""
+        # maximum displacement of a single particle move, moves are drawn from uniform(-move_size, move_size).
+        # tuned per run during burn-in (see monte_carlo.tune_move_size), stored with the brush so it is checkpointed with it.
+        self.move_size = 1.0
+
+        # number of moves proposed and accepted after the move size was frozen, used to report the acceptance rate of a run
+        self.proposed_moves = 0
+        self.accepted_moves = 0
+
+        # number of [proposed, accepted] moves of each collective chain move type, keyed by move type (see moves.MOVE_TYPES)
+        self.chain_move_statistics = {}
+
+        """spatial index"""
+        # Initialize a cell list to look up which particles are close enough to interact with a given position
+        # cell size >= config.R_SIZE, so only the 27 cells around a position need to be checked.
+        self.cell_list = cell_list.CellList(config.CELL_SIZE)
+
+        """scratch buffers"""
+        # preallocated arrays for the hot path of test_move() and accept_move(), sized for the worst case of every particle being a candidate neighbour
+        # the interaction kernel writes into these in place, so a run does not allocate new arrays for every move.
+        self.interaction_buffers = interactions.InteractionBuffers(config.NUM_CHAINS * config.CHAIN_LEN)
+        self.old_neighbours = np.zeros(config.NUM_CHAINS * config.CHAIN_LEN, dtype=np.intp)
+        self.old_interaction_contributions = np.zeros(config.NUM_CHAINS * config.CHAIN_LEN, dtype=config.PRECISION)
+
     # method to generate random grafting points and vertical chain positions
     # args: self, rng - numpy random number generator object.
     # no return value
@@ -71,7 +112,7 @@ class Brush:
         # combine the x and y coordinates into a single array and assign the grafting coordinates
         # assign 0 to all z coords as the grafting surface is at z = 0
         # graft_positions shape: (NUM_CHAINS, 3) where 3 is (x,y,z)
-        self.graft_positions = np.column_stack((x_coords, y_coords, np.zeros(config.NUM_CHAINS, dtype=config.PRECISION)))
+        self.graft_positions = np.column_stack((x_coords, y_coords, np.zeros(config.NUM_CHAINS))).astype(config.PRECISION)
 
         # assign grafting x,y positions to all particles.
         # particle_positions is a 3d array with shape [config.NUM_CHAINS, config.CHAIN_LEN, 3], and graft_positions is a 2d array with shape [config.NUM_CHAINS, 3]
@@ -89,11 +130,17 @@ class Brush:
                                                     (config.CHAIN_LEN + 1) * config.SPRING_START_LENGTH,
                                                     config.SPRING_START_LENGTH, dtype= config.PRECISION)
 
+        # sort all particles into the cell list using their flat indices (chain number * CHAIN_LEN + particle in chain)
+        self.cell_list.build(self.particle_positions.reshape(-1, 3))
+
+        # count the particles starting at or below the density boundary
+        self.near_surface_count = int(np.sum(self.particle_positions[:, :, 2] <= config.DENSITY_CALC_Z_BOUNDARY))
+
     # method to calculate the initial energy of the brush (only works with initial position configuration.)
-    # args: self
+    # args: self, pair_geometry - optional pair geometry of the current positions from calc_pair_geometry(), calculated if not given
     # no return value
     # stores: energy information of an initialized brush.
-    def initialize_energies(self):
+    def initialize_energies(self, pair_geometry=None):
         # if config.SPRING_START_LENGTH > 0, all particles are at z > 0 at the start, no particles are interacting with the surface.
         # otherwise, if config.SPRING_START_LENGTH <= 0 all particles are either on or inside the surface, and are interacting with the surface.
         # therefore the config.SPRING_START_LENGTH can be used with the calc_surface_energy() function to determine the starting surface interaction energy of all particles.
@@ -102,23 +149,90 @@ class Brush:
         # all springs start at the same length and have the same energy
         self.spring_energies.fill(interactions.calc_spring_energy(np.array([0,0,0]), np.array([0,0,config.SPRING_START_LENGTH])))
 
-        # initialize pairwise interaction cache
-        # loop through all particles in all chains
-        for ref_chain_idx in range(config.NUM_CHAINS):
-            for ref_particle_idx in range(config.CHAIN_LEN):
-                # calculate interactions for this particle
-                self.interaction_cache[ref_chain_idx, ref_particle_idx] = interactions.calc_particle_interactions(
-                    self.c_int,
-                    self.particle_positions,
-                    self.particle_types,
-                    ref_chain_idx,
-                    ref_particle_idx,
-                    ref_particle_position = self.particle_positions[ref_chain_idx, ref_particle_idx]
-                )
-
-        # calculate total energy      
+        # initialize per-particle interaction energy totals from the pairs within the interaction radius
+        # the pair geometry only depends on the positions, so variants of the same configuration can share it
+        if pair_geometry is None:
+            pair_geometry = self.calc_pair_geometry()
+        self.interaction_energies[:] = interactions.calc_pair_interaction_energies(self.c_int, self.particle_types.reshape(-1), pair_geometry).reshape(config.NUM_CHAINS, config.CHAIN_LEN)
+
+        # calculate total energy, summed in float64 whatever the storage precision
         # IMPT: Sum of all particle energy must be divided by 2 to avoid double counting
-        self.total_energy = np.sum(self.spring_energies) + np.sum(self.surface_energies) + (np.sum(self.interaction_cache) / 2)
+        self.total_energy = np.sum(self.spring_energies, dtype=np.float64) + np.sum(self.surface_energies, dtype=np.float64) + (np.sum(self.interaction_energies, dtype=np.float64) / 2)
+
+    # method to recalculate every energy of the brush from its current positions, in float64, without altering the brush
+    # unlike initialize_energies, this works for any positions, not only the initial configuration.
+    # args: self
+    # returns: (spring_energies, surface_energies, interaction_energies, total_energy)
+        # float64 arrays shaped like the brush's energy caches, and the float64 total energy
+    def calc_energies_from_scratch(self):
+        positions = self.particle_positions.astype(np.float64)
+
+        # spring below each particle, against the particle below it or the grafting point for the first particle
+        below_positions = np.concatenate((self.graft_positions.astype(np.float64)[:, None, :], positions[:, :-1]), axis=1)
+        spring_energies = interactions.calc_spring_energies(positions, below_positions)
+        surface_energies = interactions.calc_surface_energies(positions[:, :, 2])
+
+        # interactions of every pair within the radius, found with the current cell list
+        pair_geometry = interactions.calc_pair_geometry(positions.reshape(-1, 3), self.cell_list)
+        interaction_energies = interactions.calc_pair_interaction_energies(self.c_int, self.particle_types.reshape(-1).astype(np.float64), pair_geometry).reshape(config.NUM_CHAINS, config.CHAIN_LEN)
+
+        total_energy = np.sum(spring_energies) + np.sum(surface_energies) + (np.sum(interaction_energies) / 2)
+        return spring_energies, surface_energies, interaction_energies, total_energy
+
+    # method to guard against accumulated error in the incrementally updated energies
+    # total_energy and the energy caches are updated by a difference on every accepted move, so rounding errors add up over a run, faster in float32.
+    # the total energy is recalculated from scratch and compared with total_energy. if they differ by more than the tolerance (see energy_drift_tolerance),
+    # a warning is issued and the caches and total are replaced with the recalculated values. below the tolerance the brush is left unchanged.
+    # args: self
+    # returns: drift, total_energy - recalculated total energy before any correction
+    # stores: the largest drift seen in self.max_energy_drift, and corrected energies if the drift was above the tolerance
+    def check_energy_drift(self):
+        spring_energies, surface_energies, interaction_energies, total_energy = self.calc_energies_from_scratch()
+        drift = self.total_energy - total_energy
+        self.max_energy_drift = max(self.max_energy_drift, float(abs(drift)))
+
+        tolerance = self.energy_drift_tolerance(spring_energies, surface_energies, interaction_energies)
+        if abs(drift) > tolerance:
+            warnings.warn(f"energy drift {drift:.3g} above tolerance {tolerance:.3g}, resynchronising the energy caches")
+            self.spring_energies[:] = spring_energies
+            self.surface_energies[:] = surface_energies
+            self.interaction_energies[:] = interaction_energies
+            self.total_energy = total_energy
+
+        return drift
+
+    # method to get the largest drift of the total energy expected from rounding alone
+    # every cached energy is stored in config.PRECISION, so each update rounds by about eps of that precision times the size of the energies it changes.
+    # the tolerance is config.ENERGY_DRIFT_TOLERANCE multiples of eps times the summed magnitude of every energy term, so one setting holds for float64 and float32.
+    # args: spring_energies, surface_energies, interaction_energies - recalculated energy caches, the last two axes are chain and particle in chain
+    # returns: tolerance of the total energy, one per brush for a leading replica axis
+    @staticmethod
+    def energy_drift_tolerance(spring_energies, surface_energies, interaction_energies):
+        magnitude = (np.sum(np.abs(spring_energies), axis=(-2, -1)) + np.sum(np.abs(surface_energies), axis=(-2, -1)) +
+            np.sum(np.abs(interaction_energies), axis=(-2, -1)) / 2)
+        return config.ENERGY_DRIFT_TOLERANCE * np.finfo(config.PRECISION).eps * magnitude
+
+    # method to find the interacting pairs of the current positions, shared by every variant (c_int, type pattern) of the same geometry
+    # args: self
+    # returns: pair geometry (first_idxs, second_idxs, weights), see interactions.calc_pair_geometry
+    def calc_pair_geometry(self):
+        return interactions.calc_pair_geometry(self.particle_positions.reshape(-1, 3), self.cell_list)
+
+    # method to create a new brush with the same geometry (grafting points, positions and cell list) as this one
+    # only the position state is copied, types, c_int and energies are left to be set for the new variant.
+    # much cheaper than copy.deepcopy, which would also copy the energy caches and scratch buffers.
+    # args: self
+    # returns: new Brush with copies of this brush's positions
+    def copy_geometry(self):
+        brush_copy = Brush()
+        brush_copy.particle_positions[:] = self.particle_positions
+        brush_copy.graft_positions[:] = self.graft_positions
+        brush_copy.near_surface_count = self.near_surface_count
+
+        # copy every cell's member list, so moves in the copy do not change this brush's cell list
+        brush_copy.cell_list.cells = {cell: list(members) for cell, members in self.cell_list.cells.items()}
+
+        return brush_copy
 
     # method to set the type of the polymer brush, block or alternating
     # args: self, is_block boolean indicating if the chain is to be block or not.
@@ -153,14 +267,22 @@ class Brush:
     
     
     # method to calculate state of brush after move, without altering the brush.
+    # the energy is evaluated in stages, cheapest first: surface and springs, then a bound on the interactions from the number of candidate neighbours,
+    # then the exact interactions. a move is rejected as soon as a lower bound on its delta_e is above rejection_threshold, skipping the remaining stages.
     # args: self, 
         # ref_chain_idx, ref_particle_idx chain and particle indexes of the particle to be moved and tested
         # move_dir, move_magnitude direction of and magnitiude of the move to be tested
-    # returns: delta_e
-    # stores: move information waiting for accept_move() call.
-    def test_move(self, ref_chain_idx, ref_particle_idx, move_dir, move_magnitude):
-        # retrive a copy of the current reference particle position
-        new_pos = self.particle_positions[ref_chain_idx, ref_particle_idx].copy()
+        # rejection_threshold: -temperature * ln(acceptance uniform), the largest delta_e the move can be accepted with (see rejection_threshold()).
+            # defaults to inf, which always evaluates the full energy.
+    # returns: delta_e, or inf if the move was rejected early
+    # stores: move information in self.move_buffer waiting for accept_move() call, self.pending_move is None if the move was rejected early.
+    def test_move(self, ref_chain_idx, ref_particle_idx, move_dir, move_magnitude, rejection_threshold=np.inf):
+        move = self.move_buffer
+        self.pending_move = None
+
+        # retrive a copy of the current reference particle position, into the preallocated new position
+        new_pos = move.new_position
+        np.copyto(new_pos, self.particle_positions[ref_chain_idx, ref_particle_idx])
 
         # increment the coordinate of the single axis by the magnitude
         new_pos[move_dir] += move_magnitude
@@ -175,30 +297,84 @@ class Brush:
         # if true, the spring below calculation will be against the grafting point.
         is_first = (ref_particle_idx == 0)
         
+        # flat index of the reference particle, used to index the cell list and the flattened arrays
+        ref_flat_idx = ref_chain_idx * config.CHAIN_LEN + ref_particle_idx
+
+        # flattened views of the particle arrays, shape: (NUM_CHAINS * CHAIN_LEN, ...). reshape returns views, no data is copied
+        flat_positions = self.particle_positions.reshape(-1, 3)
+
         # get the current energies from the energy cache
         old_spring_above = 0 if is_last else self.spring_energies[ref_chain_idx, ref_particle_idx + 1]
         old_spring_below = self.spring_energies[ref_chain_idx,ref_particle_idx]
         old_surface = self.surface_energies[ref_chain_idx,ref_particle_idx]
-        old_interaction_contributions = self.interaction_cache[ref_chain_idx, ref_particle_idx]
+        old_interaction_energy = self.interaction_energies[ref_chain_idx, ref_particle_idx]
 
-        # calculate the new energies with the new particle position, using the interactions functions
-        new_spring_above = 0 if is_last else interactions.calc_spring_energy(new_pos, self.particle_positions[ref_chain_idx, ref_particle_idx + 1])
-        new_spring_below = interactions.calc_spring_energy(new_pos, self.graft_positions[ref_chain_idx]) if is_first else interactions.calc_spring_energy(new_pos, self.particle_positions[ref_chain_idx, ref_particle_idx - 1]) 
+        # stage 1: calculate the new surface and spring energies, which only depend on the particle and its chain neighbours
+        # the spring separations are written into the move buffer, so no temporary arrays are allocated
+        new_spring_above = 0 if is_last else interactions.calc_spring_energy(new_pos, self.particle_positions[ref_chain_idx, ref_particle_idx + 1], out=move.spring_delta)
+        new_spring_below = interactions.calc_spring_energy(new_pos, self.graft_positions[ref_chain_idx] if is_first else self.particle_positions[ref_chain_idx, ref_particle_idx - 1], out=move.spring_delta)
         new_surface = interactions.calc_surface_energy(new_pos[2])
-        new_interaction_contributions = interactions.calc_particle_interactions(self.c_int, self.particle_positions,self.particle_types,ref_chain_idx,ref_particle_idx, ref_particle_position=new_pos)
+
+        # energy change of the springs and surface alone, where spring_above is 0 for last particle, and the energy change without the new interactions
+        local_delta_e = ((new_spring_above - old_spring_above) +
+            (new_spring_below - old_spring_below) + 
+            (new_surface - old_surface))
+        partial_delta_e = local_delta_e - old_interaction_energy
+
+        # kept even if the move is rejected early, to report why moves are rejected (see instrumentation.RunMetrics)
+        move.new_surface = new_surface
+        move.local_delta_e = local_delta_e
+
+        # no more than every other particle can interact with the new position, e.g a move into the surface (+1e9) is rejected here, before the cell list is searched
+        if self.is_early_rejection(partial_delta_e - abs(self.c_int) * (config.NUM_CHAINS * config.CHAIN_LEN - 1), rejection_threshold):
+            return np.inf
+
+        # get the particles close enough to interact with the reference particle at its new position, so the rest of the brush does not need to be checked.
+        # the reference particle is left out of its new neighbours to avoid a self-interaction
+        num_new_neighbours = self.cell_list.neighbours_into(new_pos, move.neighbours, exclude=ref_flat_idx)
+        new_neighbours = move.neighbours[:num_new_neighbours]
+
+        # stage 2: every candidate contributes at least -|c_int| (|type product| = 1, cos <= 1), so the new interactions are at least -|c_int| * number of candidates.
+        # e.g a large spring stretch is rejected here, without calculating any interactions
+        if self.is_early_rejection(partial_delta_e - abs(self.c_int) * num_new_neighbours, rejection_threshold):
+            return np.inf
+
+        # stage 3: calculate the exact new interactions, in place in the move buffer
+        new_interaction_contributions = interactions.calc_neighbour_interactions(self.c_int, flat_positions, self.particle_types.reshape(-1), self.particle_types[ref_chain_idx, ref_particle_idx], new_pos, new_neighbours,
+                                                                                 out=move.interaction_contributions, buffers=self.interaction_buffers)
+        new_interaction_energy = np.sum(new_interaction_contributions)
         
         # calculate the total delta e
         delta_e = ((new_spring_above - old_spring_above) +  # where spring_above is 0 for last particle
             (new_spring_below - old_spring_below) + 
             (new_surface - old_surface) + 
-            (np.sum(new_interaction_contributions) - np.sum(old_interaction_contributions)))
-
-        # store the calculated energies and reference particle information as a pending move
-        self.pending_move = [is_last, ref_chain_idx, ref_particle_idx, new_spring_above, new_spring_below, new_surface, new_interaction_contributions, delta_e, new_pos]
+            (new_interaction_energy - old_interaction_energy))
+
+        # store the calculated energies and reference particle information in the move buffer, and mark it as the pending move
+        move.is_last = is_last
+        move.chain_idx = ref_chain_idx
+        move.particle_idx = ref_particle_idx
+        move.flat_idx = ref_flat_idx
+        move.new_spring_above = new_spring_above
+        move.new_spring_below = new_spring_below
+        move.num_neighbours = num_new_neighbours
+        move.interaction_energy = new_interaction_energy
+        move.delta_e = delta_e
+        self.pending_move = move
 
         # return the delta_e to the monte carlo simulation
         return delta_e
 
+    # method to decide whether a lower bound on delta_e is enough to reject a move
+    # the bound and the exact delta_e are summed in a different order, so they can differ by rounding. the bound must clear the threshold by
+    # config.EARLY_REJECTION_TOLERANCE (relative to the size of the bound) before rejecting, so a move is only rejected early if the full
+    # Metropolis test (acceptance uniform < exp(-delta_e / temperature)) would certainly reject it too, and every decision stays the same.
+    # args: self, delta_e_bound - lower bound on delta_e, rejection_threshold - see test_move
+    # returns: True if the move can be rejected without further evaluation
+    @staticmethod
+    def is_early_rejection(delta_e_bound, rejection_threshold):
+        return delta_e_bound - rejection_threshold > config.EARLY_REJECTION_TOLERANCE * (1 + abs(delta_e_bound))
+
     # method to update the brush state to the recently checked move
     # args: self
     # no return value
@@ -206,44 +382,552 @@ class Brush:
     def accept_move(self):
         # update class energies and positions with information in self.pending_move
         # unpack pending move information
-        is_last, ref_chain_idx, ref_particle_idx, new_spring_above, new_spring_below, new_surface, new_interaction_contributions, delta_e, new_pos = self.pending_move
+        move = self.pending_move
+        ref_chain_idx, ref_particle_idx, ref_flat_idx, new_pos = move.chain_idx, move.particle_idx, move.flat_idx, move.new_position
+        new_neighbours = move.neighbours[:move.num_neighbours]
+        new_interaction_contributions = move.interaction_contributions[:move.num_neighbours]
         
+        # flattened views of the particle arrays indexed by flat particle indices
+        flat_positions = self.particle_positions.reshape(-1, 3)
+        flat_types = self.particle_types.reshape(-1)
+        flat_interaction_energies = self.interaction_energies.reshape(-1)
+
+        # Recalculate the interactions the moved particle had at its old position, before it is overwritten
+        # only particles in the cell list neighbourhood of the old position can have been interacting with it.
+        old_pos = self.particle_positions[ref_chain_idx, ref_particle_idx]
+        num_old_neighbours = self.cell_list.neighbours_into(old_pos, self.old_neighbours, exclude=ref_flat_idx)
+        old_neighbours = self.old_neighbours[:num_old_neighbours]
+        old_interaction_contributions = interactions.calc_neighbour_interactions(self.c_int, flat_positions, flat_types, flat_types[ref_flat_idx], old_pos, old_neighbours,
+                                                                                 out=self.old_interaction_contributions, buffers=self.interaction_buffers)
+
+        # Update the cell list before the old position is overwritten
+        self.cell_list.move(ref_flat_idx, old_pos, new_pos)
+
+        # Update the near-surface count if the particle crossed the density boundary, before the old position is overwritten
+        self.near_surface_count += int(new_pos[2] <= config.DENSITY_CALC_Z_BOUNDARY) - int(old_pos[2] <= config.DENSITY_CALC_Z_BOUNDARY)
+
         # Update particle position
         self.particle_positions[ref_chain_idx, ref_particle_idx] = new_pos
 
         # Update cached energies for the moved particle
         # Only update the energy for the spring above if the particle is not the last in the chain.
-        if not is_last: self.spring_energies[ref_chain_idx, ref_particle_idx + 1] = new_spring_above
-        self.spring_energies[ref_chain_idx, ref_particle_idx] = new_spring_below
-        self.surface_energies[ref_chain_idx, ref_particle_idx] = new_surface
+        if not move.is_last: self.spring_energies[ref_chain_idx, ref_particle_idx + 1] = move.new_spring_above
+        self.spring_energies[ref_chain_idx, ref_particle_idx] = move.new_spring_below
+        self.surface_energies[ref_chain_idx, ref_particle_idx] = move.new_surface
         
-        # Update interaction cache in both directions of the symmetrical interaction
-        # interaction_cache is a 4D array with shape: (NUM_CHAINS, CHAIN_LEN, NUM_CHAINS, CHAIN_LEN)
-        # where interaction_cache[i,j,k,l] represents energy contribution between:
-        #   - particle j in chain i (source particle)
-        #   - particle l in chain k (target particle)
-
-        # new_interaction_contributions is a 2D array with shape: (NUM_CHAINS, CHAIN_LEN) containing energy contributions between the moved particle and all other particles
-        # We don't only need to update the moved particle's 2d slice, but also the 2d slice of all other particles that have interactions with the moved particle.
-        # Each particle has their own 2d slice in the interaction_chache that represents the energy they have with all other particles.
-
-        # Update outgoing interactions: 
-        # To update how much energy the moved particle contributes to all other particles:
-        # - Slice the 4D interaction_cache by fixing first two dimensions to [ref_chain_idx, ref_particle_idx] indexing the moved particle's 2d slice
-        # - This Slice represents the interaction energy that the moved particle has with all other particles.
-        # - This gives a 2D slice with shape (NUM_CHAINS, CHAIN_LEN) representing energy FROM moved particle TO all others
-        self.interaction_cache[ref_chain_idx, ref_particle_idx] = new_interaction_contributions
+        # Update the interaction energy totals in both directions of the symmetrical interaction
+        # The moved particle's own total is replaced by the sum of its new interactions.
+        # Every old neighbour loses its old interaction with the moved particle, and every new neighbour gains its new one.
+        # ufunc.at updates the totals in place without gathering them into a temporary array first
+        np.subtract.at(flat_interaction_energies, old_neighbours, old_interaction_contributions)
+        np.add.at(flat_interaction_energies, new_neighbours, new_interaction_contributions)
+        flat_interaction_energies[ref_flat_idx] = move.interaction_energy
 
-        
-        # Update incoming interactions: 
-        # To update how much energy other particles contribute to the moved particle:
-        # - Slice the 4D interaction_cache by fixing last two dimensions to [ref_chain_idx, ref_particle_idx] indexing the moved particle in all other particles' 2d slices
-        # - Select all values for first two dimensions using [:, :]
-        # - This gives a 2D slice with shape (NUM_CHAINS, CHAIN_LEN) representing energy TO moved particle FROM all others
-        self.interaction_cache[:, :, ref_chain_idx, ref_particle_idx] = new_interaction_contributions
+        # Update total system energy
+        self.total_energy += move.delta_e
+
+        # Clear the stored pending move
+        self.pending_move = None
+
+    # method to calculate the energy change of moving one particle to each of several trial positions, without altering the brush.
+    # used by multiple-try Metropolis (see monte_carlo.multiple_try_step): the springs, surface and interactions of every trial are calculated together,
+    # with the interactions of all trials against the union of their cell list candidates in one broadcast kernel, so the per-call overhead is paid once for all trials.
+    # args: self,
+        # chain_idx, particle_idx: chain and particle indexes of the particle to be moved
+        # trial_positions: 2d array of [x,y,z] coordinates to test, shape: (number of trials, 3)
+    # returns: 1d array of delta_e for moving the particle to each trial position, with the rest of the brush as it is
+    # nothing is stored, the chosen trial is applied with test_move() and accept_move()
+    def test_trial_positions(self, chain_idx, particle_idx, trial_positions):
+        trial_positions = np.asarray(trial_positions, dtype=config.PRECISION)
+        flat_idx = chain_idx * config.CHAIN_LEN + particle_idx
+        is_last = (particle_idx == config.CHAIN_LEN - 1)
+
+        # springs below (against the grafting point for the first particle of the chain) and above every trial position, and the surface energies
+        below = self.graft_positions[chain_idx] if particle_idx == 0 else self.particle_positions[chain_idx, particle_idx - 1]
+        new_local_energies = interactions.calc_spring_energies(trial_positions, below) + interactions.calc_surface_energies(trial_positions[:, 2])
+        if not is_last:
+            new_local_energies += interactions.calc_spring_energies(trial_positions, self.particle_positions[chain_idx, particle_idx + 1])
+
+        # candidates of every trial position, each listed once and without the moved particle, scored against every trial position together
+        neighbours = self.cell_list.neighbours_union(trial_positions, exclude=flat_idx)
+        new_interaction_energies = np.sum(interactions.calc_trial_interactions(self.c_int, self.particle_positions.reshape(-1, 3), self.particle_types.reshape(-1),
+                                                                               self.particle_types[chain_idx, particle_idx], trial_positions, neighbours), axis=1)
+
+        # current energy of the particle from the energy cache, where spring_above is 0 for the last particle
+        old_energy = (self.spring_energies[chain_idx, particle_idx] +
+            (0 if is_last else self.spring_energies[chain_idx, particle_idx + 1]) +
+            self.surface_energies[chain_idx, particle_idx] +
+            self.interaction_energies[chain_idx, particle_idx])
+
+        return new_local_energies + new_interaction_energies - old_energy
+
+    # method to calculate state of brush after moving a contiguous segment of one chain together, without altering the brush.
+    # used by the collective chain moves (see moves.py), which move up to a whole chain at once. every energy term is calculated for all moved particles together:
+    # the springs and surface energies of the segment, the interactions between the particles of the segment (which a rigid move leaves unchanged),
+    # and the interactions of the segment with every other particle, found with the cell list.
+    # args: self,
+        # chain_idx: chain of the segment
+        # first_idx: index in the chain of the first moved particle
+        # new_positions: 2d array of the new [x,y,z] coordinates of particles first_idx, first_idx + 1, ..., shape: (number of moved particles, 3)
+        # rejection_threshold: largest delta_e the move can be accepted with, as for test_move
+    # returns: delta_e, or inf if the move was rejected early
+    # stores: move information in self.pending_segment_move waiting for accept_segment_move() call, None if the move was rejected early.
+    def test_segment_move(self, chain_idx, first_idx, new_positions, rejection_threshold=np.inf):
+        self.pending_segment_move = None
+        new_positions = np.asarray(new_positions, dtype=config.PRECISION)
+        num_moved = len(new_positions)
+        end_idx = first_idx + num_moved
+
+        # flat indices of the moved particles are the contiguous range [flat_first, flat_end)
+        flat_first = chain_idx * config.CHAIN_LEN + first_idx
+        flat_end = flat_first + num_moved
+        flat_positions = self.particle_positions.reshape(-1, 3)
+        flat_types = self.particle_types.reshape(-1)
+        old_positions = self.particle_positions[chain_idx, first_idx:end_idx]
+        segment_types = self.particle_types[chain_idx, first_idx:end_idx]
+
+        # stage 1: springs below every moved particle (against the particle below it, the grafting point for the first particle of the chain),
+        # the spring above the segment if it does not end the chain, and the surface energies
+        below_first = self.graft_positions[chain_idx] if first_idx == 0 else self.particle_positions[chain_idx, first_idx - 1]
+        new_spring_energies = interactions.calc_spring_energies(new_positions, np.concatenate((below_first[None, :], new_positions[:-1])))
+        is_last = end_idx == config.CHAIN_LEN
+        new_spring_above = 0.0 if is_last else interactions.calc_spring_energy(new_positions[-1], self.particle_positions[chain_idx, end_idx])
+        old_spring_above = 0.0 if is_last else self.spring_energies[chain_idx, end_idx]
+        new_surface_energies = interactions.calc_surface_energies(new_positions[:, 2])
+
+        local_delta_e = ((np.sum(new_spring_energies) - np.sum(self.spring_energies[chain_idx, first_idx:end_idx])) +
+            (new_spring_above - old_spring_above) +
+            (np.sum(new_surface_energies) - np.sum(self.surface_energies[chain_idx, first_idx:end_idx])))
+
+        # every moved particle can gain or lose at most |c_int| with every particle outside the segment, and every pair inside it, e.g a move into the surface is rejected here
+        num_particles = config.NUM_CHAINS * config.CHAIN_LEN
+        if self.is_early_rejection(local_delta_e - 2 * abs(self.c_int) * num_moved * (num_particles - 1), rejection_threshold):
+            return np.inf
+
+        # stage 2: interactions between the particles of the segment, before and after the move
+        old_group_energies = interactions.calc_group_interactions(self.c_int, old_positions, segment_types)
+        new_group_energies = interactions.calc_group_interactions(self.c_int, new_positions, segment_types)
+
+        # interactions with every particle outside the segment, from the cell list candidates of each moved particle at its old and new position
+        # the cell list still holds the old positions, the segment's own particles are removed from the candidates
+        old_neighbours, old_segment_ids = self.cell_list.neighbours_batch(old_positions)
+        outside = (old_neighbours < flat_first) | (old_neighbours >= flat_end)
+        old_neighbours, old_segment_ids = old_neighbours[outside], old_segment_ids[outside]
+        old_contributions = interactions.calc_batch_neighbour_interactions(self.c_int, flat_positions, flat_types, segment_types, old_positions, old_neighbours, old_segment_ids)
+
+        new_neighbours, new_segment_ids = self.cell_list.neighbours_batch(new_positions)
+        outside = (new_neighbours < flat_first) | (new_neighbours >= flat_end)
+        new_neighbours, new_segment_ids = new_neighbours[outside], new_segment_ids[outside]
+        new_contributions = interactions.calc_batch_neighbour_interactions(self.c_int, flat_positions, flat_types, segment_types, new_positions, new_neighbours, new_segment_ids)
+
+        # new interaction total of each moved particle, within the segment and with the rest of the brush
+        new_interaction_energies = np.sum(new_group_energies, axis=1) + np.bincount(new_segment_ids, weights=new_contributions, minlength=num_moved)
+
+        # internal pairs are counted once, external pairs once from the segment's side
+        delta_e = (local_delta_e +
+            (np.sum(new_group_energies) - np.sum(old_group_energies)) / 2 +
+            (np.sum(new_contributions) - np.sum(old_contributions)))
+
+        # store the calculated energies in the pending segment move
+        move = PendingSegmentMove()
+        move.chain_idx = chain_idx
+        move.first_idx = first_idx
+        move.is_last = is_last
+        move.new_positions = new_positions
+        move.new_spring_energies = new_spring_energies
+        move.new_spring_above = new_spring_above
+        move.new_surface_energies = new_surface_energies
+        move.new_interaction_energies = new_interaction_energies
+        move.old_neighbours = old_neighbours
+        move.old_contributions = old_contributions
+        move.new_neighbours = new_neighbours
+        move.new_contributions = new_contributions
+        move.delta_e = delta_e
+        self.pending_segment_move = move
+
+        return delta_e
+
+    # method to update the brush state to the recently checked segment move
+    # args: self
+    # no return value
+    # stores: new positional and energy information of the segment and of the particles it interacted with
+    def accept_segment_move(self):
+        move = self.pending_segment_move
+        chain_idx, first_idx = move.chain_idx, move.first_idx
+        end_idx = first_idx + len(move.new_positions)
+        flat_first = chain_idx * config.CHAIN_LEN + first_idx
+        old_positions = self.particle_positions[chain_idx, first_idx:end_idx]
+
+        # Update the cell list and near-surface count before the old positions are overwritten
+        for offset, (old_pos, new_pos) in enumerate(zip(old_positions, move.new_positions)):
+            self.cell_list.move(flat_first + offset, old_pos, new_pos)
+        self.near_surface_count += int(np.sum(move.new_positions[:, 2] <= config.DENSITY_CALC_Z_BOUNDARY)) - int(np.sum(old_positions[:, 2] <= config.DENSITY_CALC_Z_BOUNDARY))
+
+        # Update particle positions and the cached spring and surface energies of the segment
+        self.particle_positions[chain_idx, first_idx:end_idx] = move.new_positions
+        self.spring_energies[chain_idx, first_idx:end_idx] = move.new_spring_energies
+        if not move.is_last: self.spring_energies[chain_idx, end_idx] = move.new_spring_above
+        self.surface_energies[chain_idx, first_idx:end_idx] = move.new_surface_energies
+
+        # Every particle outside the segment loses its old interactions with the segment and gains its new ones, as in accept_move
+        # The moved particles' own totals are replaced by the sums of their new interactions.
+        flat_interaction_energies = self.interaction_energies.reshape(-1)
+        np.subtract.at(flat_interaction_energies, move.old_neighbours, move.old_contributions)
+        np.add.at(flat_interaction_energies, move.new_neighbours, move.new_contributions)
+        self.interaction_energies[chain_idx, first_idx:end_idx] = move.new_interaction_energies
+
+        # Update total system energy
+        self.total_energy += move.delta_e
+
+        # Clear the stored pending move
+        self.pending_segment_move = None
+
+    # method to calculate the energy change of a batch of single particle moves, without altering the brush.
+    # the moves are assumed to be independent: no two moved particles may interact with each other or share a spring,
+    # so each delta_e is exactly the delta_e the move would have on its own (see monte_carlo.run_checkerboard_monte_carlo)
+    # args: self, 
+        # flat_idxs: 1d integer array of flat indices (chain number * CHAIN_LEN + particle in chain) of the particles to be moved
+        # move_dirs, move_magnitudes: 1d arrays of direction and magnitude of each move
+    # returns: 1d array of delta_e for each move
+    # stores: batch move information waiting for accept_moves() call.
+    def test_moves(self, flat_idxs, move_dirs, move_magnitudes):
+        # flattened views of the particle arrays
+        flat_positions = self.particle_positions.reshape(-1, 3)
+        flat_types = self.particle_types.reshape(-1)
+        flat_spring_energies = self.spring_energies.reshape(-1)
+        flat_surface_energies = self.surface_energies.reshape(-1)
+        flat_interaction_energies = self.interaction_energies.reshape(-1)
+
+        # new positions of all moved particles, shape: (number of moves, 3)
+        new_positions = flat_positions[flat_idxs]
+        new_positions[np.arange(len(flat_idxs)), move_dirs] += move_magnitudes
+
+        # chain and particle indexes of the moved particles
+        chain_idxs, particle_idxs = np.divmod(flat_idxs, config.CHAIN_LEN)
+        is_first = particle_idxs == 0
+        is_last = particle_idxs == config.CHAIN_LEN - 1
+
+        # position of the particle below (or the grafting point for the first particle) and above each moved particle
+        # indexes are clipped to stay in bounds, and the values they select for first/last particles are masked out
+        below_positions = np.where(is_first[:, None], self.graft_positions[chain_idxs], flat_positions[np.maximum(flat_idxs - 1, 0)])
+        above_idxs = np.minimum(flat_idxs + 1, len(flat_positions) - 1)
+        above_positions = flat_positions[above_idxs]
+
+        # get the current energies from the energy cache, spring above is 0 for last particles
+        old_spring_above = np.where(is_last, 0.0, flat_spring_energies[above_idxs])
+        old_spring_below = flat_spring_energies[flat_idxs]
+        old_surface = flat_surface_energies[flat_idxs]
+        old_interaction_energy = flat_interaction_energies[flat_idxs]
+
+        # calculate the new energies with the new particle positions
+        new_spring_above = np.where(is_last, 0.0, interactions.calc_spring_energies(new_positions, above_positions))
+        new_spring_below = interactions.calc_spring_energies(new_positions, below_positions)
+        new_surface = interactions.calc_surface_energies(new_positions[:, 2])
+
+        # gather the candidate neighbours of every new position, removing each moved particle from its own candidates
+        new_neighbours, new_segments = self.cell_list.neighbours_batch(new_positions)
+        not_self = new_neighbours != flat_idxs[new_segments]
+        new_neighbours, new_segments = new_neighbours[not_self], new_segments[not_self]
+        new_interaction_contributions = interactions.calc_batch_neighbour_interactions(self.c_int, flat_positions, flat_types, flat_types[flat_idxs], new_positions, new_neighbours, new_segments)
+        new_interaction_energy = np.bincount(new_segments, weights=new_interaction_contributions, minlength=len(flat_idxs))
+
+        # calculate the total delta e of each move
+        delta_e = ((new_spring_above - old_spring_above) +
+            (new_spring_below - old_spring_below) +
+            (new_surface - old_surface) +
+            (new_interaction_energy - old_interaction_energy))
+
+        # store the calculated energies and move information as a pending batch
+        self.pending_batch = [flat_idxs, is_last, new_positions, new_spring_above, new_spring_below, new_surface, new_neighbours, new_segments, new_interaction_contributions, new_interaction_energy, delta_e]
+
+        return delta_e
+
+    # method to update the brush state with the accepted moves of the recently checked batch
+    # args: self, accepted - 1d boolean array, True for each move in the batch to be accepted
+    # no return value
+    # stores: new positional and energy information
+    def accept_moves(self, accepted):
+        flat_idxs, is_last, new_positions, new_spring_above, new_spring_below, new_surface, new_neighbours, new_segments, new_interaction_contributions, new_interaction_energy, delta_e = self.pending_batch
+
+        # flattened views of the particle arrays
+        flat_positions = self.particle_positions.reshape(-1, 3)
+        flat_types = self.particle_types.reshape(-1)
+        flat_spring_energies = self.spring_energies.reshape(-1)
+        flat_surface_energies = self.surface_energies.reshape(-1)
+        flat_interaction_energies = self.interaction_energies.reshape(-1)
+
+        # position in the batch of each accepted move, and the candidates belonging to accepted moves
+        accepted_moves = np.flatnonzero(accepted)
+        accepted_pairs = accepted[new_segments]
+        accepted_idxs = flat_idxs[accepted_moves]
+
+        # Recalculate the interactions the accepted particles had at their old positions, before they are overwritten
+        old_positions = flat_positions[accepted_idxs]
+        old_neighbours, old_segments = self.cell_list.neighbours_batch(old_positions)
+        not_self = old_neighbours != accepted_idxs[old_segments]
+        old_neighbours, old_segments = old_neighbours[not_self], old_segments[not_self]
+        old_interaction_contributions = interactions.calc_batch_neighbour_interactions(self.c_int, flat_positions, flat_types, flat_types[accepted_idxs], old_positions, old_neighbours, old_segments)
+
+        # Update the cell list and particle positions
+        for flat_idx, old_position, new_position in zip(accepted_idxs, old_positions, new_positions[accepted_moves]):
+            self.cell_list.move(flat_idx, old_position, new_position)
+        self.near_surface_count += int(np.sum(new_positions[accepted_moves, 2] <= config.DENSITY_CALC_Z_BOUNDARY) - np.sum(old_positions[:, 2] <= config.DENSITY_CALC_Z_BOUNDARY))
+        flat_positions[accepted_idxs] = new_positions[accepted_moves]
+
+        # Update cached spring and surface energies for the moved particles, spring above only for particles that are not last in their chain
+        has_above = accepted_moves[~is_last[accepted_moves]]
+        flat_spring_energies[flat_idxs[has_above] + 1] = new_spring_above[has_above]
+        flat_spring_energies[accepted_idxs] = new_spring_below[accepted_moves]
+        flat_surface_energies[accepted_idxs] = new_surface[accepted_moves]
+
+        # Update the interaction energy totals in both directions of the symmetrical interaction
+        # moved particles in the same batch can share neighbours, so np.add.at is used to accumulate repeated indices correctly
+        np.subtract.at(flat_interaction_energies, old_neighbours, old_interaction_contributions)
+        np.add.at(flat_interaction_energies, new_neighbours[accepted_pairs], new_interaction_contributions[accepted_pairs])
+        flat_interaction_energies[accepted_idxs] = new_interaction_energy[accepted_moves]
 
         # Update total system energy
-        self.total_energy += delta_e
+        self.total_energy += np.sum(delta_e[accepted_moves])
+
+        # Clear the stored pending batch
+        self.pending_batch = None
+
+
+#define class PendingMove, fixed-layout storage for the move computed by Brush.test_move() until Brush.accept_move() applies it
+#__slots__ keeps the fields in a fixed layout without a per-instance dictionary, and the arrays are allocated once and overwritten by every test_move()
+class PendingMove:
+    __slots__ = ('is_last', 'chain_idx', 'particle_idx', 'flat_idx', 'new_spring_above', 'new_spring_below', 'new_surface', 'local_delta_e',
+                 'new_position', 'spring_delta', 'neighbours', 'num_neighbours', 'interaction_contributions', 'interaction_energy', 'delta_e')
+
+    # method to allocate the move storage
+    # args: self
+    # no return value
+    # stores: scalar fields of the move, and arrays sized for the worst case of every particle being a candidate neighbour
+    def __init__(self):
+        self.is_last = False
+        self.chain_idx = 0
+        self.particle_idx = 0
+        self.flat_idx = 0
+        self.new_spring_above = 0.0
+        self.new_spring_below = 0.0
+        self.new_surface = 0.0
+
+        # energy change of the springs and surface alone, without the interactions
+        self.local_delta_e = 0.0
+
+        # new [x,y,z] position of the moved particle
+        self.new_position = np.zeros(3, dtype=config.PRECISION)
+
+        # scratch for the separation of the new position from a chain neighbour, used to calculate each spring energy
+        self.spring_delta = np.zeros(3, dtype=config.PRECISION)
+
+        # flat indices of the candidate neighbours at the new position and their interaction energies with the moved particle, only the first num_neighbours are valid
+        self.neighbours = np.zeros(config.NUM_CHAINS * config.CHAIN_LEN, dtype=np.intp)
+        self.num_neighbours = 0
+        self.interaction_contributions = np.zeros(config.NUM_CHAINS * config.CHAIN_LEN, dtype=config.PRECISION)
+
+        # sum of the new interaction contributions, and the total energy change of the move
+        self.interaction_energy = 0.0
+        self.delta_e = 0.0
+
+#define class PendingSegmentMove, storage for the move computed by Brush.test_segment_move() until Brush.accept_segment_move() applies it
+#segment moves are much rarer than single particle moves and vary in size, so a new one is created for every move rather than preallocated
+class PendingSegmentMove:
+    __slots__ = ('chain_idx', 'first_idx', 'is_last', 'new_positions', 'new_spring_energies', 'new_spring_above', 'new_surface_energies', 'new_interaction_energies',
+                 'old_neighbours', 'old_contributions', 'new_neighbours', 'new_contributions', 'delta_e')
+
+#define class BatchedBrush, a stack of brushes (replicas) that share a grafting geometry but can differ in interaction constant, type pattern and temperature.
+#every replica advances together: one test_move/accept_move call proposes and applies one move in every replica,
+#so the python overhead of a step is paid once for all replicas instead of once per replica.
+#interactions are calculated against every particle of the replica with a dense vectorized kernel, no cell list is kept.
+#moves are drawn with the shared move size of the stacked brushes, which is never tuned: adaptive tuning, checkpoints and the other per-job options
+#are not supported in the batched modes (see sweep.check_batched_options).
+class BatchedBrush:
+
+    # method to stack already initialized brushes into one batched brush
+    # args: self, brushes - list of Brush objects with positions, types, c_int and energies initialized, all sharing the same graft positions
+    # no return value
+    # stores: state and energy information of every replica, with a leading replica axis
+    def __init__(self, brushes):
+        # number of replicas in the stack
+        self.num_replicas = len(brushes)
+
+        """physical information"""
+        # (replica, chain number, particle in chain, xyz coords)
+        self.particle_positions = np.stack([brush.particle_positions for brush in brushes])
+
+        # graft positions are shared by all replicas, (chain number, xyz coords)
+        self.graft_positions = brushes[0].graft_positions.copy()
+
+        # (replica, chain number, particle in chain)
+        self.particle_types = np.stack([brush.particle_types for brush in brushes])
+
+        # interaction constant of each replica, (replica,)
+        self.c_ints = np.array([brush.c_int for brush in brushes], dtype=config.PRECISION)
+
+        # maximum displacement of every move, moves are drawn from uniform(-move_size, move_size) as in the unbatched engine.
+        # shared by every replica, so the replicas must all have the same move size
+        if any(brush.move_size != brushes[0].move_size for brush in brushes):
+            raise ValueError("every replica of a BatchedBrush must have the same move_size")
+        self.move_size = brushes[0].move_size
+
+        # Initialize a List to store information about the pending moves
+        self.pending_move = None
+
+        """energy cache"""
+        # (replica, chain number, particle in chain)
+        self.spring_energies = np.stack([brush.spring_energies for brush in brushes])
+        self.surface_energies = np.stack([brush.surface_energies for brush in brushes])
+        self.interaction_energies = np.stack([brush.interaction_energies for brush in brushes])
+
+        # total energy of each replica, (replica,)
+        self.total_energy = np.array([brush.total_energy for brush in brushes], dtype=np.float64)
+
+        # largest difference between the running and recalculated total energy of each replica found by check_energy_drift, (replica,)
+        self.max_energy_drift = np.zeros(self.num_replicas)
+
+        """observables"""
+        # number of particles at or below config.DENSITY_CALC_Z_BOUNDARY in each replica, (replica,)
+        self.near_surface_count = np.array([brush.near_surface_count for brush in brushes], dtype=np.int64)
+
+    # method to recalculate every energy of every replica from its current positions, without altering the brush
+    # the interactions are found with the same dense kernel as the moves, one particle of every replica at a time.
+    # args: self
+    # returns: (spring_energies, surface_energies, interaction_energies, total_energy)
+        # arrays shaped like the brush's energy caches, and the float64 total energy of each replica
+    def calc_energies_from_scratch(self):
+        positions = self.particle_positions.astype(np.float64)
+
+        # spring below each particle, against the particle below it or the grafting point for the first particle
+        graft_positions = np.broadcast_to(self.graft_positions.astype(np.float64)[None, :, None, :], (self.num_replicas, config.NUM_CHAINS, 1, 3))
+        spring_energies = interactions.calc_spring_energies(positions, np.concatenate((graft_positions, positions[:, :, :-1]), axis=2))
+        surface_energies = interactions.calc_surface_energies(positions[:, :, :, 2])
+
+        # interactions of every particle with every other particle of its replica
+        flat_positions = positions.reshape(self.num_replicas, -1, 3)
+        flat_types = self.particle_types.reshape(self.num_replicas, -1)
+        interaction_energies = np.zeros(flat_types.shape)
+        for flat_idx in range(flat_types.shape[1]):
+            ref_flat_idxs = np.full(self.num_replicas, flat_idx)
+            interaction_energies[:, flat_idx] = np.sum(interactions.calc_replica_interactions(self.c_ints, flat_positions, flat_types, ref_flat_idxs, flat_positions[:, flat_idx]), axis=1)
+        interaction_energies = interaction_energies.reshape(self.interaction_energies.shape)
+
+        total_energy = np.sum(spring_energies, axis=(1, 2)) + np.sum(surface_energies, axis=(1, 2)) + (np.sum(interaction_energies, axis=(1, 2)) / 2)
+        return spring_energies, surface_energies, interaction_energies, total_energy
+
+    # method to guard against accumulated error in the incrementally updated energies of every replica, as Brush.check_energy_drift
+    # args: self
+    # returns: 1d array of the drift of each replica, (replica,)
+    # stores: the largest drift seen in self.max_energy_drift, and corrected energies of the replicas whose drift was above the tolerance
+    def check_energy_drift(self):
+        spring_energies, surface_energies, interaction_energies, total_energy = self.calc_energies_from_scratch()
+        drift = self.total_energy - total_energy
+        self.max_energy_drift = np.maximum(self.max_energy_drift, np.abs(drift))
+
+        drifted = np.flatnonzero(np.abs(drift) > Brush.energy_drift_tolerance(spring_energies, surface_energies, interaction_energies))
+        if len(drifted):
+            warnings.warn(f"energy drift {np.max(np.abs(drift[drifted])):.3g} above tolerance in {len(drifted)} replicas, resynchronising their energy caches")
+            self.spring_energies[drifted] = spring_energies[drifted]
+            self.surface_energies[drifted] = surface_energies[drifted]
+            self.interaction_energies[drifted] = interaction_energies[drifted]
+            self.total_energy[drifted] = total_energy[drifted]
+
+        return drift
+
+    # method to calculate the state of every replica after one move each, without altering the brush.
+    # args: self, 
+        # chain_idxs, particle_idxs: 1d arrays of chain and particle indexes of the particle to be moved in each replica
+        # move_dirs, move_magnitudes: 1d arrays of direction and magnitude of the move in each replica
+    # returns: 1d array of delta_e for each replica
+    # stores: move information waiting for accept_move() call.
+    def test_move(self, chain_idxs, particle_idxs, move_dirs, move_magnitudes):
+        replica_idxs = np.arange(self.num_replicas)
+
+        # new position of the moved particle in each replica, shape: (replica, 3)
+        new_positions = self.particle_positions[replica_idxs, chain_idxs, particle_idxs]
+        new_positions[replica_idxs, move_dirs] += move_magnitudes
+
+        # first and last particle flags of each replica's moved particle
+        is_first = particle_idxs == 0
+        is_last = particle_idxs == config.CHAIN_LEN - 1
+
+        # position of the particle below (or the grafting point) and above each moved particle
+        # indexes are clipped to stay in bounds, and the values they select for first/last particles are masked out
+        below_positions = np.where(is_first[:, None], self.graft_positions[chain_idxs], self.particle_positions[replica_idxs, chain_idxs, np.maximum(particle_idxs - 1, 0)])
+        above_particle_idxs = np.minimum(particle_idxs + 1, config.CHAIN_LEN - 1)
+        above_positions = self.particle_positions[replica_idxs, chain_idxs, above_particle_idxs]
+
+        # get the current energies from the energy cache, spring above is 0 for last particles
+        old_spring_above = np.where(is_last, 0.0, self.spring_energies[replica_idxs, chain_idxs, above_particle_idxs])
+        old_spring_below = self.spring_energies[replica_idxs, chain_idxs, particle_idxs]
+        old_surface = self.surface_energies[replica_idxs, chain_idxs, particle_idxs]
+        old_interaction_energy = self.interaction_energies[replica_idxs, chain_idxs, particle_idxs]
+
+        # calculate the new energies with the new particle positions
+        new_spring_above = np.where(is_last, 0.0, interactions.calc_spring_energies(new_positions, above_positions))
+        new_spring_below = interactions.calc_spring_energies(new_positions, below_positions)
+        new_surface = interactions.calc_surface_energies(new_positions[:, 2])
+        ref_flat_idxs = chain_idxs * config.CHAIN_LEN + particle_idxs
+        new_interaction_contributions = interactions.calc_replica_interactions(
+            self.c_ints,
+            self.particle_positions.reshape(self.num_replicas, -1, 3),
+            self.particle_types.reshape(self.num_replicas, -1),
+            ref_flat_idxs,
+            new_positions
+        )
+
+        # calculate the total delta e of each replica
+        delta_e = ((new_spring_above - old_spring_above) +
+            (new_spring_below - old_spring_below) +
+            (new_surface - old_surface) +
+            (np.sum(new_interaction_contributions, axis=1) - old_interaction_energy))
+
+        # store the calculated energies and move information as a pending move
+        self.pending_move = [chain_idxs, particle_idxs, is_last, new_positions, new_spring_above, new_spring_below, new_surface, new_interaction_contributions, delta_e]
+
+        return delta_e
+
+    # method to update the replicas whose recently checked move was accepted
+    # args: self, accepted - 1d boolean array, True for each replica whose move is to be accepted
+    # no return value
+    # stores: new positional and energy information
+    def accept_move(self, accepted):
+        chain_idxs, particle_idxs, is_last, new_positions, new_spring_above, new_spring_below, new_surface, new_interaction_contributions, delta_e = self.pending_move
+
+        # replicas with an accepted move, and the chain, particle and flat index of the particle moved in each
+        replicas = np.flatnonzero(accepted)
+        chains, particles = chain_idxs[replicas], particle_idxs[replicas]
+        ref_flat_idxs = chains * config.CHAIN_LEN + particles
+
+        # Recalculate the interactions the moved particles had at their old positions, before they are overwritten
+        old_interaction_contributions = interactions.calc_replica_interactions(
+            self.c_ints[replicas],
+            self.particle_positions[replicas].reshape(len(replicas), config.NUM_CHAINS * config.CHAIN_LEN, 3),
+            self.particle_types[replicas].reshape(len(replicas), config.NUM_CHAINS * config.CHAIN_LEN),
+            ref_flat_idxs,
+            self.particle_positions[replicas, chains, particles]
+        )
+
+        # Update the near-surface count of replicas whose particle crossed the density boundary, before the old positions are overwritten
+        self.near_surface_count[replicas] += (new_positions[replicas, 2] <= config.DENSITY_CALC_Z_BOUNDARY).astype(np.int64) - (self.particle_positions[replicas, chains, particles, 2] <= config.DENSITY_CALC_Z_BOUNDARY)
+
+        # Update particle positions
+        self.particle_positions[replicas, chains, particles] = new_positions[replicas]
+
+        # Update cached spring and surface energies, spring above only for particles that are not last in their chain
+        has_above = replicas[~is_last[replicas]]
+        self.spring_energies[has_above, chain_idxs[has_above], particle_idxs[has_above] + 1] = new_spring_above[has_above]
+        self.spring_energies[replicas, chains, particles] = new_spring_below[replicas]
+        self.surface_energies[replicas, chains, particles] = new_surface[replicas]
+
+        # Update the interaction energy totals in both directions of the symmetrical interaction
+        # each particle gains its new interaction with the moved particle and loses its old one, the moved particle's own total is replaced.
+        flat_interaction_energies = self.interaction_energies.reshape(self.num_replicas, -1)
+        flat_interaction_energies[replicas] += new_interaction_contributions[replicas] - old_interaction_contributions
+        flat_interaction_energies[replicas, ref_flat_idxs] = np.sum(new_interaction_contributions[replicas], axis=1)
+
+        # Update total system energy of each replica
+        self.total_energy[replicas] += delta_e[replicas]
 
         # Clear the stored pending move
         self.pending_move = None
@@ -0,0 +1,126 @@
+import numpy as np
+from itertools import chain, product
+
+# offsets to the 27 cells made up of a cell and all of its direct neighbours (including diagonals)
+# with a cell size >= the interaction radius, any particle within the radius of a point must be in one of these cells.
+NEIGHBOUR_OFFSETS = tuple(product((-1, 0, 1), repeat=3))
+
+#define class CellList, a spatial index that sorts particles into cubic cells so that only nearby particles need to be checked for interactions
+class CellList:
+
+    # method to initialize an empty cell list
+    # args: self, cell_size - edge length of each cubic cell, must be >= the interaction cutoff (config.R_SIZE)
+    # no return value
+    # stores: cell size and an empty dictionary of cells
+    def __init__(self, cell_size):
+        self.cell_size = cell_size
+
+        # Dictionary mapping integer cell coordinates (cx, cy, cz) to a list of flat particle indices in that cell
+        # flat particle index = chain number * config.CHAIN_LEN + particle in chain
+        # a dictionary is used rather than a fixed grid because particles are not confined to the grafting area, the cell space is unbounded
+        # empty cells are removed, so memory scales with the number of particles rather than the volume of the brush.
+        self.cells = {}
+
+    # method to find the cell that a position falls into
+    # args: self, position - [x,y,z] coordinates
+    # returns: tuple of integer cell coordinates (cx, cy, cz)
+    def cell_of(self, position):
+        # convert to python floats first, python floor division on floats is much faster than on numpy scalars
+        x, y, z = position.tolist()
+        return (int(x // self.cell_size), int(y // self.cell_size), int(z // self.cell_size))
+
+    # method to (re)build the cell list from scratch
+    # args: self, flat_positions - 2d array of shape (number of particles, 3)
+    # no return value
+    # stores: every particle index in the cell containing its position
+    def build(self, flat_positions):
+        self.cells = {}
+
+        # calculate the cell coordinates of all particles at once, shape: (number of particles, 3)
+        cell_coords = np.floor_divide(flat_positions, self.cell_size).astype(np.int64)
+
+        for particle_idx, cell in enumerate(map(tuple, cell_coords.tolist())):
+            self.cells.setdefault(cell, []).append(particle_idx)
+
+    # method to update the cell list after a particle has moved
+    # args: self, particle_idx - flat index of the moved particle, old_position, new_position - [x,y,z] coordinates before and after the move
+    # no return value
+    # stores: the particle index in the cell of its new position
+    def move(self, particle_idx, old_position, new_position):
+        old_cell = self.cell_of(old_position)
+        new_cell = self.cell_of(new_position)
+
+        # most moves stay inside the same cell, nothing to update
+        if old_cell == new_cell:
+            return
+
+        # remove the particle from its old cell, and delete the cell if it is now empty
+        old_members = self.cells[old_cell]
+        old_members.remove(particle_idx)
+        if not old_members:
+            del self.cells[old_cell]
+
+        # add the particle to its new cell
+        self.cells.setdefault(new_cell, []).append(particle_idx)
+
+    # method to get all particles that could be within one cell size of a position
+    # args: self, position - [x,y,z] coordinates
+    # returns: 1d integer array of flat particle indices in the 27 cells around the position (may include particles outside the cutoff)
+    def neighbours(self, position):
+        cx, cy, cz = self.cell_of(position)
+
+        # look up the members of each surrounding cell, missing cells are empty
+        members = [self.cells.get((cx + dx, cy + dy, cz + dz), ()) for dx, dy, dz in NEIGHBOUR_OFFSETS]
+
+        return np.fromiter(chain.from_iterable(members), dtype=np.intp)
+
+    # method to get all particles that could be within one cell size of a position, written into a preallocated buffer
+    # same candidates in the same order as neighbours(), without allocating a new array for every call
+    # args: self, position - [x,y,z] coordinates
+        # out - 1d integer buffer with room for every particle (config.NUM_CHAINS * config.CHAIN_LEN)
+        # exclude - flat index of a particle to leave out, e.g. the particle being moved, -1 to keep all candidates
+    # returns: number of candidates written to the start of out
+    def neighbours_into(self, position, out, exclude=-1):
+        cx, cy, cz = self.cell_of(position)
+        cells = self.cells
+
+        # write the members of the surrounding cells straight into the buffer, one at a time.
+        # building a list or copying each cell with a slice assignment would create a temporary list or array on every call
+        num_neighbours = 0
+        for dx, dy, dz in NEIGHBOUR_OFFSETS:
+            for particle_idx in cells.get((cx + dx, cy + dy, cz + dz), ()):
+                if particle_idx != exclude:
+                    out[num_neighbours] = particle_idx
+                    num_neighbours += 1
+
+        return num_neighbours
+
+    # method to get every particle that could be within one cell size of any of several nearby positions, each particle once
+    # nearby positions share most of their surrounding cells, so each distinct cell is only looked up once, e.g. the trial positions of one particle (see Brush.test_trial_positions)
+    # args: self, positions - 2d array of [x,y,z] coordinates, shape: (number of positions, 3)
+        # exclude - flat index of a particle to leave out, e.g. the particle being moved, -1 to keep all candidates
+    # returns: 1d integer array of flat particle indices in the union of the 27 cells around each position, in no particular order
+    def neighbours_union(self, positions, exclude=-1):
+        centres = {self.cell_of(position) for position in positions}
+        cells = {(cx + dx, cy + dy, cz + dz) for cx, cy, cz in centres for dx, dy, dz in NEIGHBOUR_OFFSETS}
+
+        # every particle is in exactly one cell, so no particle is listed twice
+        members = [particle_idx for cell in cells for particle_idx in self.cells.get(cell, ()) if particle_idx != exclude]
+        return np.array(members, dtype=np.intp)
+
+    # method to get the candidate neighbours of several positions at once, flattened for use in a vectorized kernel
+    # args: self, positions - 2d array of [x,y,z] coordinates, shape: (number of positions, 3)
+    # returns: 
+        # neighbour_indices - 1d integer array of the candidate flat particle indices of all positions, concatenated
+        # segment_ids - 1d integer array the same length as neighbour_indices, giving the row of positions each candidate belongs to
+    def neighbours_batch(self, positions):
+        neighbour_lists = [self.neighbours(position) for position in positions]
+
+        # no positions, return empty arrays rather than failing in np.concatenate
+        if not neighbour_lists:
+            return np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.intp)
+
+        neighbour_indices = np.concatenate(neighbour_lists)
+        segment_ids = np.repeat(np.arange(len(neighbour_lists)), [len(neighbour_list) for neighbour_list in neighbour_lists])
+
+        return neighbour_indices, segment_ids
@@ -0,0 +1,71 @@
+import os
+import pickle
+
+# function to write an object to a file atomically
+# the object is written to a temporary file in the same folder, flushed to disk, then renamed over the target,
+# so a crash during the write leaves either the previous file or the new one, never a partial file.
+# args: path - file to write, obj - any picklable object
+# no return value
+# stores: the pickled object at path
+def atomic_pickle(path, obj):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+
+    temporary_path = f'{path}.tmp'
+    with open(temporary_path, 'wb') as file:
+        pickle.dump(obj, file, protocol=pickle.HIGHEST_PROTOCOL)
+        file.flush()
+        os.fsync(file.fileno())
+
+    # os.replace is atomic on both POSIX and Windows
+    os.replace(temporary_path, path)
+
+# function to read an object written by atomic_pickle
+# args: path - file to read
+# returns: the unpickled object, or None if the file does not exist
+def load_pickle(path):
+    if path is None or not os.path.exists(path):
+        return None
+
+    with open(path, 'rb') as file:
+        return pickle.load(file)
+
+# function to save the full state of a monte carlo run at a save point
+# args: path - checkpoint file, or None to skip checkpointing
+#       save_number - number of completed save intervals
+#       brush - the brush being simulated (pending moves must be cleared, which is always true at a save point)
+#       rng - the run's numpy random number generator, only its bit generator state is stored
+#       densities - density series so far, the first save_number + 1 values are valid
+# no return value
+# stores: a checkpoint dictionary at path
+#   {
+#     "save_number": int,       # number of completed save intervals
+#     "brush": Brush,           # full brush state, including energy caches and cell list
+#     "rng_state": dict,        # rng.bit_generator.state
+#     "densities": np.ndarray   # density series so far
+#   }
+def save_checkpoint(path, save_number, brush, rng, densities):
+    if path is None:
+        return
+
+    atomic_pickle(path, {
+        "save_number": save_number,
+        "brush": brush,
+        "rng_state": rng.bit_generator.state,
+        "densities": densities
+    })
+
+# function to restore a monte carlo run from its last checkpoint, if there is one
+# args: path - checkpoint file, or None
+#       brush - brush object to restore the saved state into (modified in place)
+#       rng - random number generator to restore the saved bit generator state into (modified in place)
+# returns: (save_number, densities) of the checkpoint, or None if there is no checkpoint to resume from
+def resume_checkpoint(path, brush, rng):
+    checkpoint = load_pickle(path)
+    if checkpoint is None:
+        return None
+
+    # restore the brush and rng in place, so callers holding references see the resumed state
+    brush.__dict__.update(checkpoint["brush"].__dict__)
+    rng.bit_generator.state = checkpoint["rng_state"]
+
+    return checkpoint["save_number"], checkpoint["densities"]
@@ -1,3 +1,4 @@
+import os
 import numpy as np 
 
 # Simulation configuration
@@ -6,23 +7,95 @@ BASE_LEN_Y = 10
 NUM_CHAINS = 50
 CHAIN_LEN = 10
 SPRING_START_LENGTH = 1
-PRECISION = np.float64
+PRECISION = np.float64 # storage precision of positions and energy caches. np.float32 halves memory and bandwidth, total energies are always accumulated in float64
+ENERGY_CHECK_INTERVAL = 10 # save points between recalculating the total energy from scratch to catch accumulated error (see Brush.check_energy_drift). 0 disables the check
+ENERGY_DRIFT_TOLERANCE = 1000 # largest allowed difference between the running and recalculated total energy before the energy caches are resynchronised, in multiples of np.finfo(PRECISION).eps times the summed magnitude of the energies, so it suits float64 and float32 alike
 ITERATIONS_BETWEEN_SAVES = 1000
 TIMES_TO_SAVE = 100 # total iterations: 1000 * 100 = 10^5
+DENSITY_SAMPLE_INTERVAL = None # iterations between near-surface density samples, must divide ITERATIONS_BETWEEN_SAVES. None samples once per save interval, whatever ITERATIONS_BETWEEN_SAVES is set to
 STARTING_CONFIGURATIONS = 10
+MONTE_CARLO_ENGINE = 'serial' # 'serial' moves one particle per step, 'checkerboard' moves a batch of independent particles per sub-sweep, vectorized in one process (cores are used by running jobs in parallel)
+BATCH_REPLICAS = False # advance all parameter variants of a configuration together as one brush.BatchedBrush (serial moves, dense interactions). needs CHECKPOINTING and the other per-job options off, see sweep.check_batched_options
+PARALLEL_TEMPERING = False # run the TEMPERATURES ladder of each c_int and type together, with replica exchange between neighbouring temperatures
+SWAP_INTERVAL = 100 # monte carlo steps between replica exchange rounds
+BLOCK_DRAW_RANDOM_NUMBERS = False # draw each save interval's random numbers as whole arrays, faster but a seed then gives different trajectories. False (the default) reproduces the original per-step random stream
+EARLY_REJECTION_TOLERANCE = 1e-9 # relative margin a lower bound on a move's energy change must clear the rejection threshold by before the move is rejected early
 
 # Physical constants
 K_SPRING = 1
 C_INTERACTIONS = [0.5,1]
 TEMPERATURES = [0.5,1,2]
 R_SIZE = 1 
+DOMAIN_SIZE = 2 # edge length of the checkerboard engine's domains, must be > R_SIZE
+CELL_SIZE = R_SIZE # edge length of the cell list used to find interacting particles, must be >= R_SIZE
 SURFACE_INTERACTION_ENERGY = 1e9
 DENSITY_CALC_Z_BOUNDARY = 2
 
 DENSITY_VOLUME = BASE_LEN_Y * BASE_LEN_X * DENSITY_CALC_Z_BOUNDARY
 
 
+# Move size tuning
+ADAPTIVE_MOVE_SIZE = False # tune the maximum move size of each run during burn-in, which changes the moves, densities and acceptance compared with the original runs. if False, moves are always drawn from uniform(-1, 1)
+TUNING_SAVES = 10 # save intervals of burn-in to tune the move size over, the move size is then frozen so detailed balance holds for the rest of the run
+MAX_TUNING_FRACTION = 0.2 # largest fraction of TIMES_TO_SAVE spent tuning, so a short run still has save intervals after burn-in to sample and measure
+TARGET_ACCEPTANCE = 0.4 # acceptance ratio the move size is tuned towards
+MIN_MOVE_SIZE = 0.01 # limits of the tuned move size
+MAX_MOVE_SIZE = DOMAIN_SIZE # larger moves would always leave their checkerboard domain
+
+# Move set
+MOVE_WEIGHTS = {'single': 1} # relative frequency of each move type of the serial engine (see moves.MOVE_TYPES), e.g. {'single': 0.9, 'pivot': 0.04, 'crankshaft': 0.04, 'translation': 0.02}
+CHAIN_MOVE_MAX_ANGLE = 0.5 # largest rotation of a pivot or crankshaft move, in radians
+CHAIN_TRANSLATION_SIZE = 0.5 # largest shift of a whole chain translation, along each of x and y
+MULTIPLE_TRY_TRIALS = 1 # trial positions scored together for every single particle move of the serial engine, above 1 uses multiple-try Metropolis (see monte_carlo.multiple_try_step)
+
+# Equilibration
+TARGET_STANDARD_ERROR = None # stop a run early once its equilibrium density has this standard error (e.g 0.002). None always runs all TIMES_TO_SAVE save intervals
+MIN_SAVES_BEFORE_STOPPING = 20 # save intervals to run before a run may stop early
+GEWEKE_Z_THRESHOLD = 2 # maximum |z| between the start and end of the equilibrated samples for a run to count as converged
+MIN_BLOCKS = 4 # fewest blocks used by the blocking error estimate
+
+
 # Output
 RESULTS_FOLDERNAME = 'results' 
 CSV_FILENAME = f'{RESULTS_FOLDERNAME}/simulation_results.csv'
+RESULTS_STREAM_FILENAME = f'{RESULTS_FOLDERNAME}/simulation_results.jsonl' # every job's result appended as one JSON line as soon as it finishes, read while the sweep runs with results_stream.read_results
+RESULTS_ARRAY_FILENAME = f'{RESULTS_FOLDERNAME}/simulation_results.npz' # every parameter, statistic and density series of the sweep as columns of one file, see results_analysis.load_results
+PLOT_CONFIGURATION_GRAPHS = True # draw a graph for every configuration of every parameter set, as well as the overall graph of each parameter set
+PLOT_PROCESSES = None # processes used to render graphs, None for one per CPU core
+
+# Checkpointing
+CHECKPOINTING = True # checkpoint running jobs and keep finished job results until the sweep finishes, so a restarted sweep skips finished jobs and resumes partial ones
+CHECKPOINT_INTERVAL = 10 # save points between checkpoints
+CHECKPOINT_FOLDERNAME = f'{RESULTS_FOLDERNAME}/checkpoints'
+
+# Result cache
+RESULT_CACHE = False # also keep finished job results after their sweep, keyed by a hash of the job's parameters, the system parameters and the code, so later sweeps reuse them instead of running those jobs. off by default, so a new sweep always runs its jobs
+RESULT_CACHE_FOLDERNAME = f'{RESULTS_FOLDERNAME}/cache'
+RESULT_CACHE_MAX_BYTES = 256 * 2**20 # size limit of the cache, the least recently used results of other sweeps are removed after each sweep
+
+# Trajectories
+SAVE_TRAJECTORIES = False # stream the particle positions at every save point of every job to a memory-mapped .npy file
+TRAJECTORY_FOLDERNAME = f'{RESULTS_FOLDERNAME}/trajectories'
+
+# Worker processes
+WORKER_START_METHOD = None # how start_simulation.py starts worker processes: None for the platform default, 'fork', 'spawn' or 'forkserver'. with 'spawn' and 'forkserver', workers read config.py afresh
+FORKSERVER_PRELOAD = ['src.sweep', 'src.work_queue'] # modules the forkserver imports once before forking workers, so each worker starts with them loaded
+
+# Distributed sweeps
+DISTRIBUTED = False # hand out the sweep's work over TCP to workers on any number of hosts (start_worker.py) instead of a local process pool
+COORDINATOR_HOST = 'localhost' # address the coordinator listens on, '0.0.0.0' to accept workers from other machines
+COORDINATOR_PORT = 6000
+DEFAULT_COORDINATOR_AUTHKEY = b'polymer-brush-monte-carlo' # publicly known key, only accepted by a coordinator listening on the loopback interface
+COORDINATOR_AUTHKEY = os.environ.get('BRUSH_COORDINATOR_AUTHKEY', '').encode() or DEFAULT_COORDINATOR_AUTHKEY # shared secret authenticating workers, set BRUSH_COORDINATOR_AUTHKEY on the coordinator and every worker host to accept remote workers
+LOCAL_WORKERS = None # worker processes the coordinator starts on its own machine, None for one per CPU core, 0 to only use remote workers
+HEARTBEAT_INTERVAL = 5 # seconds between a worker's heartbeats
+WORKER_TIMEOUT = 60 # seconds without a message after which a worker is presumed dead and its work is requeued
+WORKER_CONNECT_TIMEOUT = 60 # seconds a worker keeps retrying to reach the coordinator
+
+# Instrumentation
+INSTRUMENTATION = False # time the phases of every step and count move outcomes, streamed as JSON lines to METRICS_FILENAME. off costs one check per step
+METRICS_FILENAME = f'{RESULTS_FOLDERNAME}/metrics.jsonl'
+
+# Benchmarks
+BENCHMARK_FOLDERNAME = 'benchmarks' # run_benchmarks.py saves its JSON results here, keep a baseline file to compare later runs against
 GRAPH_TITLE = 'Surface Density against Steps'
\ No newline at end of file
@@ -0,0 +1,120 @@
+import numpy as np
+from . import config
+
+# function to find where the equilibrated part of a series starts, using the MSER (marginal standard error rule)
+# for every candidate cut point d, MSER(d) = sum((x_i - mean(x[d:]))^2 for i >= d) / (n - d)^2 is the squared standard error of the mean of x[d:]
+# if the samples were independent. the cut point minimizing it removes the initial transient without throwing away more data than needed.
+# only cut points in the first half of the series are considered, as later minima come from noise in the short tail.
+# args: series - 1d array of samples in time order
+#       min_cut - earliest allowed cut point, e.g. to always discard samples taken while the move size was being tuned
+# returns: index of the first sample of the equilibrated part
+def mser_cut(series, min_cut=0):
+    series = np.asarray(series, dtype=np.float64)
+    n = len(series)
+
+    # always keep at least the last sample
+    min_cut = min(min_cut, n - 1)
+    if n - min_cut < 2:
+        return max(min_cut, 0)
+
+    # sums and sums of squares of every tail x[d:], from cumulative sums of the reversed series
+    tail_sums = np.cumsum(series[::-1])[::-1]
+    tail_square_sums = np.cumsum(series[::-1]**2)[::-1]
+    tail_lengths = np.arange(n, 0, -1)
+
+    # sum of squared deviations of every tail, divided by its length squared
+    deviations = tail_square_sums - tail_sums**2 / tail_lengths
+    mser = deviations / tail_lengths**2
+
+    return min_cut + int(np.argmin(mser[min_cut:max(n // 2, min_cut) + 1]))
+
+# function to estimate the standard error of the mean of a correlated series, using Flyvbjerg-Petersen blocking
+# neighbouring samples are repeatedly averaged in pairs. the naive standard error grows with each blocking level while the blocks are still correlated,
+# and levels off once blocks are longer than the correlation time. the first level whose error is within the statistical uncertainty of the next is taken as the plateau.
+# args: series - 1d array of samples in time order
+# returns: estimated standard error of the mean of the series (0 for fewer than 2 samples)
+def blocking_error(series):
+    blocks = np.asarray(series, dtype=np.float64)
+    if len(blocks) < 2:
+        return 0.0
+
+    # naive standard error, and its own uncertainty, at each blocking level
+    errors = []
+    uncertainties = []
+    while len(blocks) >= config.MIN_BLOCKS:
+        error = np.sqrt(np.var(blocks) / (len(blocks) - 1))
+        errors.append(error)
+        uncertainties.append(error / np.sqrt(2 * (len(blocks) - 1)))
+
+        # average neighbouring pairs, dropping the last sample of odd length series
+        blocks = 0.5 * (blocks[0:len(blocks) - 1:2] + blocks[1::2])
+
+    # too short to block, fall back to the naive standard error
+    if not errors:
+        return float(np.sqrt(np.var(series) / (len(series) - 1)))
+
+    # first level where blocking further does not change the error by more than its uncertainty
+    for level in range(len(errors) - 1):
+        if errors[level + 1] - errors[level] < uncertainties[level]:
+            return float(errors[level])
+
+    # no plateau reached, the largest error is the most conservative estimate
+    return float(max(errors))
+
+# function to compare the start and end of a series, using a Geweke-style z score
+# if the series is stationary, the means of its first 10% and last 50% agree within their standard errors.
+# args: series - 1d array of samples in time order, usually already cut with mser_cut
+# returns: z score of the difference in means (0 if the series is too short to compare)
+def geweke_z(series):
+    series = np.asarray(series, dtype=np.float64)
+    first = series[:len(series) // 10]
+    last = series[len(series) // 2:]
+    if len(first) < 2 or len(last) < 2:
+        return 0.0
+
+    standard_error = np.sqrt(blocking_error(first)**2 + blocking_error(last)**2)
+
+    # identical constant segments agree perfectly, different constant segments disagree completely
+    if standard_error == 0:
+        return 0.0 if np.mean(first) == np.mean(last) else np.inf
+
+    return float((np.mean(first) - np.mean(last)) / standard_error)
+
+# function to analyse the equilibration of a density series
+# args: series - 1d array of density samples in time order, including the initial state
+#       min_cut - earliest allowed cut point (see mser_cut)
+# returns: dictionary
+#   {
+#     "cut_index": int,          # index of the first equilibrated sample (MSER)
+#     "mean": float,             # mean of the equilibrated samples
+#     "variance": float,         # variance of the equilibrated samples
+#     "standard_error": float,   # blocking standard error of the mean of the equilibrated samples
+#     "geweke_z": float          # Geweke z score of the equilibrated samples
+#   }
+def analyze(series, min_cut=0):
+    series = np.asarray(series, dtype=np.float64)
+    cut_index = mser_cut(series, min_cut)
+    equilibrated = series[cut_index:]
+
+    return {
+        "cut_index": cut_index,
+        "mean": float(np.mean(equilibrated)),
+        "variance": float(np.var(equilibrated)),
+        "standard_error": blocking_error(equilibrated),
+        "geweke_z": geweke_z(equilibrated)
+    }
+
+# function to decide whether a running simulation has converged and can stop early
+# a run is converged when the equilibrated part of its density series has a standard error at or below the target,
+# and its start and end agree (|Geweke z| below config.GEWEKE_Z_THRESHOLD).
+# args: series - 1d array of density samples so far, including the initial state
+#       target_error - standard error to reach, or None to never stop early
+#       saves_done - number of save intervals run so far, no decision is made before config.MIN_SAVES_BEFORE_STOPPING
+#       min_cut - earliest allowed cut point (see mser_cut)
+# returns: True if the run can stop
+def is_converged(series, target_error, saves_done, min_cut=0):
+    if target_error is None or saves_done < config.MIN_SAVES_BEFORE_STOPPING:
+        return False
+
+    analysis = analyze(series, min_cut)
+    return analysis["standard_error"] <= target_error and abs(analysis["geweke_z"]) < config.GEWEKE_Z_THRESHOLD
@@ -0,0 +1,183 @@
+import json
+import os
+import threading
+import time
+import numpy as np
+from . import config
+
+# queue that worker processes send their metrics records to, set in each worker by set_metrics_queue. None outside a pool.
+_metrics_queue = None
+
+# function to connect a worker process to the parent's metrics stream, used as the process pool initializer
+# args: queue - multiprocessing queue read by a MetricsCollector in the parent process
+# no return value
+def set_metrics_queue(queue):
+    global _metrics_queue
+    _metrics_queue = queue
+
+# function to send one metrics record to the stream
+# in a worker process the record goes to the parent's MetricsCollector, otherwise it is appended to config.METRICS_FILENAME directly.
+# args: record - JSON serializable dictionary
+# no return value
+def emit(record):
+    line = json.dumps(record)
+    if _metrics_queue is not None:
+        _metrics_queue.put(line)
+    else:
+        os.makedirs(os.path.dirname(config.METRICS_FILENAME) or '.', exist_ok=True)
+        with open(config.METRICS_FILENAME, 'a') as file:
+            file.write(line + '\n')
+
+#define class RunMetrics, which times the phases of every step of one monte carlo run and counts the outcome of every move
+#only created when config.INSTRUMENTATION is enabled, run_monte_carlo skips all timing and counting when it has no RunMetrics.
+#records are emitted as JSON lines at every save point, and a summary at the end of the run:
+#   {"type": "save_point", "job": str, "save_number": int, "steps": int, "steps_per_second": float,
+#    "proposal_seconds": float, "energy_seconds": float, "accept_seconds": float,
+#    "accepted": int, "rejected_surface": int, "rejected_spring": int, "rejected_interaction": int}
+#   {"type": "run", ...same fields totalled over the run..., "save_number" is the last save point}
+class RunMetrics:
+
+    # counters of each record, in the order they are reported
+    COUNTERS = ("steps", "proposal_seconds", "energy_seconds", "accept_seconds", "accepted", "rejected_surface", "rejected_spring", "rejected_interaction")
+
+    # method to initialize empty counters
+    # args: self, job - name of the run, included in every record
+    # no return value
+    # stores: counters for the current save interval and the whole run
+    def __init__(self, job):
+        self.job = job
+        self.interval = dict.fromkeys(self.COUNTERS, 0)
+        self.total = dict.fromkeys(self.COUNTERS, 0)
+        self.interval_start = time.perf_counter()
+        self.last_mark = self.interval_start
+        self.save_number = 0
+
+    # method to start timing a save interval, called before its random numbers are drawn so drawing counts as proposal time
+    # args: self
+    # no return value
+    def start_interval(self):
+        self.interval_start = time.perf_counter()
+        self.last_mark = self.interval_start
+
+    # method to run one Metropolis step with timing and outcome counting, the instrumented equivalent of the step in run_monte_carlo
+    # proposal: from the end of the previous step until the energy evaluation starts (drawing and unpacking the move)
+    # energy: Brush.test_move. accept: the Metropolis test and Brush.accept_move
+    # a rejected move is counted against the surface if it would enter the surface, against the springs if the spring and surface change alone
+    # is above the rejection threshold, and against the interactions otherwise.
+    # args: self, brush, temperature, chain_idx, particle_idx, move_direction, move_magnitude, acceptance_uniform - as in run_monte_carlo
+    #       rejection_threshold - -temperature * ln(acceptance_uniform), see monte_carlo.rejection_threshold
+    # returns: True if the move was accepted
+    def timed_step(self, brush, temperature, chain_idx, particle_idx, move_direction, move_magnitude, acceptance_uniform, rejection_threshold):
+        energy_start = time.perf_counter()
+        delta_e = brush.test_move(chain_idx, particle_idx, move_direction, move_magnitude, rejection_threshold)
+        accept_start = time.perf_counter()
+
+        interval = self.interval
+        accepted = acceptance_uniform < np.exp(-delta_e / temperature)
+        if accepted:
+            brush.accept_move()
+            interval["accepted"] += 1
+        elif brush.move_buffer.new_surface > 0:
+            interval["rejected_surface"] += 1
+        elif brush.move_buffer.local_delta_e >= rejection_threshold:
+            interval["rejected_spring"] += 1
+        else:
+            interval["rejected_interaction"] += 1
+
+        step_end = time.perf_counter()
+        interval["steps"] += 1
+        interval["proposal_seconds"] += energy_start - self.last_mark
+        interval["energy_seconds"] += accept_start - energy_start
+        interval["accept_seconds"] += step_end - accept_start
+        self.last_mark = step_end
+
+        return accepted
+
+    # method to emit the metrics of a finished save interval and add them to the run totals
+    # args: self, save_number - number of completed save intervals
+    # no return value
+    def end_interval(self, save_number):
+        elapsed = time.perf_counter() - self.interval_start
+        self.save_number = save_number
+        emit(self.record("save_point", self.interval, elapsed))
+
+        for counter in self.COUNTERS:
+            self.total[counter] += self.interval[counter]
+            self.interval[counter] = 0
+
+        # the time spent outside steps (saving, checkpointing) is not included in the next proposal time
+        self.last_mark = time.perf_counter()
+
+    # method to emit the summary of the whole run
+    # args: self
+    # returns: the summary record
+    def finish(self):
+        record = self.record("run", self.total, self.total["proposal_seconds"] + self.total["energy_seconds"] + self.total["accept_seconds"])
+        emit(record)
+        return record
+
+    # method to build a record from a set of counters
+    # args: self, record_type - "save_point" or "run", counters - dictionary of COUNTERS, elapsed - wall time the counters cover in seconds
+    # returns: record dictionary (see class description)
+    def record(self, record_type, counters, elapsed):
+        record = {"type": record_type, "job": self.job, "save_number": self.save_number}
+        record.update(counters)
+        record["steps_per_second"] = counters["steps"] / elapsed if elapsed > 0 else 0.0
+        return record
+
+#define class MetricsCollector, which runs in the parent process, writes the metrics stream of all workers to one JSON-lines file and totals the run summaries
+class MetricsCollector:
+
+    # method to start collecting, replacing any metrics file of a previous sweep
+    # args: self, queue - multiprocessing queue the workers emit to (see set_metrics_queue), path - JSON-lines file to write, None for config.METRICS_FILENAME
+    # no return value
+    # stores: the totals of every run summary received, and a background thread reading the queue
+    def __init__(self, queue, path=None):
+        self.queue = queue
+        self.path = config.METRICS_FILENAME if path is None else path
+        self.total = dict.fromkeys(RunMetrics.COUNTERS, 0)
+        self.runs = 0
+
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        self.thread = threading.Thread(target=self.collect, daemon=True)
+        self.thread.start()
+
+    # method run by the background thread, writing every record as it arrives until stop() sends None
+    # args: self
+    # no return value
+    def collect(self):
+        with open(self.path, 'w') as file:
+            for line in iter(self.queue.get, None):
+                file.write(line + '\n')
+                file.flush()
+
+                record = json.loads(line)
+                if record["type"] == "run":
+                    self.runs += 1
+                    for counter in RunMetrics.COUNTERS:
+                        self.total[counter] += record[counter]
+
+    # method to stop collecting once every worker has finished, and wait for the remaining records to be written
+    # args: self
+    # returns: summary dictionary of all runs
+    #   {"runs": int, "steps": int, "steps_per_second": float (per process), "proposal_fraction", "energy_fraction", "accept_fraction": float,
+    #    "acceptance_rate", "rejected_surface_rate", "rejected_spring_rate", "rejected_interaction_rate": float}
+    def stop(self):
+        self.queue.put(None)
+        self.thread.join()
+
+        total = self.total
+        step_seconds = total["proposal_seconds"] + total["energy_seconds"] + total["accept_seconds"]
+        steps = max(total["steps"], 1)
+        return {
+            "runs": self.runs,
+            "steps": total["steps"],
+            "steps_per_second": total["steps"] / step_seconds if step_seconds > 0 else 0.0,
+            "proposal_fraction": total["proposal_seconds"] / step_seconds if step_seconds > 0 else 0.0,
+            "energy_fraction": total["energy_seconds"] / step_seconds if step_seconds > 0 else 0.0,
+            "accept_fraction": total["accept_seconds"] / step_seconds if step_seconds > 0 else 0.0,
+            "acceptance_rate": total["accepted"] / steps,
+            "rejected_surface_rate": total["rejected_surface"] / steps,
+            "rejected_spring_rate": total["rejected_spring"] / steps,
+            "rejected_interaction_rate": total["rejected_interaction"] / steps
+        }
@@ -3,10 +3,16 @@ from . import config
 
 # function to calculate spring energy between two points
 # args: two arrays of co-ordinates [x,y,z]
+    # out: optional array of 3 values to write the separation pos1 - pos2 into, so no temporary array is allocated
 # returns: the calculated spring energy between the two points
-def calc_spring_energy(pos1, pos2):
+def calc_spring_energy(pos1, pos2, out=None):
     # numpy implementation of the spring formula $E_{spring}(ij) = {1\over2} \,k\, d_{ij}^2$
-    spring_energy = 0.5 * config.K_SPRING * (np.linalg.norm(pos1 - pos2))**2
+    if out is None:
+        spring_energy = 0.5 * config.K_SPRING * (np.linalg.norm(pos1 - pos2))**2
+    else:
+        # the squared distance is taken as a dot product of the separation with itself, without the square root and temporaries of np.linalg.norm
+        np.subtract(pos1, pos2, out=out)
+        spring_energy = 0.5 * config.K_SPRING * np.dot(out, out)
     return spring_energy
 
 # function to calculate surface interaction energy
@@ -17,36 +23,220 @@ def calc_surface_energy(z):
     surface_energy = config.SURFACE_INTERACTION_ENERGY if z <= 0 else 0.0
     return surface_energy
 
-# function to calculate the interaction energy between a reference particle and all other particles in the system 
+# function to calculate spring energies between many pairs of points at once
+# args: two arrays of co-ordinates with shape (..., 3), broadcast against each other
+# returns: array of the calculated spring energies with the broadcast shape, without the xyz axis
+def calc_spring_energies(pos1, pos2):
+    # vectorized version of calc_spring_energy, norm taken along the xyz axis
+    spring_energies = 0.5 * config.K_SPRING * (np.linalg.norm(pos1 - pos2, axis=-1))**2
+    return spring_energies
+
+# function to calculate surface interaction energies for many particles at once
+# args: array of z axis position values
+# returns: array of the surface interaction energies, same shape as z
+def calc_surface_energies(z):
+    # vectorized version of calc_surface_energy
+    surface_energies = np.where(z <= 0, config.SURFACE_INTERACTION_ENERGY, 0.0)
+    return surface_energies
+
+#define class InteractionBuffers, preallocated scratch arrays for calc_neighbour_interactions
+#a Brush owns one set and reuses it for every move, so the interaction kernel does not allocate temporary arrays on every call.
+class InteractionBuffers:
+    __slots__ = ('positions', 'distances', 'types', 'outside')
+
+    # method to allocate the scratch arrays
+    # args: self, size - largest number of candidate particles the kernel will be called with
+    # no return value
+    # stores: scratch arrays for candidate positions, distances, types and the outside-radius mask
+    def __init__(self, size):
+        self.positions = np.zeros((size, 3), dtype=config.PRECISION)
+        self.distances = np.zeros(size, dtype=config.PRECISION)
+        self.types = np.zeros(size, dtype=config.PRECISION)
+        self.outside = np.zeros(size, dtype=bool)
+
+# function to calculate the interaction energy between a reference particle and a subset of nearby particles
 # args: 
     # c_int: interaction constant
-    # particle_positions: 3d Numpy array of particle position data: (chain number, particle in chain, xyz coords)
-    # particle_types: 2d array to store type (A/B) for each particle. A = 1, B = -1
-    # ref_chain_idx, ref_particle_idx: chain and particle indexes of the reference particle
+    # flat_positions: 2d Numpy array of particle position data: (chain number * CHAIN_LEN + particle in chain, xyz coords)
+    # flat_types: 1d array of particle types, indexed the same way as flat_positions. A = 1, B = -1
+    # ref_particle_type: type of the reference particle
     # ref_particle_position: [x,y,z] coordinates of the reference particle
-# returns: 2D array of shape (NUM_CHAINS, CHAIN_LEN) containing energy contributions from each particle to the reference particle
-def calc_particle_interactions(c_int, particle_positions, particle_types, ref_chain_idx, ref_particle_idx, ref_particle_position):
-
-    # Get the type (A=1 or B=-1) of the reference particle.
-    ref_particle_type = particle_types[ref_chain_idx, ref_particle_idx]    
-
-    # Initialize array to store energy contributions for each particle
-    # Same shape as particle_types: (NUM_CHAINS, CHAIN_LEN)
-    energy_contributions = np.zeros_like(particle_types, dtype=config.PRECISION)
-    
-    # calculate exact spherical distances between reference particle and the remaining particles
-    # particle_positions shape: (NUM_CHAINS, CHAIN_LEN, 3) where 3 is (x,y,z)
-    # axis=2 tells np.linalg.norm to calculate along the xyz coordinates,
-    # distances shape: (NUM_CHAINS, CHAIN_LEN)
-    distances = np.linalg.norm(particle_positions - ref_particle_position, axis=2)
-    
-    # mask out remaining particles outside interaction radius
-    spherical_mask = distances < config.R_SIZE
-    
-    # calculate the interaction energy between each particle within the interaction sphere and the reference particle
-    energy_contributions[spherical_mask] = (ref_particle_type * particle_types[spherical_mask]) * c_int * np.cos((np.pi/2) * (distances[spherical_mask]/config.R_SIZE))
+    # neighbour_indices: 1d array of flat indices of the candidate particles, must not include the reference particle
+    # out: optional 1d array to write the energy contributions into, at least as long as neighbour_indices
+    # buffers: optional InteractionBuffers at least as long as neighbour_indices, used for all intermediate arrays
+        # with both out and buffers given, the kernel does not allocate any arrays
+# returns: 1d array of energy contributions from each candidate particle to the reference particle, 0 for candidates outside the interaction radius
+    # a view of the first len(neighbour_indices) values of out, if given
+def calc_neighbour_interactions(c_int, flat_positions, flat_types, ref_particle_type, ref_particle_position, neighbour_indices, out=None, buffers=None):
+    num_neighbours = len(neighbour_indices)
+    if buffers is None:
+        buffers = InteractionBuffers(num_neighbours)
+    if out is None:
+        out = np.zeros(num_neighbours, dtype=config.PRECISION)
+    energy_contributions = out[:num_neighbours]
+
+    # calculate exact spherical distances between reference particle and the candidate particles only
+    # every step writes into the scratch arrays in place. the operations are the same as np.linalg.norm(positions - ref, axis=1), so the results are identical
+    # distances shape: (number of candidates,)
+    squared_differences = np.take(flat_positions, neighbour_indices, axis=0, out=buffers.positions[:num_neighbours])
+    np.subtract(squared_differences, ref_particle_position, out=squared_differences)
+    np.multiply(squared_differences, squared_differences, out=squared_differences)
+    distances = np.add.reduce(squared_differences, axis=1, out=buffers.distances[:num_neighbours])
+    np.sqrt(distances, out=distances)
+
+    # candidates come from whole cells, so some are still outside the interaction radius and contribute 0
+    outside = np.greater_equal(distances, config.R_SIZE, out=buffers.outside[:num_neighbours])
+
+    # (ref_particle_type * type) * c_int * cos((pi/2) * (distance/R_SIZE)), evaluated in place in the same order as the original expression
+    np.divide(distances, config.R_SIZE, out=distances)
+    np.multiply(distances, np.pi/2, out=distances)
+    np.cos(distances, out=distances)
+    type_products = np.take(flat_types, neighbour_indices, out=buffers.types[:num_neighbours])
+    np.multiply(type_products, ref_particle_type, out=type_products)
+    np.multiply(type_products, c_int, out=type_products)
+    np.multiply(type_products, distances, out=energy_contributions)
+    np.copyto(energy_contributions, 0.0, where=outside)
+
+    return energy_contributions
+
+
+# function to find every interacting pair of particles and the distance part of its interaction energy
+# the interaction energy of a pair is (type_i * type_j) * c_int * cos((pi/2) * (distance/R_SIZE)). only the cosine depends on the positions,
+# so it is calculated once per geometry and shared by every c_int and type pattern (see calc_pair_interaction_energies).
+# args: 
+    # flat_positions: 2d Numpy array of particle position data: (chain number * CHAIN_LEN + particle in chain, xyz coords)
+    # particle_cell_list: cell_list.CellList of the same positions, used to only check pairs in neighbouring cells
+# returns: (first_idxs, second_idxs, weights)
+    # first_idxs, second_idxs: 1d arrays of the flat indices of each pair within the interaction radius, each pair once with first < second
+    # weights: 1d array of cos((pi/2) * (distance/R_SIZE)) for each pair
+def calc_pair_geometry(flat_positions, particle_cell_list):
+    # candidate neighbours of every particle, in one flattened list
+    neighbour_indices, segment_ids = particle_cell_list.neighbours_batch(flat_positions)
+
+    # keep each unordered pair once, which also removes every particle from its own candidates
+    is_first = segment_ids < neighbour_indices
+    first_idxs, second_idxs = segment_ids[is_first], neighbour_indices[is_first]
+
+    # distances of the candidate pairs, and the pairs inside the interaction radius
+    distances = np.linalg.norm(flat_positions[first_idxs] - flat_positions[second_idxs], axis=1)
+    within = distances < config.R_SIZE
+
+    return first_idxs[within], second_idxs[within], np.cos((np.pi/2) * (distances[within]/config.R_SIZE))
+
+# function to calculate the total interaction energy of every particle from a shared pair geometry
+# args: 
+    # c_int: interaction constant
+    # flat_types: 1d array of particle types, indexed by flat particle index. A = 1, B = -1
+    # pair_geometry: (first_idxs, second_idxs, weights) from calc_pair_geometry
+# returns: 1d array of the sum of the interaction energies of each particle with every other particle, shape: (number of particles,)
+def calc_pair_interaction_energies(c_int, flat_types, pair_geometry):
+    first_idxs, second_idxs, weights = pair_geometry
+
+    # interaction energy of each pair, scaled by the type product and interaction constant of this variant
+    pair_energies = (flat_types[first_idxs] * flat_types[second_idxs]) * c_int * weights
+
+    # every pair contributes its energy to both of its particles
+    return (np.bincount(first_idxs, weights=pair_energies, minlength=len(flat_types)) +
+            np.bincount(second_idxs, weights=pair_energies, minlength=len(flat_types)))
+
+
+# function to calculate the interaction energies between several reference particles and their own subsets of nearby particles, in one vectorized kernel
+# args: 
+    # c_int: interaction constant
+    # flat_positions: 2d Numpy array of particle position data: (chain number * CHAIN_LEN + particle in chain, xyz coords)
+    # flat_types: 1d array of particle types, indexed the same way as flat_positions. A = 1, B = -1
+    # ref_particle_types: 1d array of the types of the reference particles
+    # ref_particle_positions: 2d array of [x,y,z] coordinates of the reference particles, shape: (number of references, 3)
+    # neighbour_indices: 1d array of flat indices of the candidate particles of all references, concatenated
+    # segment_ids: 1d array the same length as neighbour_indices, giving the reference (row of ref_particle_positions) each candidate belongs to
+# returns: 1d array of energy contributions for each (reference, candidate) pair, 0 for candidates outside the interaction radius
+    # use np.bincount(segment_ids, weights=..., minlength=number of references) to get the total for each reference
+def calc_batch_neighbour_interactions(c_int, flat_positions, flat_types, ref_particle_types, ref_particle_positions, neighbour_indices, segment_ids):
+
+    # distance between each candidate and the reference particle it belongs to
+    distances = np.linalg.norm(flat_positions[neighbour_indices] - ref_particle_positions[segment_ids], axis=1)
+
+    energy_contributions = np.where(
+        distances < config.R_SIZE,
+        (ref_particle_types[segment_ids] * flat_types[neighbour_indices]) * c_int * np.cos((np.pi/2) * (distances/config.R_SIZE)),
+        0.0
+    )
+
+    return energy_contributions
+
+
+# function to calculate the interaction energy between one particle placed at each of several trial positions and a shared set of candidate particles
+# used by multiple-try Metropolis (see monte_carlo.multiple_try_step), where every trial position of the moved particle is scored in one broadcast
+# args:
+    # c_int: interaction constant
+    # flat_positions: 2d Numpy array of particle position data: (chain number * CHAIN_LEN + particle in chain, xyz coords)
+    # flat_types: 1d array of particle types, indexed the same way as flat_positions. A = 1, B = -1
+    # ref_particle_type: type of the moved particle
+    # trial_positions: 2d array of [x,y,z] coordinates of the trial positions, shape: (number of trials, 3)
+    # neighbour_indices: 1d array of flat indices of the candidate particles of every trial position, must not include the moved particle
+# returns: 2d array of energy contributions from each candidate to each trial position, shape: (number of trials, number of candidates), 0 outside the interaction radius
+    # row sums give the interaction energy of the particle at each trial position
+def calc_trial_interactions(c_int, flat_positions, flat_types, ref_particle_type, trial_positions, neighbour_indices):
+    # distance between every trial position and every candidate, by broadcasting the trials against the candidates, shape: (number of trials, number of candidates)
+    # einsum sums the squared xyz differences without the overhead of np.linalg.norm on a 3d array
+    differences = flat_positions[neighbour_indices][None, :, :] - trial_positions[:, None, :]
+    distances = np.sqrt(np.einsum('tnk,tnk->tn', differences, differences))
+
+    energy_contributions = np.where(
+        distances < config.R_SIZE,
+        (ref_particle_type * flat_types[neighbour_indices]) * c_int * np.cos((np.pi/2) * (distances/config.R_SIZE)),
+        0.0
+    )
+
+    return energy_contributions
+
+
+# function to calculate the interaction energies between every pair of particles in a small group, e.g. the particles of a chain segment moved together
+# args: 
+    # c_int: interaction constant
+    # positions: 2d array of [x,y,z] coordinates of the group, shape: (number of particles, 3)
+    # types: 1d array of the types of the group. A = 1, B = -1
+# returns: 2d array of the interaction energy of each pair, shape: (number of particles, number of particles). 0 on the diagonal and for pairs outside the interaction radius
+    # row sums give each particle's interactions within the group, and half the total sum is the group's internal interaction energy
+def calc_group_interactions(c_int, positions, types):
+    # distance between every pair of the group, by broadcasting the positions against themselves
+    distances = np.linalg.norm(positions[:, None, :] - positions[None, :, :], axis=2)
+
+    pair_energies = np.where(
+        distances < config.R_SIZE,
+        np.outer(types, types) * c_int * np.cos((np.pi/2) * (distances/config.R_SIZE)),
+        0.0
+    )
+
+    # Zero out self-interaction
+    np.fill_diagonal(pair_energies, 0.0)
+
+    return pair_energies
+
+
+# function to calculate the interaction energy between one reference particle per replica and every other particle in the same replica
+# args: 
+    # c_ints: 1d array of the interaction constant of each replica, shape: (number of replicas,)
+    # flat_positions: 3d Numpy array of particle position data: (replica, chain number * CHAIN_LEN + particle in chain, xyz coords)
+    # flat_types: 2d array of particle types: (replica, chain number * CHAIN_LEN + particle in chain). A = 1, B = -1
+    # ref_flat_idxs: 1d array of the flat index of the reference particle in each replica
+    # ref_particle_positions: 2d array of [x,y,z] coordinates of the reference particle in each replica, shape: (number of replicas, 3)
+# returns: 2d array of shape (number of replicas, NUM_CHAINS * CHAIN_LEN) containing energy contributions from each particle to the reference particle of its replica
+def calc_replica_interactions(c_ints, flat_positions, flat_types, ref_flat_idxs, ref_particle_positions):
+    replica_idxs = np.arange(len(ref_flat_idxs))
+
+    # distances between the reference particle and all particles of each replica, shape: (number of replicas, NUM_CHAINS * CHAIN_LEN)
+    # einsum sums the squared xyz differences without the overhead of np.linalg.norm on a 3d array
+    differences = flat_positions - ref_particle_positions[:, None, :]
+    distances = np.sqrt(np.einsum('rnk,rnk->rn', differences, differences))
+
+    # only evaluate the cosine for the few particles inside the interaction radius
+    replica_mask, particle_mask = np.nonzero(distances < config.R_SIZE)
+    ref_particle_types = flat_types[replica_idxs, ref_flat_idxs]
+    energy_contributions = np.zeros(distances.shape, dtype=config.PRECISION)
+    energy_contributions[replica_mask, particle_mask] = (ref_particle_types[replica_mask] * flat_types[replica_mask, particle_mask]) * c_ints[replica_mask] * np.cos((np.pi/2) * (distances[replica_mask, particle_mask]/config.R_SIZE))
 
     # Zero out self-interaction
-    energy_contributions[ref_chain_idx, ref_particle_idx] = 0
-    
+    energy_contributions[replica_idxs, ref_flat_idxs] = 0
+
     return energy_contributions
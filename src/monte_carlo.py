@@ -1,50 +1,624 @@
+import math
 import numpy as np
 from . import config
+from . import checkpoint
+from . import trajectory
+from . import equilibration
+from . import moves
+
+# function to get the configured number of steps between density samples
+# read at call time, so it follows ITERATIONS_BETWEEN_SAVES when that is changed at runtime
+# no args
+# returns: config.DENSITY_SAMPLE_INTERVAL, or config.ITERATIONS_BETWEEN_SAVES if it is None
+def density_sample_interval():
+    return config.ITERATIONS_BETWEEN_SAVES if config.DENSITY_SAMPLE_INTERVAL is None else config.DENSITY_SAMPLE_INTERVAL
 
 # function to put a brush through a single monte carlo simulation (i.e 10^5 iterations)
 # args: class brush that has been pre-initialized,
         # temperature for this run.
         # seeded random number generator
-# return: 1d array of densities calculated at every config.ITERATIONS_BETWEEN_SAVES iterations (i.e 1000 iterations)
-def run_monte_carlo(brush, temperature, rng):
-    # initialize array to store particle positions at save points
-    # config.TIMES_TO_SAVE + 1, to include the original state of the brush
-    # shape: (number of save_points, number of chains, number of particles per chain, xyz_coords)
-    saved_positions = np.zeros((config.TIMES_TO_SAVE + 1, 
-                              config.NUM_CHAINS,
-                              config.CHAIN_LEN,
-                              3), dtype=config.PRECISION)
-    
-    # Save the initial particle positions
-    saved_positions[0] = brush.particle_positions
+        # block_draw: if True, draw all random numbers for each save interval as whole arrays up front (see reproducibility below)
+        # every setting below defaulting to None is read from config when the run starts (block_draw: config.BLOCK_DRAW_RANDOM_NUMBERS, and so on),
+            # so changes made to config at runtime, e.g. by run_benchmarks.py, are used by the run and match the result's cache key.
+        # checkpoint_path: file to checkpoint the run to every config.CHECKPOINT_INTERVAL save points, or None to disable.
+            # if the file already exists, the brush and rng are restored from it and the run continues from its save point.
+        # trajectory_path: .npy file to stream the particle positions at every save point into, or None to not keep frames
+        # sample_interval: number of steps between density samples, must divide config.ITERATIONS_BETWEEN_SAVES. None for density_sample_interval()
+            # the density is read from the brush's running near-surface count, so sampling at every step costs no more than at every save point.
+        # target_error: standard error of the equilibrium density to stop at (see equilibration.is_converged), None for config.TARGET_STANDARD_ERROR, which is None to always run every save interval
+        # adaptive_move_size: if True, tune brush.move_size over the first config.TUNING_SAVES save intervals (see tuning_saves), then freeze it (see tune_move_size). None for config.ADAPTIVE_MOVE_SIZE
+            # samples taken while tuning are never counted as equilibrated, so detailed balance holds for every sample used.
+        # metrics: instrumentation.RunMetrics to time every step and count move outcomes, or None to run without instrumentation
+        # move_weights: relative frequency of each move type (see moves.MOVE_TYPES), None for config.MOVE_WEIGHTS. steps that make a collective chain move are not timed by metrics.
+        # multiple_tries: number of trial positions of every single particle move, above 1 the move is made with multiple-try Metropolis (see multiple_try_step)
+            # and is not timed by metrics. 1 makes the ordinary single trial Metropolis move. None for config.MULTIPLE_TRY_TRIALS
+# return: 1d array of densities sampled at every sample_interval iterations, including the initial state (i.e 1 + 10^5 / sample_interval values)
+    # a run that stops early returns only the samples up to the save point it stopped at
+#
+# reproducibility:
+#   the same rng seed always gives an identical trajectory within the same block_draw mode, but the two modes consume the random stream in a different order,
+#   so trajectories from block_draw=True and block_draw=False are not comparable step for step.
+#   block_draw=False: each step draws chain, particle, direction, magnitude, acceptance uniform, in that order (the original per-step stream).
+#   block_draw=True: each save interval draws config.ITERATIONS_BETWEEN_SAVES chains, then particles, then directions, then magnitudes, then acceptance uniforms.
+#   block draws depend only on config.ITERATIONS_BETWEEN_SAVES, not on the outcome of any move, so the stream consumed per save interval is fixed.
+#   checkpoints are taken at save points and hold the full brush and rng bit generator state, so a resumed run is bit-for-bit identical to an uninterrupted one.
+#   the density sample interval does not consume random numbers, so it does not change the trajectory.
+#   with adaptive_move_size=False and brush.move_size = 1, moves are drawn from uniform(-1, 1) exactly as in the original stream.
+#   with collective chain moves in move_weights, the move types of a save interval are drawn first, and each chain move draws its own random numbers when it is made.
+#   with only single particle moves, no move types are drawn and the stream is unchanged.
+#   with multiple_tries above 1, the drawn direction and magnitude are the first trial, and each multiple-try move draws its other trial and reference moves when it is made.
+def run_monte_carlo(brush, temperature, rng, block_draw=None, checkpoint_path=None, trajectory_path=None, sample_interval=None, target_error=None, adaptive_move_size=None, metrics=None, move_weights=None, multiple_tries=None):
+    block_draw = config.BLOCK_DRAW_RANDOM_NUMBERS if block_draw is None else block_draw
+    sample_interval = density_sample_interval() if sample_interval is None else sample_interval
+    target_error = config.TARGET_STANDARD_ERROR if target_error is None else target_error
+    adaptive_move_size = config.ADAPTIVE_MOVE_SIZE if adaptive_move_size is None else adaptive_move_size
+    move_weights = config.MOVE_WEIGHTS if move_weights is None else move_weights
+    multiple_tries = config.MULTIPLE_TRY_TRIALS if multiple_tries is None else multiple_tries
+
+    samples_per_save = samples_per_save_interval(sample_interval)
+
+    # samples taken while the move size is being tuned, excluded from the equilibrated part of the run
+    tuning_samples = tuning_steps(adaptive_move_size) // sample_interval
+
+    # initialize array to store the density at each sample point
+    # +1 to include the original state of the brush
+    densities = np.zeros(config.TIMES_TO_SAVE * samples_per_save + 1)
+    densities[0] = brush.near_surface_count / config.DENSITY_VOLUME
+    first_save = 0
+
+    # continue from the last checkpoint if there is one
+    resumed = checkpoint.resume_checkpoint(checkpoint_path, brush, rng)
+    if resumed is not None:
+        first_save, densities = resumed
+
+    # open the trajectory file, continuing the existing one when resuming
+    writer = start_trajectory(trajectory_path, brush, resumed is not None)
     
-    # monte carlo simulation runs for 1000 steps on the inner loop, escapes to the outer loop to save current positions in saved_positions, then goes back into the inner loop.
+    # monte carlo simulation runs for 1000 steps on the inner loop, escapes to the outer loop to handle the save point, then goes back into the inner loop.
+    for save_number in range(first_save, config.TIMES_TO_SAVE):
+        # index in densities of the last sample before this save interval
+        sample_offset = save_number * samples_per_save
+
+        # count accepted single particle moves in this save interval, for move size tuning and acceptance statistics
+        accepted_moves = 0
+
+        if metrics is not None:
+            metrics.start_interval()
+
+        # move type of every step, None if every step is a single particle move
+        move_types = moves.draw_move_types(rng, move_weights)
+        chain_moves = 0 if move_types is None else sum(move_type != 0 for move_type in move_types)
+
+        for iteration, (chain_idx, particle_idx, move_direction, move_magnitude, acceptance_uniform) in enumerate(draw_save_interval(rng, block_draw, brush.move_size), start=1):
+            # a collective chain move replaces the single particle move drawn for this step, which is skipped
+            if move_types is not None and move_types[iteration - 1] != 0:
+                chain_move_step(brush, moves.MOVE_TYPES[move_types[iteration - 1]], temperature, rng, acceptance_uniform)
+
+            elif multiple_tries > 1:
+                if multiple_try_step(brush, chain_idx, particle_idx, move_direction, move_magnitude, temperature, rng, acceptance_uniform, multiple_tries):
+                    accepted_moves += 1
+
+            elif metrics is None:
+                # Calculate energy difference for proposed move, stopping early if the move cannot be accepted with this acceptance uniform
+                delta_e = brush.test_move(chain_idx, particle_idx, move_direction, move_magnitude, rejection_threshold(acceptance_uniform, temperature))
+
+                # calculate the acceptance criteria, the same test with or without early rejection (early rejected moves return inf)
+                if acceptance_uniform < np.exp(-delta_e / temperature):
+                    brush.accept_move()
+                    accepted_moves += 1
+
+            # the same step, timed and with its outcome counted
+            elif metrics.timed_step(brush, temperature, chain_idx, particle_idx, move_direction, move_magnitude, acceptance_uniform, rejection_threshold(acceptance_uniform, temperature)):
+                accepted_moves += 1
+
+            # sample the near-surface density from the running count
+            if iteration % sample_interval == 0:
+                densities[sample_offset + iteration // sample_interval] = brush.near_surface_count / config.DENSITY_VOLUME
+
+        # tune the move size during burn-in, or record the acceptance statistics once it is frozen
+        update_move_statistics(brush, save_number, config.ITERATIONS_BETWEEN_SAVES - chain_moves, accepted_moves, adaptive_move_size)
+
+        if metrics is not None:
+            metrics.end_interval(save_number + 1)
+
+        # stream the positions at this save point to the trajectory file
+        if writer is not None:
+            writer.write(save_number + 1, brush.particle_positions)
+
+        # recalculate the energy from scratch every config.ENERGY_CHECK_INTERVAL save points, correcting the caches if they have drifted
+        if config.ENERGY_CHECK_INTERVAL and (save_number + 1) % config.ENERGY_CHECK_INTERVAL == 0:
+            brush.check_energy_drift()
+
+        # checkpoint the run every config.CHECKPOINT_INTERVAL save points, flushing the trajectory first so it is consistent with the checkpoint
+        if (save_number + 1) % config.CHECKPOINT_INTERVAL == 0:
+            if writer is not None:
+                writer.flush()
+            checkpoint.save_checkpoint(checkpoint_path, save_number + 1, brush, rng, densities)
+
+        # stop early once the equilibrium density is known well enough, dropping the samples that were never taken
+        if equilibration.is_converged(densities[:sample_offset + samples_per_save + 1], target_error, save_number + 1, tuning_samples):
+            densities = densities[:sample_offset + samples_per_save + 1]
+            break
+
+    # a run that stopped early keeps only the frames of the save points it reached
+    if writer is not None:
+        writer.close((len(densities) - 1) // samples_per_save + 1)
+
+    if metrics is not None:
+        metrics.finish()
+
+    return densities
+
+# function to draw the random numbers of every step of one save interval
+# args: seeded random number generator, block_draw - see run_monte_carlo, move_size - maximum move magnitude
+# returns: iterable of (chain_idx, particle_idx, move_direction, move_magnitude, acceptance_uniform) for each of the config.ITERATIONS_BETWEEN_SAVES steps
+def draw_save_interval(rng, block_draw, move_size=1.0):
+    if block_draw:
+        # draw every proposal and acceptance uniform for this save interval as whole arrays.
+        # one numpy call per quantity instead of five calls per step removes most of the per-step python overhead.
+        # .tolist() converts to python scalars, which are faster to index and compare with than numpy scalars.
+        chain_idxs = rng.integers(0, config.NUM_CHAINS, size=config.ITERATIONS_BETWEEN_SAVES).tolist()
+        particle_idxs = rng.integers(0, config.CHAIN_LEN, size=config.ITERATIONS_BETWEEN_SAVES).tolist()
+        move_directions = rng.integers(0, 3, size=config.ITERATIONS_BETWEEN_SAVES).tolist()
+        move_magnitudes = rng.uniform(-move_size, move_size, size=config.ITERATIONS_BETWEEN_SAVES).tolist()
+        acceptance_uniforms = rng.random(size=config.ITERATIONS_BETWEEN_SAVES).tolist()
+
+        return zip(chain_idxs, particle_idxs, move_directions, move_magnitudes, acceptance_uniforms)
+
+    return draw_steps(rng, move_size)
+
+# generator drawing the random numbers of one save interval one step at a time, in the original per-step order
+# the acceptance uniform is drawn last, as it always was. no other random numbers are drawn between steps, so drawing it before the energy is computed does not change the stream.
+# args: seeded random number generator, move_size - maximum move magnitude
+# yields: (chain_idx, particle_idx, move_direction, move_magnitude, acceptance_uniform) for each of the config.ITERATIONS_BETWEEN_SAVES steps
+def draw_steps(rng, move_size=1.0):
+    for iteration in range(config.ITERATIONS_BETWEEN_SAVES):
+        # randomly select a chain and particle.
+        chain_idx = rng.integers(0, config.NUM_CHAINS)
+        particle_idx = rng.integers(0, config.CHAIN_LEN)
+        
+        # generate a random move direction and magnitude.
+        move_direction = rng.integers(0, 3)  # x, y, or z
+        move_magnitude = rng.uniform(-move_size, move_size)
+
+        yield chain_idx, particle_idx, move_direction, move_magnitude, rng.random()
+
+# function to make one collective chain move: propose it, calculate its energy change and apply the Metropolis test
+# args: brush, move_type - key of moves.PROPOSALS, temperature - temperature of the run
+#       rng - seeded random number generator, used to draw the move, acceptance_uniform - uniform random number drawn for this step
+# returns: True if the move was accepted
+# stores: the outcome in brush.chain_move_statistics
+def chain_move_step(brush, move_type, temperature, rng, acceptance_uniform):
+    proposal = moves.PROPOSALS[move_type](brush, rng)
+
+    # a move that cannot be made on this chain counts as rejected
+    accepted = False
+    if proposal is not None:
+        chain_idx, first_idx, new_positions = proposal
+        delta_e = brush.test_segment_move(chain_idx, first_idx, new_positions, rejection_threshold(acceptance_uniform, temperature))
+        if acceptance_uniform < np.exp(-delta_e / temperature):
+            brush.accept_segment_move()
+            accepted = True
+
+    moves.record_chain_move(brush, move_type, accepted)
+    return accepted
+
+# function to make one single particle move with multiple-try Metropolis (Liu, Liang & Wong 2000)
+# num_trials trial positions are drawn from the usual symmetric single axis proposal and one is chosen with probability proportional to its Boltzmann weight.
+# num_trials - 1 reference positions are then drawn from the same proposal around the chosen position, and together with the current position
+# they weight the reverse move. accepting with min(1, sum of trial weights / sum of reference weights) keeps detailed balance.
+# all trials are scored in one call to Brush.test_trial_positions, and all references in a second, so the numpy overhead of a step is shared by its trials,
+# and choosing among several trials makes an accepted move more likely at low temperature, where most single trials are rejected.
+# args: brush, chain_idx, particle_idx - particle to move, move_direction, move_magnitude - the first trial, drawn with the step
+#       temperature - temperature of the run, rng - seeded random number generator, used to draw the other trial and reference moves and to choose a trial
+#       acceptance_uniform - uniform random number drawn for this step, num_trials - number of trial positions
+# returns: True if the move was accepted
+def multiple_try_step(brush, chain_idx, particle_idx, move_direction, move_magnitude, temperature, rng, acceptance_uniform, num_trials):
+    position = brush.particle_positions[chain_idx, particle_idx]
+
+    # every move of the step is drawn up front: the step's own move, the other num_trials - 1 trial moves, then num_trials - 1 reference moves.
+    # the reference moves do not depend on which trial is chosen, so they are drawn with the trials and only applied from the chosen position
+    move_directions = np.concatenate(([move_direction], rng.integers(0, 3, size=2 * (num_trials - 1))))
+    move_magnitudes = np.concatenate(([move_magnitude], rng.uniform(-brush.move_size, brush.move_size, size=2 * (num_trials - 1))))
+    trial_positions = displaced_positions(position, move_directions[:num_trials], move_magnitudes[:num_trials])
+
+    # log Boltzmann weights relative to the current state
+    trial_log_weights = -brush.test_trial_positions(chain_idx, particle_idx, trial_positions) / temperature
+
+    # the trial is chosen by inverting the cumulative weights with one uniform, which is much cheaper than rng.choice for a handful of trials
+    # weights are normalized with the largest, so the weights of moves into the surface underflow to 0 instead of overflowing
+    cumulative_weights = np.cumsum(np.exp(trial_log_weights - np.max(trial_log_weights)))
+    chosen = min(int(np.searchsorted(cumulative_weights, rng.random() * cumulative_weights[-1], side='right')), num_trials - 1)
+
+    # reference positions around the chosen trial, the current position (log weight 0) completes the reverse trial set
+    reference_positions = displaced_positions(trial_positions[chosen], move_directions[num_trials:], move_magnitudes[num_trials:])
+    reference_log_weights = np.append(-brush.test_trial_positions(chain_idx, particle_idx, reference_positions) / temperature, 0.0)
+
+    # acceptance ratio in log space, limited to 1 so exp cannot overflow
+    log_acceptance = np.logaddexp.reduce(trial_log_weights) - np.logaddexp.reduce(reference_log_weights)
+    if acceptance_uniform >= math.exp(min(log_acceptance, 0.0)):
+        return False
+
+    # apply the chosen trial through the ordinary move, which updates the energy caches, cell list and near-surface count
+    brush.test_move(chain_idx, particle_idx, int(move_directions[chosen]), float(move_magnitudes[chosen]))
+    brush.accept_move()
+    return True
+
+# function to move a position along a single axis once for each of several moves
+# args: position - [x,y,z] coordinates, move_directions - 1d integer array of the axis of each move, move_magnitudes - 1d array of the magnitude of each move
+# returns: 2d array of the moved positions, shape: (number of moves, 3)
+def displaced_positions(position, move_directions, move_magnitudes):
+    positions = np.empty((len(move_directions), 3), dtype=position.dtype)
+    positions[:] = position
+    positions[np.arange(len(move_directions)), move_directions] += move_magnitudes
+    return positions
+
+# function to convert an acceptance uniform into the largest energy change a move can be accepted with
+# the Metropolis test u < exp(-delta_e / T) accepts exactly the moves with delta_e < -T * ln(u), so any move whose energy change is
+# known to be above this threshold can be rejected before its full energy is calculated (see brush.Brush.test_move).
+# args: acceptance_uniform - uniform random number in [0, 1) drawn for the move, temperature - temperature of the run
+# returns: -temperature * ln(acceptance_uniform), inf for a uniform of 0 (every move with a finite energy change is accepted)
+def rejection_threshold(acceptance_uniform, temperature):
+    if acceptance_uniform <= 0:
+        return math.inf
+    return -temperature * math.log(acceptance_uniform)
+
+# function to get the number of density samples in each save interval
+# args: sample_interval - number of steps between density samples
+# returns: config.ITERATIONS_BETWEEN_SAVES // sample_interval
+def samples_per_save_interval(sample_interval):
+    if sample_interval <= 0 or config.ITERATIONS_BETWEEN_SAVES % sample_interval != 0:
+        raise ValueError(f"density sample interval ({sample_interval}) must divide config.ITERATIONS_BETWEEN_SAVES ({config.ITERATIONS_BETWEEN_SAVES})")
+    return config.ITERATIONS_BETWEEN_SAVES // sample_interval
+
+# function to get the number of save intervals spent tuning the move size at the start of a run
+# capped at config.MAX_TUNING_FRACTION of the run, so a run of few save intervals is never all burn-in
+# args: adaptive_move_size - whether the run tunes its move size
+# returns: config.TUNING_SAVES, at most config.MAX_TUNING_FRACTION * config.TIMES_TO_SAVE, or 0 without tuning
+def tuning_saves(adaptive_move_size):
+    return min(config.TUNING_SAVES, int(config.MAX_TUNING_FRACTION * config.TIMES_TO_SAVE)) if adaptive_move_size else 0
+
+# function to get the number of steps spent tuning the move size at the start of a run
+# args: adaptive_move_size - whether the run tunes its move size
+# returns: tuning_saves * config.ITERATIONS_BETWEEN_SAVES
+def tuning_steps(adaptive_move_size):
+    return tuning_saves(adaptive_move_size) * config.ITERATIONS_BETWEEN_SAVES
+
+# function to scale the maximum move size towards the target acceptance ratio
+# too many rejections mean moves are too large, too many acceptances mean moves are too small to decorrelate quickly.
+# the size is scaled by acceptance_rate / config.TARGET_ACCEPTANCE, limited to halving or doubling per save interval so noisy rates do not overshoot.
+# args: move_size - current maximum move magnitude, acceptance_rate - fraction of moves accepted with it
+# returns: new move size, within [config.MIN_MOVE_SIZE, config.MAX_MOVE_SIZE]
+def tune_move_size(move_size, acceptance_rate):
+    scale = np.clip(acceptance_rate / config.TARGET_ACCEPTANCE, 0.5, 2.0)
+    return float(np.clip(move_size * scale, config.MIN_MOVE_SIZE, config.MAX_MOVE_SIZE))
+
+# function to update the move size and acceptance statistics of a brush at the end of a save interval
+# during the first tuning_saves save intervals of an adaptive run the move size is tuned, afterwards it is frozen and the moves are counted.
+# args: brush, save_number - index of the save interval that just finished
+#       proposed_moves, accepted_moves - moves proposed and accepted in that save interval
+#       adaptive_move_size - whether the run tunes its move size
+# no return value
+# stores: brush.move_size while tuning, brush.proposed_moves and brush.accepted_moves afterwards
+def update_move_statistics(brush, save_number, proposed_moves, accepted_moves, adaptive_move_size):
+    if save_number < tuning_saves(adaptive_move_size):
+        brush.move_size = tune_move_size(brush.move_size, accepted_moves / max(proposed_moves, 1))
+    else:
+        brush.proposed_moves += proposed_moves
+        brush.accepted_moves += accepted_moves
+
+# function to report the move and energy statistics of a finished run
+# args: brush - the brush after the run, adaptive_move_size - whether the run tuned its move size, None for config.ADAPTIVE_MOVE_SIZE
+# returns: dictionary
+#   {
+#     "move_size": float,          # maximum move magnitude used after tuning
+#     "acceptance_rate": float or None, # fraction of moves accepted after tuning, None if the run stopped before any moves were counted
+#     "tuning_steps": int,         # steps spent tuning at the start of the run
+#     "max_energy_drift": float,   # largest difference found between the running and recalculated total energy
+#     "chain_move_acceptance": dict # acceptance rate of each collective chain move type proposed (see moves.chain_move_acceptance_rates)
+#   }
+def run_statistics(brush, adaptive_move_size=None):
+    adaptive_move_size = config.ADAPTIVE_MOVE_SIZE if adaptive_move_size is None else adaptive_move_size
+
+    return {
+        "move_size": brush.move_size,
+        "acceptance_rate": brush.accepted_moves / brush.proposed_moves if brush.proposed_moves else None,
+        "tuning_steps": tuning_steps(adaptive_move_size),
+        "max_energy_drift": brush.max_energy_drift,
+        "chain_move_acceptance": moves.chain_move_acceptance_rates(brush)
+    }
+
+# function to open the trajectory file of a run
+# args: trajectory_path - .npy file, or None to not keep frames
+#       brush - the brush being simulated, its current positions are written as the first frame of a new file
+#       resume - True if the run is resuming from a checkpoint and should continue the existing file
+# returns: trajectory.TrajectoryWriter, or None if trajectory_path is None
+def start_trajectory(trajectory_path, brush, resume):
+    if trajectory_path is None:
+        return None
+
+    writer = trajectory.TrajectoryWriter(trajectory_path, config.TIMES_TO_SAVE + 1, resume=resume)
+    if not resume:
+        writer.write(0, brush.particle_positions)
+
+    return writer
+
+# function to put a brush through a single monte carlo simulation using the checkerboard domain-decomposed engine
+# the x-y plane is split into square domains of side config.DOMAIN_SIZE (> config.R_SIZE), coloured in a 2x2 checkerboard.
+# each sub-sweep:
+    # 1. shifts the domain grid by a random offset, so domain boundaries are not fixed in space.
+    # 2. picks one of the 4 colours at random. domains of the same colour are separated by at least one whole domain, so are more than config.R_SIZE apart.
+    # 3. picks one particle uniformly from each domain of that colour, keeping at most one particle per chain so no two moved particles share a spring.
+    # 4. proposes a single axis move for every picked particle. moves that would leave their domain are rejected.
+    # 5. accepts or rejects all moves at once with vectorized Metropolis criteria.
+# particles that stay inside their own domain can never interact with a particle moving in another domain, so the moves are independent
+# and each one is an ordinary Metropolis move with a symmetric proposal: detailed balance holds for every sub-sweep.
+# the batch of a sub-sweep is evaluated with vectorized array operations in this process. it is not split across worker processes,
+# a sub-sweep moves about one particle per active domain, far too little work to pay for sending it to another process.
+# args: class brush that has been pre-initialized,
+        # temperature for this run.
+        # seeded random number generator
+        # checkpoint_path: file to checkpoint the run to, or None to disable (see run_monte_carlo)
+        # trajectory_path: .npy file to stream the particle positions at every save point into, or None to not keep frames
+        # sample_interval: number of proposed moves between density samples, must divide config.ITERATIONS_BETWEEN_SAVES
+        # target_error: standard error of the equilibrium density to stop at (see run_monte_carlo)
+        # adaptive_move_size: if True, tune brush.move_size during burn-in, then freeze it (see run_monte_carlo)
+        # sample_interval, target_error and adaptive_move_size are read from config when None, as in run_monte_carlo
+# return: 1d array of densities sampled after every sample_interval proposed moves, including the initial state, up to the save point the run stopped at
+    # moves are proposed in whole sub-sweeps, so a sample is taken at the end of the first sub-sweep that reaches each multiple of sample_interval
+def run_checkerboard_monte_carlo(brush, temperature, rng, checkpoint_path=None, trajectory_path=None, sample_interval=None, target_error=None, adaptive_move_size=None):
+    sample_interval = density_sample_interval() if sample_interval is None else sample_interval
+    target_error = config.TARGET_STANDARD_ERROR if target_error is None else target_error
+    adaptive_move_size = config.ADAPTIVE_MOVE_SIZE if adaptive_move_size is None else adaptive_move_size
+
+    if config.DOMAIN_SIZE <= config.R_SIZE:
+        raise ValueError(f"config.DOMAIN_SIZE ({config.DOMAIN_SIZE}) must be greater than config.R_SIZE ({config.R_SIZE})")
+
+    samples_per_save = samples_per_save_interval(sample_interval)
+
+    # samples taken while the move size is being tuned, excluded from the equilibrated part of the run
+    tuning_samples = tuning_steps(adaptive_move_size) // sample_interval
+
+    # initialize array to store the density at each sample point, +1 to include the original state of the brush
+    densities = np.zeros(config.TIMES_TO_SAVE * samples_per_save + 1)
+    densities[0] = brush.near_surface_count / config.DENSITY_VOLUME
+    first_save = 0
+
+    # continue from the last checkpoint if there is one
+    resumed = checkpoint.resume_checkpoint(checkpoint_path, brush, rng)
+    if resumed is not None:
+        first_save, densities = resumed
+
+    # open the trajectory file, continuing the existing one when resuming
+    writer = start_trajectory(trajectory_path, brush, resumed is not None)
+
+    # flattened view of the particle positions, and the chain index of every particle
+    flat_positions = brush.particle_positions.reshape(-1, 3)
+    flat_chain_idxs = np.arange(len(flat_positions)) // config.CHAIN_LEN
+
+    for save_number in range(first_save, config.TIMES_TO_SAVE):
+        # count proposed moves, so each save interval proposes at least as many moves as the serial engine, and accepted moves for move size tuning
+        proposed_moves = 0
+        accepted_moves = 0
+
+        # index in densities of the last sample before this save interval, and the number of samples taken in this save interval
+        sample_offset = save_number * samples_per_save
+        samples_taken = 0
+
+        while proposed_moves < config.ITERATIONS_BETWEEN_SAVES:
+            # randomly shift the domain grid and pick a colour (0-3) for this sub-sweep
+            grid_shift = rng.uniform(0, config.DOMAIN_SIZE, size=2)
+            colour = rng.integers(0, 4)
+
+            # domain (column of the x-y plane) of every particle, and whether it has the active colour
+            domains = np.floor_divide(flat_positions[:, :2] - grid_shift, config.DOMAIN_SIZE).astype(np.int64)
+            active = ((domains[:, 0] % 2) == (colour % 2)) & ((domains[:, 1] % 2) == (colour // 2))
+            candidates = np.flatnonzero(active)
+
+            # pick one particle uniformly from each active domain:
+            # sort candidates by domain then by a random key, and take the first candidate in each domain
+            keys = rng.random(len(candidates))
+            order = np.lexsort((keys, domains[candidates, 1], domains[candidates, 0]))
+            sorted_domains = domains[candidates[order]]
+            first_in_domain = np.ones(len(order), dtype=bool)
+            first_in_domain[1:] = np.any(sorted_domains[1:] != sorted_domains[:-1], axis=1)
+            picked = candidates[order[first_in_domain]]
+
+            # keep at most one picked particle per chain, choosing between picks from the same chain at random
+            picked = picked[rng.permutation(len(picked))]
+            _, first_in_chain = np.unique(flat_chain_idxs[picked], return_index=True)
+            picked = picked[np.sort(first_in_chain)]
+
+            # generate a random move direction, magnitude and acceptance uniform for every picked particle
+            move_directions = rng.integers(0, 3, size=len(picked))
+            move_magnitudes = rng.uniform(-brush.move_size, brush.move_size, size=len(picked))
+            acceptance_uniforms = rng.random(size=len(picked))
+            proposed_moves += len(picked)
+
+            if len(picked) == 0:
+                continue
+
+            # Calculate energy difference for all proposed moves
+            delta_e = brush.test_moves(picked, move_directions, move_magnitudes)
+
+            # reject any move that takes a particle out of its domain, this keeps the proposal symmetric and the moves independent
+            new_positions = brush.pending_batch[2]
+            new_domains = np.floor_divide(new_positions[:, :2] - grid_shift, config.DOMAIN_SIZE).astype(np.int64)
+            stays_in_domain = np.all(new_domains == domains[picked], axis=1)
+
+            # calculate the acceptance criteria for all moves at once
+            accepted = stays_in_domain & (acceptance_uniforms < np.exp(-delta_e / temperature))
+            brush.accept_moves(accepted)
+            accepted_moves += int(np.count_nonzero(accepted))
+
+            # sample the near-surface density from the running count for every sample point this sub-sweep reached
+            while samples_taken < min(proposed_moves // sample_interval, samples_per_save):
+                samples_taken += 1
+                densities[sample_offset + samples_taken] = brush.near_surface_count / config.DENSITY_VOLUME
+
+        # tune the move size during burn-in, or record the acceptance statistics once it is frozen
+        update_move_statistics(brush, save_number, proposed_moves, accepted_moves, adaptive_move_size)
+
+        # stream the positions at this save point to the trajectory file
+        if writer is not None:
+            writer.write(save_number + 1, brush.particle_positions)
+
+        # recalculate the energy from scratch every config.ENERGY_CHECK_INTERVAL save points, correcting the caches if they have drifted
+        if config.ENERGY_CHECK_INTERVAL and (save_number + 1) % config.ENERGY_CHECK_INTERVAL == 0:
+            brush.check_energy_drift()
+
+        # checkpoint the run every config.CHECKPOINT_INTERVAL save points, flushing the trajectory first so it is consistent with the checkpoint
+        if (save_number + 1) % config.CHECKPOINT_INTERVAL == 0:
+            if writer is not None:
+                writer.flush()
+            checkpoint.save_checkpoint(checkpoint_path, save_number + 1, brush, rng, densities)
+
+        # stop early once the equilibrium density is known well enough, dropping the samples that were never taken
+        if equilibration.is_converged(densities[:sample_offset + samples_per_save + 1], target_error, save_number + 1, tuning_samples):
+            densities = densities[:sample_offset + samples_per_save + 1]
+            break
+
+    # a run that stopped early keeps only the frames of the save points it reached
+    if writer is not None:
+        writer.close((len(densities) - 1) // samples_per_save + 1)
+
+    return densities
+
+# function to put every replica of a batched brush through a single monte carlo simulation at the same time
+# each replica proposes its own independent move every step, and all replicas are tested and accepted in one vectorized call.
+# args: class brush.BatchedBrush that has been pre-initialized,
+        # temperatures: 1d array of the temperature of each replica
+        # seeded random number generator
+        # block_draw: if True, draw all random numbers for each save interval as whole arrays up front, None for config.BLOCK_DRAW_RANDOM_NUMBERS
+# return: 2d array of densities of each replica calculated at every config.ITERATIONS_BETWEEN_SAVES iterations, shape: (replica, config.TIMES_TO_SAVE + 1)
+#
+# reproducibility: as for run_monte_carlo, a seed reproduces the trajectories exactly within a block_draw mode.
+#   each draw has shape (replica,) per step, or (config.ITERATIONS_BETWEEN_SAVES, replica) per save interval with block_draw=True,
+#   so trajectories depend on the number and order of replicas, and are not comparable with unbatched runs.
+def run_batched_monte_carlo(batched_brush, temperatures, rng, block_draw=None):
+    block_draw = config.BLOCK_DRAW_RANDOM_NUMBERS if block_draw is None else block_draw
+    num_replicas = batched_brush.num_replicas
+    temperatures = np.asarray(temperatures, dtype=np.float64)
+
+    # initialize array to store the density of each replica at each save point, +1 to include the original state of the brushes
+    densities = np.zeros((num_replicas, config.TIMES_TO_SAVE + 1))
+    densities[:, 0] = batched_brush.near_surface_count / config.DENSITY_VOLUME
+
     for save_number in range(config.TIMES_TO_SAVE):
-        for iteration in range(config.ITERATIONS_BETWEEN_SAVES):
-            # randomly select a chain and particle.
-            chain_idx = rng.integers(0, config.NUM_CHAINS)
-            particle_idx = rng.integers(0, config.CHAIN_LEN)
-            
-            # generate a random move direction and magnitude.
-            move_direction = rng.integers(0, 3)  # x, y, or z
-            move_magnitude = rng.uniform(-1, 1)
-            
-            # Calculate energy difference for proposed move
-            delta_e = brush.test_move(chain_idx, particle_idx, move_direction, move_magnitude)
-            
-            # calculate the acceptance criteria
-            if rng.random() < np.exp(-delta_e / temperature):
-                brush.accept_move()
-    
-        # save the current particle positions for density calculation later
-        saved_positions[save_number + 1] = brush.particle_positions
-    
-    # Flag z-coordinates that are below than or equal to the z_boundary
-    mask = saved_positions[..., 2] <= config.DENSITY_CALC_Z_BOUNDARY
+        run_batched_steps(batched_brush, temperatures, rng, config.ITERATIONS_BETWEEN_SAVES, block_draw)
+
+        # calculate the density of each replica at this save point
+        densities[:, save_number + 1] = batched_brush.near_surface_count / config.DENSITY_VOLUME
 
-    # Sum over all chains and particles for each save point
-    # densities is a 1d array of the calculated near-surface density at each save point. config.length = TIMES_TO_SAVE
-    densities = np.sum(mask, axis=(1, 2)) / config.DENSITY_VOLUME
+        # recalculate the energies from scratch every config.ENERGY_CHECK_INTERVAL save points, correcting the caches of replicas that have drifted
+        if config.ENERGY_CHECK_INTERVAL and (save_number + 1) % config.ENERGY_CHECK_INTERVAL == 0:
+            batched_brush.check_energy_drift()
 
     return densities
 
+# function to advance every replica of a batched brush by a number of monte carlo steps
+# args: class brush.BatchedBrush that has been pre-initialized,
+        # temperatures: 1d array of the temperature of each replica
+        # seeded random number generator
+        # num_steps: number of steps to run
+        # block_draw: if True, draw all random numbers for the num_steps steps as whole arrays up front
+# no return value
+def run_batched_steps(batched_brush, temperatures, rng, num_steps, block_draw):
+    # shape of the random draws, one value per replica per step
+    draw_shape = (num_steps, batched_brush.num_replicas) if block_draw else (batched_brush.num_replicas,)
+
+    if block_draw:
+        # draw every proposal and acceptance uniform for these steps as whole arrays.
+        chain_idxs = rng.integers(0, config.NUM_CHAINS, size=draw_shape)
+        particle_idxs = rng.integers(0, config.CHAIN_LEN, size=draw_shape)
+        move_directions = rng.integers(0, 3, size=draw_shape)
+        move_magnitudes = rng.uniform(-batched_brush.move_size, batched_brush.move_size, size=draw_shape)
+        acceptance_uniforms = rng.random(size=draw_shape)
+
+    for iteration in range(num_steps):
+        if block_draw:
+            step_draws = (chain_idxs[iteration], particle_idxs[iteration], move_directions[iteration], move_magnitudes[iteration], acceptance_uniforms[iteration])
+        else:
+            step_draws = (rng.integers(0, config.NUM_CHAINS, size=draw_shape),
+                          rng.integers(0, config.CHAIN_LEN, size=draw_shape),
+                          rng.integers(0, 3, size=draw_shape),
+                          rng.uniform(-batched_brush.move_size, batched_brush.move_size, size=draw_shape),
+                          rng.random(size=draw_shape))
+        step_chains, step_particles, step_directions, step_magnitudes, step_uniforms = step_draws
+
+        # Calculate energy difference for the proposed move in every replica
+        delta_e = batched_brush.test_move(step_chains, step_particles, step_directions, step_magnitudes)
+
+        # calculate the acceptance criteria for every replica at once
+        batched_brush.accept_move(step_uniforms < np.exp(-delta_e / temperatures))
+
+# function to run a temperature ladder of replicas with replica exchange (parallel tempering)
+# every replica runs ordinary monte carlo steps at its current temperature. every swap_interval steps, swaps of the
+# configurations at neighbouring temperatures are proposed and accepted with probability min(1, exp((1/T_k - 1/T_k+1) * (E_k - E_k+1))).
+# swaps alternate between the even pairs (0,1),(2,3)... and the odd pairs (1,2),(3,4)..., so every pair is attempted every two swap rounds.
+# replicas keep their positions and exchange temperatures instead, which is equivalent and avoids copying the brush state.
+# args: class brush.BatchedBrush with one replica per temperature, all with the same c_int and type pattern
+        # temperatures: 1d array of the ladder temperatures, replica k starts at temperatures[k]
+        # seeded random number generator
+        # swap_interval: number of monte carlo steps between swap rounds, None for config.SWAP_INTERVAL
+        # block_draw: if True, draw all random numbers for each swap interval as whole arrays up front, None for config.BLOCK_DRAW_RANDOM_NUMBERS
+# return: 
+    # densities: 2d array of the density at each temperature (not each replica) at every config.ITERATIONS_BETWEEN_SAVES iterations, shape: (temperature, config.TIMES_TO_SAVE + 1)
+    # swap_acceptance_rates: 1d array of the fraction of accepted swaps between each pair of neighbouring temperatures, shape: (temperature - 1,)
+def run_parallel_tempering(batched_brush, temperatures, rng, swap_interval=None, block_draw=None):
+    swap_interval = config.SWAP_INTERVAL if swap_interval is None else swap_interval
+    block_draw = config.BLOCK_DRAW_RANDOM_NUMBERS if block_draw is None else block_draw
+    temperatures = np.asarray(temperatures, dtype=np.float64)
+    num_temperatures = len(temperatures)
+
+    # replica_at_temperature[k] is the replica currently at temperatures[k]
+    replica_at_temperature = np.arange(num_temperatures)
+
+    # count attempted and accepted swaps for each neighbouring pair
+    swap_attempts = np.zeros(num_temperatures - 1, dtype=np.int64)
+    swap_accepts = np.zeros(num_temperatures - 1, dtype=np.int64)
+
+    # initialize array to store the density at each temperature at each save point, +1 to include the original state
+    densities = np.zeros((num_temperatures, config.TIMES_TO_SAVE + 1))
+    densities[:, 0] = batched_brush.near_surface_count[replica_at_temperature] / config.DENSITY_VOLUME
+
+    # total steps run, used to place swap rounds at every multiple of swap_interval across save points
+    total_steps = 0
+
+    for save_number in range(config.TIMES_TO_SAVE):
+        steps_left = config.ITERATIONS_BETWEEN_SAVES
+
+        while steps_left > 0:
+            # run up to the next swap round or save point, whichever comes first
+            num_steps = min(steps_left, swap_interval - total_steps % swap_interval)
+
+            # temperature of every replica, replica_temperatures[replica_at_temperature[k]] = temperatures[k]
+            replica_temperatures = np.empty(num_temperatures)
+            replica_temperatures[replica_at_temperature] = temperatures
+            run_batched_steps(batched_brush, replica_temperatures, rng, num_steps, block_draw)
+
+            total_steps += num_steps
+            steps_left -= num_steps
+
+            if total_steps % swap_interval == 0:
+                # alternate between even and odd neighbouring pairs each swap round
+                first_pairs = np.arange((total_steps // swap_interval) % 2, num_temperatures - 1, 2)
+                for k in first_pairs:
+                    lower, upper = replica_at_temperature[k], replica_at_temperature[k + 1]
+                    log_acceptance = (1 / temperatures[k] - 1 / temperatures[k + 1]) * (batched_brush.total_energy[lower] - batched_brush.total_energy[upper])
+                    swap_attempts[k] += 1
+                    if rng.random() < np.exp(min(log_acceptance, 0.0)):
+                        replica_at_temperature[k], replica_at_temperature[k + 1] = upper, lower
+                        swap_accepts[k] += 1
+
+        # calculate the density at each temperature at this save point
+        densities[:, save_number + 1] = batched_brush.near_surface_count[replica_at_temperature] / config.DENSITY_VOLUME
+
+        # recalculate the energies from scratch every config.ENERGY_CHECK_INTERVAL save points, so swaps are never decided on drifted total energies
+        if config.ENERGY_CHECK_INTERVAL and (save_number + 1) % config.ENERGY_CHECK_INTERVAL == 0:
+            batched_brush.check_energy_drift()
+
+    # fraction of accepted swaps, 0 for pairs that were never attempted
+    swap_acceptance_rates = swap_accepts / np.maximum(swap_attempts, 1)
+
+    return densities, swap_acceptance_rates
@@ -0,0 +1,111 @@
+import numpy as np
+from . import config
+
+# every move type of the move set, in the order their weights are drawn in
+# 'single' is the single particle move of Brush.test_move, the others move part or all of a chain together with Brush.test_segment_move
+MOVE_TYPES = ('single', 'pivot', 'crankshaft', 'translation')
+
+# function to convert the configured move weights into the probability of each move type
+# args: move_weights - dictionary of move type to relative weight, missing move types are never proposed
+# returns: 1d array of probabilities in the order of MOVE_TYPES
+# raises ValueError for unknown move types, negative weights or weights that are all 0
+def move_probabilities(move_weights):
+    unknown = set(move_weights) - set(MOVE_TYPES)
+    if unknown:
+        raise ValueError(f"unknown move types {sorted(unknown)}, expected some of {MOVE_TYPES}")
+
+    weights = np.array([move_weights.get(move_type, 0.0) for move_type in MOVE_TYPES], dtype=np.float64)
+    if np.any(weights < 0) or np.sum(weights) <= 0:
+        raise ValueError(f"move weights must be non-negative and not all 0, got {move_weights}")
+
+    return weights / np.sum(weights)
+
+# function to draw the move type of every step of one save interval
+# args: rng - seeded random number generator, move_weights - see move_probabilities, None for config.MOVE_WEIGHTS
+# returns: list of indexes into MOVE_TYPES for each of the config.ITERATIONS_BETWEEN_SAVES steps (0 is a single particle move),
+    # or None if every move is a single particle move. no random numbers are drawn then, so the random stream is the same as without a move set.
+def draw_move_types(rng, move_weights=None):
+    move_weights = config.MOVE_WEIGHTS if move_weights is None else move_weights
+    probabilities = move_probabilities(move_weights)
+    if probabilities[0] == 1:
+        return None
+
+    return rng.choice(len(MOVE_TYPES), size=config.ITERATIONS_BETWEEN_SAVES, p=probabilities).tolist()
+
+# function to calculate the matrix of a rotation about an axis (Rodrigues' rotation formula)
+# args: axis - [x,y,z] unit vector, angle - rotation angle in radians
+# returns: 3x3 rotation matrix, apply to row vectors as positions @ matrix.T
+def rotation_matrix(axis, angle):
+    x, y, z = axis
+    cross_matrix = np.array([[0, -z, y], [z, 0, -x], [-y, x, 0]])
+    return np.eye(3) + np.sin(angle) * cross_matrix + (1 - np.cos(angle)) * (cross_matrix @ cross_matrix)
+
+# function to propose a pivot move: the part of a chain above a random particle (or the whole chain, about its grafting point) is rotated about that point
+# the axis is uniform on the sphere and the angle uniform in [-config.CHAIN_MOVE_MAX_ANGLE, config.CHAIN_MOVE_MAX_ANGLE], so the reverse rotation is as likely
+# as the forward one and the proposal is symmetric. the spring to the pivot is unchanged, and the rotated part keeps its shape.
+# args: brush, rng - seeded random number generator
+# returns: (chain_idx, first_idx, new_positions) of the moved segment, see Brush.test_segment_move
+def propose_pivot(brush, rng):
+    chain_idx = int(rng.integers(0, config.NUM_CHAINS))
+
+    # -1 pivots the whole chain about its grafting point
+    pivot_idx = int(rng.integers(-1, config.CHAIN_LEN - 1))
+    pivot = brush.graft_positions[chain_idx] if pivot_idx == -1 else brush.particle_positions[chain_idx, pivot_idx]
+
+    axis = rng.normal(size=3)
+    axis /= np.linalg.norm(axis)
+    rotation = rotation_matrix(axis, rng.uniform(-config.CHAIN_MOVE_MAX_ANGLE, config.CHAIN_MOVE_MAX_ANGLE))
+
+    segment = brush.particle_positions[chain_idx, pivot_idx + 1:]
+    return chain_idx, pivot_idx + 1, (segment - pivot) @ rotation.T + pivot
+
+# function to propose a crankshaft move: one particle is rotated about the axis through the particles on either side of it
+# the particle below the first particle of a chain is its grafting point, the last particle of a chain has no axis and is never chosen.
+# both springs of the particle keep their length, the angle is uniform in [-config.CHAIN_MOVE_MAX_ANGLE, config.CHAIN_MOVE_MAX_ANGLE] so the proposal is symmetric.
+# args: brush, rng - seeded random number generator
+# returns: (chain_idx, first_idx, new_positions) of the moved particle, see Brush.test_segment_move, or None if the chain is too short or the axis has no length
+def propose_crankshaft(brush, rng):
+    if config.CHAIN_LEN < 2:
+        return None
+
+    chain_idx = int(rng.integers(0, config.NUM_CHAINS))
+    particle_idx = int(rng.integers(0, config.CHAIN_LEN - 1))
+    angle = rng.uniform(-config.CHAIN_MOVE_MAX_ANGLE, config.CHAIN_MOVE_MAX_ANGLE)
+
+    below = brush.graft_positions[chain_idx] if particle_idx == 0 else brush.particle_positions[chain_idx, particle_idx - 1]
+    axis = brush.particle_positions[chain_idx, particle_idx + 1] - below
+    axis_length = np.linalg.norm(axis)
+    if axis_length == 0:
+        return None
+
+    rotation = rotation_matrix(axis / axis_length, angle)
+    return chain_idx, particle_idx, ((brush.particle_positions[chain_idx, particle_idx] - below) @ rotation.T + below)[None, :]
+
+# function to propose a lateral translation: a whole chain is shifted parallel to the grafting surface, its grafting point stays fixed
+# the shift is uniform in [-config.CHAIN_TRANSLATION_SIZE, config.CHAIN_TRANSLATION_SIZE] in x and y, so the proposal is symmetric.
+# only the spring to the grafting point changes length.
+# args: brush, rng - seeded random number generator
+# returns: (chain_idx, first_idx, new_positions) of the whole chain, see Brush.test_segment_move
+def propose_translation(brush, rng):
+    chain_idx = int(rng.integers(0, config.NUM_CHAINS))
+    shift = np.zeros(3)
+    shift[:2] = rng.uniform(-config.CHAIN_TRANSLATION_SIZE, config.CHAIN_TRANSLATION_SIZE, size=2)
+    return chain_idx, 0, brush.particle_positions[chain_idx] + shift
+
+# proposal function of each collective move type
+PROPOSALS = {'pivot': propose_pivot, 'crankshaft': propose_crankshaft, 'translation': propose_translation}
+
+# function to record the outcome of a collective move
+# args: brush, move_type - key of PROPOSALS, accepted - whether the move was accepted
+# no return value
+# stores: counts in brush.chain_move_statistics
+def record_chain_move(brush, move_type, accepted):
+    statistics = brush.chain_move_statistics.setdefault(move_type, [0, 0])
+    statistics[0] += 1
+    statistics[1] += int(accepted)
+
+# function to get the acceptance rate of each collective move type of a run
+# args: brush - the brush after the run
+# returns: dictionary of move type to the fraction of its proposals accepted, only for move types that were proposed
+def chain_move_acceptance_rates(brush):
+    return {move_type: accepted / proposed for move_type, (proposed, accepted) in brush.chain_move_statistics.items() if proposed > 0}
@@ -0,0 +1,160 @@
+import functools
+import hashlib
+import json
+import os
+import numpy as np
+from . import config
+from . import checkpoint
+
+# modules whose code changes the result of a job, hashed into every cache key
+# instrumentation.timed_step runs the Metropolis step of instrumented runs, and checkpoint restores the state of resumed runs, so both can change results too
+SIMULATION_MODULES = ('brush.py', 'cell_list.py', 'interactions.py', 'monte_carlo.py', 'moves.py', 'sweep.py', 'equilibration.py', 'instrumentation.py', 'checkpoint.py')
+
+# configuration values that change the result of a job, hashed into every cache key
+# output settings (folders, checkpointing, trajectories, plotting) and the sweep's parameter lists are left out,
+# so extending config.TEMPERATURES or config.C_INTERACTIONS does not invalidate the jobs already run.
+SYSTEM_PARAMETERS = ('BASE_LEN_X', 'BASE_LEN_Y', 'NUM_CHAINS', 'CHAIN_LEN', 'SPRING_START_LENGTH', 'PRECISION',
+                     'ENERGY_CHECK_INTERVAL', 'ENERGY_DRIFT_TOLERANCE', 'ITERATIONS_BETWEEN_SAVES', 'TIMES_TO_SAVE', 'DENSITY_SAMPLE_INTERVAL',
+                     'MONTE_CARLO_ENGINE', 'BLOCK_DRAW_RANDOM_NUMBERS', 'EARLY_REJECTION_TOLERANCE',
+                     'K_SPRING', 'R_SIZE', 'DOMAIN_SIZE', 'CELL_SIZE', 'SURFACE_INTERACTION_ENERGY', 'DENSITY_CALC_Z_BOUNDARY', 'DENSITY_VOLUME',
+                     'ADAPTIVE_MOVE_SIZE', 'TUNING_SAVES', 'MAX_TUNING_FRACTION', 'TARGET_ACCEPTANCE', 'MIN_MOVE_SIZE', 'MAX_MOVE_SIZE',
+                     'MOVE_WEIGHTS', 'CHAIN_MOVE_MAX_ANGLE', 'CHAIN_TRANSLATION_SIZE', 'MULTIPLE_TRY_TRIALS',
+                     'TARGET_STANDARD_ERROR', 'MIN_SAVES_BEFORE_STOPPING', 'GEWEKE_Z_THRESHOLD', 'MIN_BLOCKS')
+
+# function to get the version of the simulation code, so results of older code are never reused
+# args: none
+# returns: hex digest of the simulation modules' source and the numpy version (which fixes the random streams)
+@functools.lru_cache(maxsize=1)
+def code_version():
+    digest = hashlib.sha256(np.__version__.encode())
+    source_folder = os.path.dirname(os.path.abspath(__file__))
+    for module in SIMULATION_MODULES:
+        with open(os.path.join(source_folder, module), 'rb') as file:
+            digest.update(file.read())
+    return digest.hexdigest()
+
+# function to identify the system a sweep's job results belong to, without the sweep's parameter lists
+# an independent job's result only depends on its own parameters, the system parameters and the code, so a sweep that adds or drops
+# temperatures or interaction constants can continue the results of the last one (see results_stream.ResultsWriter)
+# args: none
+# returns: hex digest of the system parameters and the code version
+def system_version():
+    parameters = {name: repr(getattr(config, name)) for name in SYSTEM_PARAMETERS}
+    parameters["code"] = code_version()
+    return hashlib.sha256(json.dumps(parameters, sort_keys=True).encode()).hexdigest()
+
+# function to get the cache key of a job
+# the key is a hash of everything the job's result depends on: its parameters, the system parameters in config and the code version.
+# values are read from config when called, so changes made at runtime (e.g. by run_benchmarks.py) are part of the key.
+# args: job - job dictionary from sweep.build_jobs
+# returns: hex digest identifying the job's result
+def job_key(job):
+    key = {
+        # floats are used so that e.g. temperature 1 and 1.0 are the same job
+        "job": [int(job["config_index"]), float(job["temperature"]), float(job["c_int"]), bool(job["is_block"])],
+        "system": {name: repr(getattr(config, name)) for name in SYSTEM_PARAMETERS},
+        "code": code_version()
+    }
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+# function to get the file a job's finished result is kept in
+# results are kept whenever config.CHECKPOINTING or config.RESULT_CACHE is on, so a restarted sweep always skips the jobs it already finished.
+# config.RESULT_CACHE only decides whether they are also kept after their sweep finishes, to be reused by later sweeps (see discard).
+# entries are spread over subfolders by the first two characters of their key, so no folder holds too many files
+# args: job - job dictionary
+# returns: .pkl path, or None if both config.CHECKPOINTING and config.RESULT_CACHE are disabled
+def cache_path(job):
+    if not (config.CHECKPOINTING or config.RESULT_CACHE):
+        return None
+
+    return os.path.join(config.RESULT_CACHE_FOLDERNAME, *split_key(job_key(job)))
+
+# function to look up the cached result of a job
+# a hit updates the entry's modification time, which evict uses as the time it was last used
+# args: job - job dictionary
+# returns: the cached result dictionary (see sweep.run_job), or None if the job has no cached result
+def load_result(job):
+    path = cache_path(job)
+    result = checkpoint.load_pickle(path)
+    if result is not None:
+        os.utime(path)
+    return result
+
+# function to add the result of a finished job to the cache
+# args: job - job dictionary, result - result dictionary from sweep.run_job
+# no return value
+# stores: the result in the cache, written atomically so a crash never leaves a partial entry
+def store_result(job, result):
+    path = cache_path(job)
+    if path is not None:
+        checkpoint.atomic_pickle(path, result)
+
+# function to split the jobs of a sweep into those with kept results and those still to run
+# without config.RESULT_CACHE, the only results kept are those of an unfinished sweep, so only a restarted sweep skips jobs
+# args: jobs - list of job dictionaries
+# returns: (cached_results, missing_jobs)
+    # cached_results: list of result dictionaries of the jobs found in the cache
+    # missing_jobs: list of the jobs not in the cache, in the order given
+def split_cached(jobs):
+    cached_results = []
+    missing_jobs = []
+    for job in jobs:
+        result = load_result(job)
+        if result is None:
+            missing_jobs.append(job)
+        else:
+            cached_results.append(result)
+    return cached_results, missing_jobs
+
+# function to remove the kept results of some jobs
+# without config.RESULT_CACHE, the parent process removes the results of a sweep once it has finished, so they are not reused by later sweeps
+# args: jobs - list of job dictionaries
+# returns: number of entries removed
+def discard(jobs):
+    removed = 0
+    for job in jobs:
+        path = os.path.join(config.RESULT_CACHE_FOLDERNAME, *split_key(job_key(job)))
+        if os.path.exists(path):
+            os.remove(path)
+            removed += 1
+    return removed
+
+# function to get the subfolder and file name of a cache key
+# args: key - hex digest from job_key
+# returns: (subfolder, file name)
+def split_key(key):
+    return key[:2], f'{key}.pkl'
+
+# function to limit the size of the cache, removing the least recently used entries first
+# called by the parent process after a sweep. the entries of the current sweep are never removed, even if they alone are over the limit.
+# args: max_bytes - largest total size of the cache entries to keep, None for config.RESULT_CACHE_MAX_BYTES, keep_jobs - list of job dictionaries of the current sweep
+# returns: number of entries removed
+def evict(max_bytes=None, keep_jobs=()):
+    max_bytes = config.RESULT_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    if not os.path.isdir(config.RESULT_CACHE_FOLDERNAME):
+        return 0
+
+    keep_filenames = {split_key(job_key(job))[1] for job in keep_jobs}
+
+    # (last used time, size, path) of every entry
+    entries = []
+    for folder, _, filenames in os.walk(config.RESULT_CACHE_FOLDERNAME):
+        for filename in filenames:
+            if filename.endswith('.pkl'):
+                path = os.path.join(folder, filename)
+                status = os.stat(path)
+                entries.append((status.st_mtime, status.st_size, path))
+
+    # remove the oldest entries until the rest fit, skipping the current sweep's
+    total_bytes = sum(size for _, size, _ in entries)
+    removed = 0
+    for _, size, path in sorted(entries):
+        if total_bytes <= max_bytes:
+            break
+        if os.path.basename(path) in keep_filenames:
+            continue
+        os.remove(path)
+        total_bytes -= size
+        removed += 1
+
+    return removed
@@ -1,30 +1,165 @@
-import matplotlib.pyplot as plt
+# graphs are drawn on Figure objects with the Agg canvas directly rather than through pyplot, so they render to files without a display
+# (e.g in worker processes) and the user's matplotlib backend is left as it is
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 import numpy as np
 import os
 import csv
+import multiprocessing as mp
 from . import config
+from . import moves
 
+# figure reused for every graph drawn in this process, created by get_figure
+_figure = None
 
-# function to save the plot to a file
-# args: filename: str, name of the file to save the plot to
-#       graph_title: str, title of the graph to display
-# stores: the plot to the filename specified
+
+# function to get the figure of this process, cleared for a new graph
+# creating a figure is much slower than clearing one, so one figure is reused for every graph a process draws
+# args: none
+# return: matplotlib figure
+def get_figure():
+    global _figure
+    if _figure is None:
+        _figure = Figure(figsize=(10, 6))
+        FigureCanvasAgg(_figure)
+    _figure.clf()
+    return _figure
+
+# function to draw one graph and save it to a file
+# args: plot: dict describing the graph, built by plot_and_save_data so it can be sent to a worker process
+#   {
+#     "filename": str,                               # png file to save the graph to
+#     "title": str,                                  # title of the graph
+#     "lines": [(x, y, label), ...],                 # density series to draw, with their x-axis values and legend labels
+#     "equilibration_step": int or None,             # step to mark as the start of the equilibrated part, None to not mark it
+#     "text": str                                    # text box in the top left of the graph
+#   }
+# stores: the graph to the filename specified
 # return: none
-def save_plot(filename, graph_title):
+def render_plot(plot):
+    figure = get_figure()
+    axes = figure.add_subplot()
+
+    # Create density against iterations
+    # Make line graph
+    for x, y, label in plot["lines"]:
+        axes.plot(x, y, marker='', linestyle='-', label=label, alpha=0.7)
+
+    # Mark where the equilibrated part of the run starts
+    if plot["equilibration_step"] is not None:
+        axes.axvline(plot["equilibration_step"], color='grey', linestyle='--', label='Equilibrated')
+
+    # Add text box
+    axes.text(0.02, 0.98, plot["text"],
+        transform=axes.transAxes,
+        verticalalignment='top',
+        bbox=dict(boxstyle='round', facecolor='white', alpha=0.8)
+    )
+
     # Add axis labels and title
-    plt.xlabel('Number of Steps', fontsize=12)
-    plt.ylabel('Density (particles/volume)', fontsize=12)
-    plt.title(graph_title, fontsize=14)
+    axes.set_xlabel('Number of Steps', fontsize=12)
+    axes.set_ylabel('Density (particles/volume)', fontsize=12)
+    axes.set_title(plot["title"], fontsize=14)
     
     # Add a legend and grid
-    plt.legend(loc='best', fontsize=8)
-    plt.grid(True, alpha=0.3)
+    axes.legend(loc='best', fontsize=8)
+    axes.grid(True, alpha=0.3)
+
+    figure.savefig(plot["filename"])
+
+# function to draw a list of graphs, spread across a process pool
+# args: plots: List[dict], graphs to draw (see render_plot)
+#       processes: int or None, number of processes to render with, None for one per CPU core
+# stores: every graph to its filename
+# return: none
+def render_plots(plots, processes=None):
+    processes = min(processes or mp.cpu_count(), len(plots))
+
+    # a single process draws the graphs itself rather than paying to start a pool
+    if processes <= 1:
+        for plot in plots:
+            render_plot(plot)
+        return
+
+    # graphs are handed out in chunks, as each one is quick to draw compared to sending it to a process
+    with mp.Pool(processes=processes) as pool:
+        for _ in pool.imap_unordered(render_plot, plots, chunksize=max(1, len(plots) // (4 * processes))):
+            pass
+
+# function to generate the x-axis values (number of iterations) of a density series
+# args: densities: List[float], density values sampled at equal intervals over the run, including the initial state
+#       steps_run: int, number of iterations the run actually ran, less than the full run if it stopped early
+# return: 1d array of the iteration number of each density value
+def steps_axis(densities, steps_run):
+    return np.linspace(
+        0,                                                                  # Start at the 0, initial configuration
+        steps_run,                                                          # End at the last iteration run
+        len(densities)                                                      # One value per density sample
+    )
+
+# function to save every result of the sweep as columns of one .npz file
+# each parameter and statistic is a 1d array with one entry per job, in the order of all_results.
+# density series can be shorter than a full run if the run stopped early, so they are stored as one 2d array padded with nan,
+# with the length of each series in "num_densities". statistics missing in batched modes are stored as nan.
+# parallel tempering swap acceptance rates are stored the same way as the densities, in "swap_acceptance_rates" and "num_swap_acceptance_rates" (0 without parallel tempering),
+# and the acceptance rate of each collective chain move type in its own "chain_move_acceptance_<move type>" column, nan where the move type was not used.
+# args: all_results: List[Dict], as for plot_and_save_data
+#       filename: str, .npz file to write, None for config.RESULTS_ARRAY_FILENAME
+# stores: the columnar results file
+# return: none
+def save_results_array(all_results, filename=None):
+    filename = config.RESULTS_ARRAY_FILENAME if filename is None else filename
+    results = [(configuration["config_index"], result) for configuration in all_results for result in configuration["results"]]
 
-    # save the figure for all configurations in this parameter set.
-    plt.savefig(filename)
-    plt.close()
+    # every job's density series, padded with nan to the longest series
+    num_densities = np.array([len(result["densities"]) for _, result in results], dtype=np.int64)
+    densities = np.full((len(results), num_densities.max(initial=0)), np.nan)
+    for row, (_, result) in enumerate(results):
+        densities[row, :num_densities[row]] = result["densities"]
 
+    # every job's swap acceptance rates, padded with nan to the longest temperature ladder
+    swap_rates = [[] if result.get("swap_acceptance_rates") is None else result["swap_acceptance_rates"] for _, result in results]
+    num_swap_acceptance_rates = np.array([len(rates) for rates in swap_rates], dtype=np.int64)
+    swap_acceptance_rates = np.full((len(results), num_swap_acceptance_rates.max(initial=0)), np.nan)
+    for row, rates in enumerate(swap_rates):
+        swap_acceptance_rates[row, :num_swap_acceptance_rates[row]] = rates
 
+    # optional statistics, nan where a mode does not report them
+    def column(key):
+        return np.array([np.nan if result.get(key) is None else result[key] for _, result in results], dtype=np.float64)
+
+    # acceptance rate of each chain move type, nan where the move type was not proposed or the mode has no chain moves
+    chain_move_acceptance = {f"chain_move_acceptance_{move_type}": np.array([(result.get("chain_move_acceptance") or {}).get(move_type, np.nan) for _, result in results], dtype=np.float64)
+                             for move_type in moves.MOVE_TYPES[1:]}
+
+    np.savez(filename,
+        config_index=np.array([config_index for config_index, _ in results], dtype=np.int64),
+        c_int=np.array([result["c_int"] for _, result in results], dtype=np.float64),
+        temperature=np.array([result["temperature"] for _, result in results], dtype=np.float64),
+        is_block=np.array([result["is_block"] for _, result in results], dtype=bool),
+        equilibrium_density=column("equilibrium_density"),
+        equilibrium_variance=column("equilibrium_variance"),
+        standard_error=column("standard_error"),
+        equilibration_step=np.array([result["equilibration_step"] for _, result in results], dtype=np.int64),
+        steps_run=np.array([result["steps_run"] for _, result in results], dtype=np.int64),
+        move_size=column("move_size"),
+        acceptance_rate=column("acceptance_rate"),
+        max_energy_drift=column("max_energy_drift"),
+        num_densities=num_densities,
+        densities=densities,
+        num_swap_acceptance_rates=num_swap_acceptance_rates,
+        swap_acceptance_rates=swap_acceptance_rates,
+        **chain_move_acceptance
+    )
+
+# function to load a results file written by save_results_array
+# args: filename: str, .npz file to read, None for config.RESULTS_ARRAY_FILENAME
+# return: dictionary of column name to array, see save_results_array.
+#         the densities of job i are densities[i, :num_densities[i]], its swap acceptance rates swap_acceptance_rates[i, :num_swap_acceptance_rates[i]]
+def load_results(filename=None):
+    filename = config.RESULTS_ARRAY_FILENAME if filename is None else filename
+    with np.load(filename) as results:
+        return {name: results[name] for name in results.files}
 
 # function to plot and save the graphs to png files, and save the data to a csv file
 # args:  all_results: List[Dict] is a list of dictionaries containing the results for each initial configuration, packaged at start_simulation.py
@@ -34,28 +169,37 @@ def save_plot(filename, graph_title):
 #         "c_int": float,                  # Interaction parameter
 #         "temperature": float,            # Temperature parameter
 #         "is_block": bool,                # True for block polymer, False for alternating
-#         "densities": List[float],        # List of density values at each save point
+#         "densities": List[float],        # List of density values at each sample point
 #         "equilibrium_density": float,    # Final equilibrium density
-#         "equilibrium_variance": float    # Variance in equilibrium density
+#         "equilibrium_variance": float,   # Variance in equilibrium density
+#         "standard_error": float,         # Standard error of the equilibrium density
+#         "equilibration_step": int,       # Step the equilibrated part of the run starts at
+#         "steps_run": int,                # Steps the run actually ran
+#         "move_size": float or None,      # Tuned maximum move magnitude
+#         "acceptance_rate": float or None,# Fraction of moves accepted after tuning
+#         "max_energy_drift": float or None,# Largest drift found by the energy checks
+#         "chain_move_acceptance": dict or None,  # Acceptance rate of each chain move type used
+#         "swap_acceptance_rates": np.ndarray or None  # Parallel tempering swap acceptance between neighbouring temperatures
 #       },
 #       ...more results for different parameter sets for the same configuration...
 #      ]
 #    }
 #   ...more configurations
 #   ]
-# stores: the individual configuration plots and combined parameter plots as png files, and the data to a csv file to the results folder
+#       plot_configurations: bool, draw a graph for every configuration of every parameter set, not only the overall graphs. None for config.PLOT_CONFIGURATION_GRAPHS
+#       processes: int or None, number of processes to render graphs with, None for config.PLOT_PROCESSES (itself None for one per CPU core)
+# stores: the individual configuration plots and combined parameter plots as png files, the data to a csv file and every result to a columnar .npz file in the results folder
 # return: none
-def plot_and_save_data(all_results):
+def plot_and_save_data(all_results, plot_configurations=None, processes=None):
+    plot_configurations = config.PLOT_CONFIGURATION_GRAPHS if plot_configurations is None else plot_configurations
+    processes = config.PLOT_PROCESSES if processes is None else processes
+
     # Create a dictionary to sort data according to simulation parameters (unique combination of c_int, temperature and is_block).
     parameter_combinations = {}
-    
-    # Generate the x-axis values (number of iterations)
-    x_axis_values = np.arange(      
-        0,                                                                  # Start at the 0, initial configuration
-        (config.ITERATIONS_BETWEEN_SAVES * config.TIMES_TO_SAVE) + 1,       # End at the total number of iterations. +1 to handle arange behavior which does not include the final point by default
-        config.ITERATIONS_BETWEEN_SAVES                                     # Step size between saves
-    )
 
+    # Collect the graphs to draw, they are all rendered together at the end
+    plots = []
+    
     # Create the results directory if it doesn't exist
     os.makedirs(config.RESULTS_FOLDERNAME, exist_ok=True)
 
@@ -64,7 +208,7 @@ def plot_and_save_data(all_results):
 
         # Create CSV writer and write header to the CSV file
         csvwriter = csv.writer(csvfile)
-        csvwriter.writerow(['Configuration', 'Type', 'Temperature', 'C_int', 'Equilibrium Density', 'Variance'])
+        csvwriter.writerow(['Configuration', 'Type', 'Temperature', 'C_int', 'Equilibrium Density', 'Variance', 'Standard Error', 'Equilibration Step', 'Steps Run', 'Move Size', 'Acceptance Rate'])
          
         # Unpack data to show trends for each combination of parameters
         # Index into the results for each initial configuration
@@ -85,29 +229,23 @@ def plot_and_save_data(all_results):
                     result["temperature"],
                     result["c_int"],
                     f"{result['equilibrium_density']:.6f}",
-                    f"{result['equilibrium_variance']:.6f}"
+                    f"{result['equilibrium_variance']:.6f}",
+                    f"{result['standard_error']:.6f}",
+                    result["equilibration_step"],
+                    result["steps_run"],
+                    "" if result["move_size"] is None else f"{result['move_size']:.4f}",
+                    "" if result["acceptance_rate"] is None else f"{result['acceptance_rate']:.4f}"
                 ])
 
-                # Create a new figure for this parameter combination
-                plt.figure(figsize=(10, 6))
-
-                # Create density against iterations
-                # Make line graph
-                plt.plot(x_axis_values, result["densities"], marker='', linestyle='-', label=f'Config {configuration["config_index"]}', alpha=0.7)
-
-                # Add equilibruim density and variance text box
-                plt.text(0.02, 0.98, f'Equilibrium Density: {result["equilibrium_density"]:.4f}\nVariance: {result["equilibrium_variance"]:.4f}',
-                    transform=plt.gca().transAxes,
-                    verticalalignment='top',
-                    bbox=dict(boxstyle='round', facecolor='white', alpha=0.8)
-                )
-
-                # Generate the graph title and filename
-                graph_title = f'{config.GRAPH_TITLE} \n{polymer_type} Polymer, T={result["temperature"]}, C_int={result["c_int"]}'
-                filename = f'{config.RESULTS_FOLDERNAME}/{configuration["config_index"]}_density_plot_{polymer_type}_T{result["temperature"]}_C{result["c_int"]}.png'
-
-                # save the figure for this configuration and parameter set.
-                save_plot(filename, graph_title)
+                # Describe the graph of density against iterations for this configuration and parameter set.
+                if plot_configurations:
+                    plots.append({
+                        "filename": f'{config.RESULTS_FOLDERNAME}/{configuration["config_index"]}_density_plot_{polymer_type}_T{result["temperature"]}_C{result["c_int"]}.png',
+                        "title": f'{config.GRAPH_TITLE} \n{polymer_type} Polymer, T={result["temperature"]}, C_int={result["c_int"]}',
+                        "lines": [(steps_axis(result["densities"], result["steps_run"]), result["densities"], f'Config {configuration["config_index"]}')],
+                        "equilibration_step": result["equilibration_step"],
+                        "text": f'Equilibrium Density: {result["equilibrium_density"]:.4f} ± {result["standard_error"]:.4f}\nVariance: {result["equilibrium_variance"]:.4f}'
+                    })
 
                 # Pack the data for later plotting in overall results graphs, where initial configurations with the same parameters are plotted as different lines on the same graph.
                 # Create a key for this parameter combination
@@ -126,7 +264,8 @@ def plot_and_save_data(all_results):
                 #           config_index: {                   # Key is configuration index
                 #             'densities': List[float],       # List of density values
                 #             'equilibrium_density': float,   # Final equilibrium density
-                #             'equilibrium_variance': float   # Variance in equilibrium density
+                #             'equilibrium_variance': float,  # Variance in equilibrium density
+                #             'steps_run': int                # Steps the run actually ran
                 #         },
                 #         ...more configurations with the same parameters
                 #     }
@@ -134,7 +273,8 @@ def plot_and_save_data(all_results):
                 parameter_combinations[key][configuration["config_index"]] = {
                     'densities': result["densities"],
                     'equilibrium_density': result["equilibrium_density"],
-                    'equilibrium_variance': result["equilibrium_variance"]
+                    'equilibrium_variance': result["equilibrium_variance"],
+                    'steps_run': result["steps_run"]
                     }
 
     # Create a plot for each parameter combination
@@ -146,9 +286,6 @@ def plot_and_save_data(all_results):
         # Unpack parameters from key tuple
         c_int, temperature, polymer_type = key
         
-        # Create a new figure for this parameter combination
-        plt.figure(figsize=(10, 6))
-        
         # Average the equilibrium densities and variance statistics for the results in each set of parameters
         mean_equilibrium_density = np.mean([data['equilibrium_density'] for data in config_data.values()])
         mean_equilibrium_variance = np.mean([data['equilibrium_variance'] for data in config_data.values()])
@@ -157,22 +294,16 @@ def plot_and_save_data(all_results):
         # unpack the config index identifier from the nested dictionary key
         # config_index: int
         # data: {densities[float], equilibrium_density, equilibrium_variance}
-        for config_index, data in config_data.items():
-            plt.plot(x_axis_values, data['densities'], marker='', linestyle='-', label=f'Config {config_index}', alpha=0.7)
-
-        # Add text box with mean values
-        plt.text(0.02, 0.98, 
-                f'Mean Equilibrium Density: {mean_equilibrium_density:.4f}\n' + 
-                f'Mean Equilibrium Variance: {mean_equilibrium_variance:.4f}',
-                transform=plt.gca().transAxes,
-                verticalalignment='top',
-                bbox=dict(boxstyle='round', facecolor='white', alpha=0.8))
-    
-        # save the figure for all configurations in this parameter set.
-        graph_title = f'{config.GRAPH_TITLE}\n{polymer_type} Polymer, T={temperature}, C_int={c_int}'
-        filename = f'{config.RESULTS_FOLDERNAME}/overall_{polymer_type}_T{temperature}_C{c_int}.png'
-        save_plot(filename, graph_title)
-
-
+        plots.append({
+            "filename": f'{config.RESULTS_FOLDERNAME}/overall_{polymer_type}_T{temperature}_C{c_int}.png',
+            "title": f'{config.GRAPH_TITLE}\n{polymer_type} Polymer, T={temperature}, C_int={c_int}',
+            "lines": [(steps_axis(data['densities'], data['steps_run']), data['densities'], f'Config {config_index}') for config_index, data in config_data.items()],
+            "equilibration_step": None,
+            "text": f'Mean Equilibrium Density: {mean_equilibrium_density:.4f}\n' + f'Mean Equilibrium Variance: {mean_equilibrium_variance:.4f}'
+        })
 
+    # save every result as columns of one file for later analysis, including the full density series
+    save_results_array(all_results)
 
+    # draw all graphs across a process pool
+    render_plots(plots, processes)
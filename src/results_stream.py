@@ -0,0 +1,152 @@
+import json
+import os
+import time
+import numpy as np
+from . import config
+
+# function to convert the numpy values of a result dictionary into JSON types
+# args: value - numpy array or scalar that json cannot serialize
+# returns: list or python scalar
+def to_json(value):
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"cannot write {type(value).__name__} to the results stream")
+
+#define class ResultsWriter, which appends the result of every finished job to a JSON-lines file as soon as it arrives
+#each result is one line, written with a single write and flushed to disk with fsync before write() returns, so every job reported as finished
+#survives a crash. a crash during a write can only leave a partial last line, which read_results skips.
+#the parent process keeps nothing per job, so its memory stays flat however large the sweep is, and the file can be read while the sweep is running.
+#the first line identifies the sweep ({"sweep": id}), so a restarted sweep only continues a stream written with the same system parameters and code.
+class ResultsWriter:
+
+    # method to open the results stream of a sweep
+    # args: self, path - JSON-lines file to write, None for config.RESULTS_STREAM_FILENAME
+    #       resume - if True, append to an existing file of the same sweep instead of starting a new one
+    #       sweep - identifier of the sweep written as the first line of a new file (e.g. result_cache.system_version()), or None to not write one
+    # no return value
+    # stores: the open file
+    # raises ValueError if resuming a file that belongs to a different sweep, which is never overwritten without resume=False
+    def __init__(self, path=None, resume=False, sweep=None):
+        path = config.RESULTS_STREAM_FILENAME if path is None else path
+        self.path = path
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+
+        if resume and sweep is not None and os.path.exists(path) and read_sweep(path) not in (None, sweep):
+            raise ValueError(f"{path} holds the results of a different sweep (system parameters or code changed), start a fresh sweep (start_simulation.py --fresh) to overwrite it")
+
+        self.file = open(path, 'a' if resume else 'w')
+
+        # end a partial last line left by a crash, so the next result starts on its own line
+        if self.file.tell() > 0:
+            with open(path, 'rb') as existing:
+                existing.seek(-1, os.SEEK_END)
+                if existing.read(1) != b'\n':
+                    self.file.write('\n')
+        elif sweep is not None:
+            self.write({"sweep": sweep})
+
+    # method to append one result
+    # args: self, result - result dictionary from sweep.run_job or sweep.run_single_configuration
+    # no return value
+    def write(self, result):
+        self.file.write(json.dumps(result, default=to_json) + '\n')
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    # method to close the file
+    # args: self
+    # no return value
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+# generator reading the records of a results stream one line at a time
+# args: path - JSON-lines file
+# yields: each complete record as a dictionary, a partial last line from an interrupted write is skipped
+def read_records(path):
+    with open(path) as file:
+        for line in file:
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                continue
+
+# function to get the sweep a results stream belongs to
+# args: path - JSON-lines file, None for config.RESULTS_STREAM_FILENAME
+# returns: the sweep identifier from its first line, or None if it has none
+def read_sweep(path=None):
+    path = config.RESULTS_STREAM_FILENAME if path is None else path
+    for record in read_records(path):
+        return record.get("sweep")
+    return None
+
+# function to get the parameters identifying the job of a result, the same for a job dictionary and its result
+# floats are used so that e.g. temperature 1 and 1.0 are the same job, as in result_cache.job_key
+# args: job - job dictionary from sweep.build_jobs, or result dictionary
+# returns: (config_index, temperature, c_int, is_block)
+def job_identity(job):
+    return (int(job["config_index"]), float(job["temperature"]), float(job["c_int"]), bool(job["is_block"]))
+
+# function to find the jobs already in a results stream, so a restarted sweep only runs the rest
+# only the parameters of each record are kept, so memory does not grow with the length of the density series
+# args: path - JSON-lines file, None for config.RESULTS_STREAM_FILENAME
+# returns: set of job_identity of every result in the stream, empty if the file does not exist
+def finished_jobs(path=None):
+    path = config.RESULTS_STREAM_FILENAME if path is None else path
+    if not os.path.exists(path):
+        return set()
+    return {job_identity(record) for record in read_records(path) if "sweep" not in record}
+
+# function to read the results written so far by a ResultsWriter, e.g. to analyse a sweep that is still running or was interrupted
+# args: path - JSON-lines file, None for config.RESULTS_STREAM_FILENAME
+# returns: list of result dictionaries (see sweep.run_job) in the order they finished, with densities as numpy arrays
+    # a partial last line from an interrupted write is skipped. use sweep.collect_results to group them by configuration.
+def read_results(path=None):
+    path = config.RESULTS_STREAM_FILENAME if path is None else path
+    results = []
+    for result in read_records(path):
+        # the line identifying the sweep is not a result
+        if "sweep" in result:
+            continue
+
+        result["densities"] = np.array(result["densities"])
+        if result.get("swap_acceptance_rates") is not None:
+            result["swap_acceptance_rates"] = np.array(result["swap_acceptance_rates"])
+        results.append(result)
+    return results
+
+#define class Progress, which reports how much of a sweep is done and estimates the time left
+#the estimate assumes the remaining units of work take as long on average as the finished ones.
+class Progress:
+
+    # method to start timing a sweep
+    # args: self, total - number of units of work in the sweep
+    # no return value
+    def __init__(self, total):
+        self.total = total
+        self.completed = 0
+        self.start_time = time.time()
+
+    # method to record finished units of work
+    # args: self, count - number of units that just finished
+    # returns: progress string, e.g. "[12/120] 10.0% elapsed 0:01:05 ETA 0:09:45"
+    def update(self, count=1):
+        self.completed += count
+        elapsed = time.time() - self.start_time
+        remaining = elapsed / self.completed * (self.total - self.completed) if self.completed else 0.0
+        return f"[{self.completed}/{self.total}] {self.completed / max(self.total, 1):.1%} elapsed {format_duration(elapsed)} ETA {format_duration(remaining)}"
+
+# function to format a number of seconds as hours:minutes:seconds
+# args: seconds - float
+# returns: string, e.g. 1:02:03
+def format_duration(seconds):
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}"
@@ -0,0 +1,319 @@
+import functools
+import os
+import zlib
+import numpy as np
+from . import config
+from . import brush
+from . import monte_carlo
+from . import equilibration
+from . import instrumentation
+from . import result_cache
+
+# starting configurations built once by the parent process and handed to this worker by initialize_worker, keyed by config_index. empty outside a sweep's workers.
+_configurations = {}
+
+# function to list every independent job of the parameter sweep
+# a job is one monte carlo run: one starting configuration, temperature, interaction constant and polymer type.
+# args: config_indexes - iterable of starting configuration indexes to build jobs for
+# returns: list of job dictionaries in canonical order (configuration, then temperature, then c_int, then block before alternating)
+#   [{
+#     "config_index": int,     # Index identifying the initial configuration
+#     "temperature": float,    # Temperature parameter
+#     "c_int": float,          # Interaction parameter
+#     "is_block": bool         # True for block polymer, False for alternating
+#    },
+#   ...]
+def build_jobs(config_indexes):
+    return [{"config_index": config_index, "temperature": temperature, "c_int": c_int, "is_block": is_block}
+            for config_index in config_indexes
+            for temperature in config.TEMPERATURES
+            for c_int in config.C_INTERACTIONS
+            for is_block in [True, False]]
+
+# function to create the random number generator of a single job
+# every configuration has its own SeedSequence (seeded with config_index), and every job is a child spawned from it.
+# the child's spawn key is derived from the job's parameters rather than its position in the sweep, so a job gets the same stream
+# no matter which other jobs exist, in which order they are scheduled, or which process runs them.
+# args: job - job dictionary from build_jobs
+# returns: numpy random number generator for this job
+def job_rng(job):
+    # stable 32 bit key for the parameter combination. floats are used so that e.g. temperature 1 and 1.0 are the same job.
+    parameter_key = zlib.crc32(repr((float(job["temperature"]), float(job["c_int"]), bool(job["is_block"]))).encode())
+
+    # equivalent to the child of np.random.SeedSequence(config_index).spawn() with this spawn key
+    seed_sequence = np.random.SeedSequence(job["config_index"], spawn_key=(parameter_key,))
+    return np.random.default_rng(seed_sequence)
+
+# function to get a readable name for a job, unique within a sweep, used for its checkpoint and result files
+# args: job - job dictionary
+# returns: string name, e.g. 3_Block_T0.5_C1
+def job_name(job):
+    polymer_type = "Block" if job["is_block"] else "Alternating"
+    return f'{job["config_index"]}_{polymer_type}_T{job["temperature"]}_C{job["c_int"]}'
+
+# function to get the file a job checkpoints to
+# the name ends with the start of the job's cache key, so a checkpoint is never resumed after the system parameters or code change
+# args: job - job dictionary
+# returns: .pkl path, or None if config.CHECKPOINTING is disabled
+def job_checkpoint_path(job):
+    if not config.CHECKPOINTING:
+        return None
+
+    return os.path.join(config.CHECKPOINT_FOLDERNAME, f'{job_name(job)}_{result_cache.job_key(job)[:12]}.pkl')
+
+# function to get the file a job streams its trajectory to
+# args: job - job dictionary
+# returns: .npy path, or None if config.SAVE_TRAJECTORIES is disabled
+def job_trajectory_path(job):
+    if not config.SAVE_TRAJECTORIES:
+        return None
+
+    return os.path.join(config.TRAJECTORY_FOLDERNAME, f'{job_name(job)}.npy')
+
+# function to generate the starting configuration (grafting points and straight chains) shared by every job of a configuration
+# in a sweep's workers the configuration built by the parent is used (see initialize_worker), so no worker regenerates it however the jobs are scheduled.
+# otherwise the last few are cached, so consecutive jobs of the same configuration only generate it and find its interacting pairs once.
+# callers must not modify the returned brush, prepare_variant copies it.
+# args: config_index - index of the starting configuration
+# returns: (original_brush, pair_geometry)
+    # original_brush: Brush with positions initialized, types and energies not yet set
+    # pair_geometry: interacting pairs of the starting positions, shared by every variant (see brush.Brush.calc_pair_geometry)
+@functools.lru_cache(maxsize=2)
+def initialize_configuration(config_index):
+    if config_index in _configurations:
+        return _configurations[config_index]
+
+    original_brush = brush.Brush()
+
+    # initialize a random number generator for the geometry of this configuration, using the config_index as the seed.
+    # fixes: all results being the same due to time based-rng having the same values for parallel processes.
+    rng = np.random.default_rng(config_index)
+    original_brush.initialize_positions(rng)
+
+    return original_brush, original_brush.calc_pair_geometry()
+
+# function to build the starting configurations of a sweep once, in the parent process, to send to every worker with initialize_worker
+# each is a few tens of kilobytes, and is sent once per worker rather than once per job.
+# args: config_indexes - iterable of starting configuration indexes
+# returns: dict of config_index: (original_brush, pair_geometry) from initialize_configuration
+def build_configurations(config_indexes):
+    return {config_index: initialize_configuration(config_index) for config_index in config_indexes}
+
+# function to set up a worker process of the sweep, used as the process pool or work queue initializer
+# args: configurations - dict from build_configurations, used by initialize_configuration instead of generating them again
+#       metrics_queue - multiprocessing queue for instrumentation.set_metrics_queue, or None without instrumentation
+# no return value
+# stores: the configurations in this process
+def initialize_worker(configurations, metrics_queue=None):
+    _configurations.update(configurations)
+    if metrics_queue is not None:
+        instrumentation.set_metrics_queue(metrics_queue)
+
+# function to set up the brush for one parameter variant of a starting configuration
+# args: configuration - (original_brush, pair_geometry) from initialize_configuration, not modified
+#       c_int, is_block - interaction constant and polymer type of the variant
+# returns: a new Brush with the variant's types and energies initialized
+def prepare_variant(configuration, c_int, is_block):
+    original_brush, pair_geometry = configuration
+
+    # Copy the geometry of the original brush to preserve the initial state
+    brush_copy = original_brush.copy_geometry()
+
+    # Set the interaction constant for this simulation
+    brush_copy.c_int = c_int
+
+    # Set the type of polymer, block or alternating for this simulation
+    brush_copy.set_type(is_block)
+
+    # Initialize the energies for this brush, from the pair geometry shared by every variant
+    brush_copy.initialize_energies(pair_geometry)
+
+    return brush_copy
+
+# function to package the densities of a finished run with its parameters and equilibrium statistics
+# the equilibrated part of the series is found with equilibration.analyze (MSER cut), rather than assuming the second half is equilibrated.
+# args: job - job dictionary, densities - 1d array of densities at each sample point, swap_acceptance_rates - parallel tempering statistics or None
+#       sample_interval - number of steps between density samples, None for monte_carlo.density_sample_interval()
+#       run_stats - move and energy statistics from monte_carlo.run_statistics, or None for batched modes
+# returns: result dictionary (see run_job)
+def summarize(job, densities, swap_acceptance_rates=None, sample_interval=None, run_stats=None):
+    sample_interval = monte_carlo.density_sample_interval() if sample_interval is None else sample_interval
+
+    # samples taken while the move size was being tuned can never be part of the equilibrated run
+    tuning_samples = run_stats["tuning_steps"] // sample_interval if run_stats is not None else 0
+    analysis = equilibration.analyze(densities, tuning_samples)
+
+    return {
+        "config_index" : job["config_index"],
+        "c_int" : job["c_int"],
+        "temperature" : job["temperature"],
+        "is_block" : job["is_block"],
+        "densities" : densities,
+        "equilibrium_density": analysis["mean"],
+        "equilibrium_variance" : analysis["variance"],
+        "standard_error" : analysis["standard_error"],
+        "equilibration_step" : analysis["cut_index"] * sample_interval,
+        "steps_run" : (len(densities) - 1) * sample_interval,
+        "move_size" : run_stats["move_size"] if run_stats is not None else None,
+        "acceptance_rate" : run_stats["acceptance_rate"] if run_stats is not None else None,
+        "max_energy_drift" : run_stats["max_energy_drift"] if run_stats is not None else None,
+        "chain_move_acceptance" : run_stats["chain_move_acceptance"] if run_stats is not None else None,
+        "swap_acceptance_rates" : swap_acceptance_rates
+    }
+
+# function to run a single job of the sweep
+# depends only on the job itself: the starting configuration is regenerated from config_index and the rng is spawned from the job's parameters.
+# with config.CHECKPOINTING or config.RESULT_CACHE, a job whose result is kept returns it without running, and a finished job keeps its result (see result_cache.cache_path).
+# with config.CHECKPOINTING, a job with a checkpoint resumes from it, giving exactly the result an uninterrupted run would.
+# args: job - job dictionary from build_jobs
+# returns: dictionary of results for this job:
+#   {
+#     "config_index": int,                 # Index identifying the initial configuration
+#     "c_int": float,                      # Interaction parameter
+#     "temperature": float,                # Temperature parameter
+#     "is_block": bool,                    # True for block polymer, False for alternating
+#     "densities": List[float],            # List of density values at each sample point (every monte_carlo.density_sample_interval() steps, every save point in batched modes)
+#     "equilibrium_density": float,        # Final equilibrium density, mean of the samples after the equilibration step
+#     "equilibrium_variance": float,       # Variance in equilibrium density
+#     "standard_error": float,             # Blocking standard error of the equilibrium density
+#     "equilibration_step": int,           # Step the equilibrated part of the run starts at (MSER cut, never before the end of move size tuning)
+#     "steps_run": int,                    # Steps actually run, fewer than the full run if it converged early (config.TARGET_STANDARD_ERROR)
+#     "move_size": float or None,          # Maximum move magnitude after tuning, None in batched modes
+#     "acceptance_rate": float or None,    # Fraction of moves accepted after tuning, None in batched modes or if no moves were counted after tuning
+#     "max_energy_drift": float or None,   # Largest drift of the running total energy found by the energy checks, None in batched modes
+#     "chain_move_acceptance": dict or None,  # Acceptance rate of each collective chain move type used (config.MOVE_WEIGHTS), None in batched modes
+#     "swap_acceptance_rates": np.ndarray or None  # Parallel tempering swap acceptance between neighbouring temperatures of this ladder, None without parallel tempering
+#   }
+def run_job(job):
+    checkpoint_path = job_checkpoint_path(job)
+
+    # skip jobs that already finished, earlier in this sweep or in a previous sweep with the same system parameters and code
+    cached_result = result_cache.load_result(job)
+    if cached_result is not None:
+        return cached_result
+
+    brush_copy = prepare_variant(initialize_configuration(job["config_index"]), job["c_int"], job["is_block"])
+    rng = job_rng(job)
+
+    # Run the monte carlo simulation with the configured engine and get the densities
+    if config.MONTE_CARLO_ENGINE == 'checkerboard':
+        densities = monte_carlo.run_checkerboard_monte_carlo(brush_copy, job["temperature"], rng, checkpoint_path=checkpoint_path, trajectory_path=job_trajectory_path(job))
+    else:
+        metrics = instrumentation.RunMetrics(job_name(job)) if config.INSTRUMENTATION else None
+        densities = monte_carlo.run_monte_carlo(brush_copy, job["temperature"], rng, checkpoint_path=checkpoint_path, trajectory_path=job_trajectory_path(job), metrics=metrics)
+
+    result = summarize(job, densities, run_stats=monte_carlo.run_statistics(brush_copy))
+
+    # store the finished result before removing the checkpoint, so a crash in between never loses the job
+    result_cache.store_result(job, result)
+    if checkpoint_path is not None and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+
+    return result
+
+# function to estimate the relative cost of a job, used to schedule the longest jobs first
+# every job runs the same number of steps, but accepted moves cost roughly as much again as the trial move, and hotter runs accept more.
+# exp(-1/T) is used as a rough proxy for the acceptance rate, only the ordering of the estimates matters.
+# args: job - job dictionary
+# returns: estimated cost in units of trial moves
+def estimate_job_cost(job):
+    steps = config.ITERATIONS_BETWEEN_SAVES * config.TIMES_TO_SAVE
+    return steps * (1 + np.exp(-1 / job["temperature"]))
+
+# function to refuse the options the batched modes (config.BATCH_REPLICAS, config.PARALLEL_TEMPERING) cannot honour, rather than silently ignoring them
+# a batched unit of work is a whole configuration advanced by brush.BatchedBrush: its moves are single particle moves of a fixed size, densities are sampled at every save point,
+# and it is run to the end without checkpoints, kept results, trajectories or metrics.
+# args: none, reads config
+# no return value, raises ValueError naming every unsupported option that is set
+def check_batched_options():
+    if not (config.BATCH_REPLICAS or config.PARALLEL_TEMPERING):
+        return
+
+    unsupported = {
+        "ADAPTIVE_MOVE_SIZE": config.ADAPTIVE_MOVE_SIZE,
+        "CHECKPOINTING": config.CHECKPOINTING,
+        "RESULT_CACHE": config.RESULT_CACHE,
+        "SAVE_TRAJECTORIES": config.SAVE_TRAJECTORIES,
+        "INSTRUMENTATION": config.INSTRUMENTATION,
+        "TARGET_STANDARD_ERROR": config.TARGET_STANDARD_ERROR is not None,
+        "MONTE_CARLO_ENGINE": config.MONTE_CARLO_ENGINE != 'serial',
+        "MOVE_WEIGHTS": any(weight for move_type, weight in config.MOVE_WEIGHTS.items() if move_type != 'single'),
+        "MULTIPLE_TRY_TRIALS": config.MULTIPLE_TRY_TRIALS > 1,
+        "DENSITY_SAMPLE_INTERVAL": monte_carlo.density_sample_interval() != config.ITERATIONS_BETWEEN_SAVES
+    }
+    names = [name for name, is_set in unsupported.items() if is_set]
+    if names:
+        raise ValueError(f"config.BATCH_REPLICAS and config.PARALLEL_TEMPERING do not support {', '.join('config.' + name for name in names)}, "
+                         "turn these options off or run the variants as independent jobs")
+
+# function to run every parameter variant of one starting configuration in this process
+# used for the modes that advance several variants of a configuration together (config.BATCH_REPLICAS, config.PARALLEL_TEMPERING),
+# otherwise every variant is run as an independent job with run_job.
+# args: config_index (just a unique identifier integer for one of the 10 generated starting configurations)
+# returns: list of result dictionaries (see run_job) in canonical job order
+def run_single_configuration(config_index):
+    jobs = build_jobs([config_index])
+
+    # without a batched mode every variant is an independent job
+    if not (config.BATCH_REPLICAS or config.PARALLEL_TEMPERING):
+        return [run_job(job) for job in jobs]
+    check_batched_options()
+
+    # one random number generator for the whole batch, spawned from the configuration's SeedSequence with a key no job can have
+    rng = np.random.default_rng(np.random.SeedSequence(config_index, spawn_key=(2**32,)))
+
+    # Prepare a brush for each variant from the shared starting configuration
+    configuration = initialize_configuration(config_index)
+    variant_brushes = [prepare_variant(configuration, job["c_int"], job["is_block"]) for job in jobs]
+
+    # Swap acceptance rates of each parallel tempering ladder, keyed by (c_int, is_block)
+    swap_acceptance_rates = {}
+
+    # Run the monte carlo simulations and get the densities of every variant
+    if config.PARALLEL_TEMPERING:
+        all_densities = [None] * len(jobs)
+
+        # run the temperature ladder of each interaction constant and polymer type together, with replica exchange
+        for c_int in config.C_INTERACTIONS:
+            for is_block in [True, False]:
+                # indexes of this ladder's jobs, sorted from coldest to hottest so neighbouring rungs are neighbouring temperatures
+                ladder = sorted((i for i, job in enumerate(jobs) if job["c_int"] == c_int and job["is_block"] == is_block), key=lambda i: jobs[i]["temperature"])
+
+                ladder_densities, swap_acceptance_rates[(c_int, is_block)] = monte_carlo.run_parallel_tempering(
+                    brush.BatchedBrush([variant_brushes[i] for i in ladder]), [jobs[i]["temperature"] for i in ladder], rng)
+
+                for rung, job_idx in enumerate(ladder):
+                    all_densities[job_idx] = ladder_densities[rung]
+
+                print(f"Configuration:{config_index} Interaction Constant:{c_int} Is block:{is_block} Swap acceptance rates:{np.round(swap_acceptance_rates[(c_int, is_block)], 3).tolist()}")
+    else:
+        # stack all variants into one batched brush and advance them together
+        all_densities = monte_carlo.run_batched_monte_carlo(brush.BatchedBrush(variant_brushes), [job["temperature"] for job in jobs], rng)
+
+    return [summarize(job, densities, swap_acceptance_rates.get((job["c_int"], job["is_block"])), config.ITERATIONS_BETWEEN_SAVES) for job, densities in zip(jobs, all_densities)]
+
+# function to group job results by starting configuration, in canonical order
+# the order results arrive in (which depends on scheduling) does not affect the output.
+# args: job_results - iterable of result dictionaries from run_job, in any order
+# returns: all_results: List[Dict]
+# [{
+#     "config_index": int,
+#     "results": [{...result dictionary, see run_job...},
+#     ...more results for different parameter sets with the same initial configuration, 12 total...
+#    ]
+#  },
+# ...more different initial configurations 10 total...
+# ]
+def collect_results(job_results):
+    job_results = list(job_results)
+
+    # canonical position of every parameter combination within a configuration
+    canonical_order = {(job["temperature"], job["c_int"], job["is_block"]): position for position, job in enumerate(build_jobs([0]))}
+
+    all_results = []
+    for config_index in sorted({result["config_index"] for result in job_results}):
+        results = [result for result in job_results if result["config_index"] == config_index]
+        results.sort(key=lambda result: canonical_order[(result["temperature"], result["c_int"], result["is_block"])])
+        all_results.append({"config_index": config_index, "results": results})
+
+    return all_results
@@ -0,0 +1,90 @@
+import io
+import os
+import struct
+import numpy as np
+from . import config
+
+#define class TrajectoryWriter, which streams the particle positions at each save point of a run into a memory-mapped .npy file
+#frames are written straight to the file instead of being kept in memory, so memory use stays constant however long the run is,
+#and the file is a standard .npy that can be opened later with load_trajectory (or np.load) for post-hoc analysis.
+#the file is created with room for every save point of the run. a run that stops early cuts it down to the frames it wrote when it is closed.
+class TrajectoryWriter:
+
+    # method to create (or reopen) the trajectory file of a run
+    # args: self,
+        # path: .npy file to write
+        # num_frames: total number of frames in the run, config.TIMES_TO_SAVE + 1 to include the initial state
+        # resume: if True and the file exists, reopen it to continue writing after a checkpoint instead of starting a new file
+    # no return value
+    # stores: the memory-mapped frame array, shape: (num_frames, NUM_CHAINS, CHAIN_LEN, 3)
+    def __init__(self, path, num_frames, resume=False):
+        self.path = path
+
+        if resume and os.path.exists(path):
+            # frames written after the last checkpoint are overwritten as the run is repeated from there
+            self.frames = np.lib.format.open_memmap(path, mode='r+')
+        else:
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            self.frames = np.lib.format.open_memmap(path, mode='w+', dtype=config.PRECISION,
+                                                    shape=(num_frames, config.NUM_CHAINS, config.CHAIN_LEN, 3))
+
+    # method to write the particle positions of one save point
+    # args: self, frame_number - index of the save point (0 is the initial state), particle_positions - 3d array (chain number, particle in chain, xyz coords)
+    # no return value
+    def write(self, frame_number, particle_positions):
+        self.frames[frame_number] = particle_positions
+
+    # method to flush written frames to disk, called at checkpoints so the file is consistent with the checkpoint
+    # args: self
+    # no return value
+    def flush(self):
+        self.frames.flush()
+
+    # method to flush and close the file
+    # args: self, num_frames - number of frames the run wrote, None if it wrote all of them. if fewer, the file is cut down to them (see truncate_frames)
+    # no return value
+    def close(self, num_frames=None):
+        total_frames = len(self.frames)
+        self.frames.flush()
+        del self.frames
+
+        if num_frames is not None and num_frames < total_frames:
+            truncate_frames(self.path, num_frames)
+
+# function to cut a .npy trajectory down to its first frames, e.g. after a run stopped early, so the frames never written are not read as real ones
+# the header is rewritten in place with the new number of frames and the file is truncated after the last kept frame, so no frame data is copied.
+# a shorter shape never needs a longer header, the new header is padded with spaces to the length of the old one so the frames stay where they are.
+# args: path - .npy file written by TrajectoryWriter, num_frames - number of frames to keep
+# no return value
+def truncate_frames(path, num_frames):
+    with open(path, 'r+b') as file:
+        version = np.lib.format.read_magic(file)
+        read_header = np.lib.format.read_array_header_1_0 if version == (1, 0) else np.lib.format.read_array_header_2_0
+        shape, fortran_order, dtype = read_header(file)
+        data_offset = file.tell()
+
+        # build the header for the new shape, then pad it to the old header's length before its closing newline
+        header = {"descr": np.lib.format.dtype_to_descr(dtype), "fortran_order": fortran_order, "shape": (num_frames,) + shape[1:]}
+        buffer = io.BytesIO()
+        if version == (1, 0):
+            np.lib.format.write_array_header_1_0(buffer, header)
+        else:
+            np.lib.format.write_array_header_2_0(buffer, header)
+        new_header = buffer.getvalue()
+        new_header = new_header[:-1] + b' ' * (data_offset - len(new_header)) + b'\n'
+
+        # the header length field follows the 6 byte magic string and 2 byte version, 2 bytes long in version 1.0 and 4 bytes from version 2.0
+        length_format = '<H' if version == (1, 0) else '<I'
+        length_end = 8 + struct.calcsize(length_format)
+        new_header = new_header[:8] + struct.pack(length_format, data_offset - length_end) + new_header[length_end:]
+
+        file.seek(0)
+        file.write(new_header)
+        file.truncate(data_offset + num_frames * int(np.prod(shape[1:])) * dtype.itemsize)
+
+# function to open a trajectory written by TrajectoryWriter without loading it into memory
+# args: path - .npy trajectory file
+# returns: read-only memory-mapped array of shape (number of save points, NUM_CHAINS, CHAIN_LEN, 3), frames are only read from disk when indexed
+    # a run that stopped early has only the save points it reached. a run interrupted before finishing still has the unwritten frames, as zeros
+def load_trajectory(path):
+    return np.load(path, mmap_mode='r')
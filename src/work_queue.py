@@ -0,0 +1,302 @@
+import collections
+import hashlib
+import json
+import multiprocessing as mp
+import ipaddress
+import queue
+import socket
+import threading
+import time
+import traceback
+from multiprocessing.connection import Listener, Client
+from . import config
+from . import result_cache
+
+# configuration values a worker must share with the coordinator, on top of result_cache.SYSTEM_PARAMETERS,
+# as whole configurations are run from them in the batched modes
+SWEEP_PARAMETERS = ('TEMPERATURES', 'C_INTERACTIONS', 'BATCH_REPLICAS', 'PARALLEL_TEMPERING', 'SWAP_INTERVAL')
+
+# function to summarize the configuration and code a process would run jobs with
+# a worker with a different config.py or source than the coordinator would return different results, so it is turned away.
+# args: none
+# returns: hex digest of the system and sweep parameters and the code version
+def fingerprint():
+    parameters = {name: repr(getattr(config, name)) for name in result_cache.SYSTEM_PARAMETERS + SWEEP_PARAMETERS}
+    parameters["code"] = result_cache.code_version()
+    return hashlib.sha256(json.dumps(parameters, sort_keys=True).encode()).hexdigest()
+
+#define class Coordinator, which hands out units of work to worker processes over TCP and collects their results
+#workers on any host connect with run_worker, and repeatedly request a unit of work, run it and send back the result.
+#while running, workers send a heartbeat every config.HEARTBEAT_INTERVAL seconds. the work of a worker that disconnects,
+#or sends nothing for config.WORKER_TIMEOUT seconds, is put back at the front of the queue for another worker.
+#messages are pickled and authenticated with config.COORDINATOR_AUTHKEY, so anyone holding the key can run code on the coordinator and its workers.
+#the default key is public, so a coordinator using it refuses to listen beyond the loopback interface. only run workers on networks you trust with the key.
+#   worker -> coordinator: ("hello", fingerprint), ("request",), ("heartbeat",), ("result", work_id, result), ("error", work_id, traceback)
+#   coordinator -> worker: ("work", work_id, work_function, work_item), ("wait", seconds), ("stop", reason)
+class Coordinator:
+
+    # method to start listening for workers
+    # args: self, work_function - picklable function run on every work item (e.g. sweep.run_job), it is sent by reference so workers must have the same code
+    #       work_items - list of picklable arguments, one per unit of work
+    #       address - (host, port) to listen on, use host '0.0.0.0' to accept workers from other machines. None for (config.COORDINATOR_HOST, config.COORDINATOR_PORT)
+    #       authkey - bytes shared with the workers, None for config.COORDINATOR_AUTHKEY
+    #       local_workers - number of worker processes to start on this machine, initializer, initargs - passed to them (see run_worker)
+    # no return value
+    # stores: the queue of work, the work assigned to each worker and the results, the local worker processes, and a background thread accepting connections
+    # raises ValueError if listening beyond the loopback interface with config.DEFAULT_COORDINATOR_AUTHKEY
+    def __init__(self, work_function, work_items, address=None, authkey=None, local_workers=0, initializer=None, initargs=()):
+        address = (config.COORDINATOR_HOST, config.COORDINATOR_PORT) if address is None else address
+        authkey = config.COORDINATOR_AUTHKEY if authkey is None else authkey
+        if authkey == config.DEFAULT_COORDINATOR_AUTHKEY and not is_loopback(address[0]):
+            raise ValueError(f"refusing to accept workers on {address[0]} with the default authkey, set the BRUSH_COORDINATOR_AUTHKEY environment variable on the coordinator and every worker")
+
+        self.work_function = work_function
+        self.work_items = list(work_items)
+        self.fingerprint = fingerprint()
+
+        # work ids (indexes into work_items) not yet handed out, ids of finished work, and the work ids and last message time of each connected worker
+        self.pending = collections.deque(range(len(self.work_items)))
+        self.finished = set()
+        self.workers = {}
+        self.lock = threading.Lock()
+
+        # results and errors are passed from the connection threads to results() through a queue
+        self.completed = queue.Queue()
+        self.closed = False
+
+        self.listener = Listener(address, authkey=authkey)
+        self.address = self.listener.address
+
+        # local workers are forked before this process starts any threads, as a thread holding a lock during the fork would leave it locked in the worker
+        self.local_workers = start_local_workers(self.address, local_workers, authkey, initializer, initargs)
+        threading.Thread(target=self.accept, daemon=True).start()
+
+    # method run by the background thread, starting a thread to serve each worker that connects
+    # args: self
+    # no return value
+    def accept(self):
+        worker_id = 0
+        while not self.closed:
+            try:
+                connection = self.listener.accept()
+            except (OSError, EOFError, mp.AuthenticationError):
+                # a failed handshake (e.g. wrong authkey) only affects that worker, the listener closing ends the loop
+                continue
+            worker_id += 1
+            threading.Thread(target=self.serve, args=(worker_id, connection), daemon=True).start()
+
+    # method run by a connection thread, answering the messages of one worker until it disconnects
+    # args: self, worker_id - number identifying the worker, connection - its multiprocessing connection
+    # no return value
+    def serve(self, worker_id, connection):
+        try:
+            while True:
+                message = connection.recv()
+
+                # a worker presumed dead after a timeout is registered again when it is heard from
+                with self.lock:
+                    self.workers.setdefault(worker_id, {"work_ids": set()})["last_seen"] = time.monotonic()
+
+                if message[0] == "hello":
+                    if message[1] != self.fingerprint:
+                        connection.send(("stop", "worker configuration or code differs from the coordinator"))
+                        break
+                elif message[0] == "request":
+                    connection.send(self.next_work(worker_id))
+                elif message[0] in ("result", "error"):
+                    self.complete(worker_id, message)
+        except (EOFError, OSError):
+            pass
+        finally:
+            # the worker disconnected or died, anything it was still running is given to another worker
+            self.requeue(worker_id)
+            connection.close()
+
+    # method to hand out the next unit of work to a worker
+    # args: self, worker_id - worker requesting work
+    # returns: message to send to the worker
+    def next_work(self, worker_id):
+        with self.lock:
+            if self.pending:
+                work_id = self.pending.popleft()
+                self.workers[worker_id]["work_ids"].add(work_id)
+                return ("work", work_id, self.work_function, self.work_items[work_id])
+
+            if self.closed or len(self.finished) == len(self.work_items):
+                return ("stop", "all work finished")
+
+        # everything is handed out, but wait in case work of a failed worker is put back
+        return ("wait", config.HEARTBEAT_INTERVAL)
+
+    # method to record a result or error sent by a worker
+    # work can be handed out twice if its worker was presumed dead, only the first result is kept.
+    # args: self, worker_id - worker that sent the message, message - ("result", work_id, result) or ("error", work_id, traceback)
+    # no return value
+    def complete(self, worker_id, message):
+        kind, work_id, value = message
+        with self.lock:
+            if worker_id in self.workers:
+                self.workers[worker_id]["work_ids"].discard(work_id)
+            if work_id in self.finished:
+                return
+            self.finished.add(work_id)
+
+            # a copy handed to another worker after a timeout no longer needs to run
+            if work_id in self.pending:
+                self.pending.remove(work_id)
+
+        self.completed.put((kind, work_id, value))
+
+    # method to put the unfinished work of a worker back at the front of the queue
+    # args: self, worker_id - worker that disconnected or timed out
+    # no return value
+    def requeue(self, worker_id):
+        with self.lock:
+            worker = self.workers.pop(worker_id, None)
+            if worker is None:
+                return
+            for work_id in sorted(worker["work_ids"], reverse=True):
+                if work_id not in self.finished:
+                    self.pending.appendleft(work_id)
+
+    # method to requeue the work of every worker that has not sent anything for config.WORKER_TIMEOUT seconds
+    # a worker that later recovers is served as normal, and its result is used if it is still the first.
+    # args: self
+    # no return value
+    def requeue_timed_out(self):
+        now = time.monotonic()
+        with self.lock:
+            timed_out = [worker_id for worker_id, worker in self.workers.items() if now - worker["last_seen"] > config.WORKER_TIMEOUT]
+        for worker_id in timed_out:
+            print(f"Worker {worker_id} timed out, requeueing its work")
+            self.requeue(worker_id)
+
+    # method to wait for the results of all work, yielding them in the order they finish
+    # args: self
+    # returns: generator of the result of each work item, like multiprocessing.Pool.imap_unordered
+    # raises RuntimeError with the worker's traceback if a work item failed
+    def results(self):
+        for _ in range(len(self.work_items)):
+            while True:
+                # checked on every pass, so a dead worker's work is requeued even while other workers keep finishing theirs
+                self.requeue_timed_out()
+                try:
+                    kind, work_id, value = self.completed.get(timeout=config.HEARTBEAT_INTERVAL)
+                    break
+                except queue.Empty:
+                    pass
+
+            if kind == "error":
+                raise RuntimeError(f"work item {self.work_items[work_id]!r} failed on a worker:\n{value}")
+            yield value
+
+    # method to stop handing out work and stop listening, workers are told to stop at their next request
+    # args: self
+    # no return value
+    def close(self):
+        self.closed = True
+        self.listener.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+# function to check whether a host name or address only reaches this machine
+# args: host - host name or IP address a listener binds to, '' or '0.0.0.0' for every interface
+# returns: True for loopback addresses such as localhost or 127.0.0.1, False otherwise or if the name does not resolve
+def is_loopback(host):
+    try:
+        return ipaddress.ip_address(socket.gethostbyname(host)).is_loopback if host else False
+    except (OSError, ValueError):
+        return False
+
+# function to connect to a coordinator, retrying while it starts up
+# args: address - (host, port) of the coordinator, authkey - bytes shared with the coordinator
+# returns: multiprocessing connection
+# raises ConnectionRefusedError if the coordinator cannot be reached within config.WORKER_CONNECT_TIMEOUT seconds
+def connect(address, authkey):
+    deadline = time.monotonic() + config.WORKER_CONNECT_TIMEOUT
+    while True:
+        try:
+            return Client(address, authkey=authkey)
+        except ConnectionRefusedError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.5)
+
+# function to run a worker, pulling work from a coordinator until it has no more
+# a background thread sends a heartbeat every config.HEARTBEAT_INTERVAL seconds, so the coordinator knows the worker is alive during long work.
+# args: address - (host, port) of the coordinator, authkey - bytes shared with the coordinator, None for the config.COORDINATOR_* settings
+#       initializer, initargs - optional function called with initargs before any work, as for multiprocessing.Pool
+# returns: number of work items run
+def run_worker(address=None, authkey=None, initializer=None, initargs=()):
+    address = (config.COORDINATOR_HOST, config.COORDINATOR_PORT) if address is None else address
+    authkey = config.COORDINATOR_AUTHKEY if authkey is None else authkey
+    if initializer is not None:
+        initializer(*initargs)
+
+    connection = connect(address, authkey)
+
+    # the heartbeat thread and this thread both send, so sends are locked. only this thread receives.
+    send_lock = threading.Lock()
+    stopped = threading.Event()
+
+    def send(message):
+        with send_lock:
+            connection.send(message)
+
+    def heartbeat():
+        while not stopped.wait(config.HEARTBEAT_INTERVAL):
+            try:
+                send(("heartbeat",))
+            except OSError:
+                return
+
+    threading.Thread(target=heartbeat, daemon=True).start()
+
+    work_done = 0
+    try:
+        send(("hello", fingerprint()))
+        while True:
+            send(("request",))
+            message = connection.recv()
+
+            if message[0] == "stop":
+                print(f"Worker stopping: {message[1]}")
+                break
+            if message[0] == "wait":
+                time.sleep(message[1])
+                continue
+
+            _, work_id, work_function, work_item = message
+            try:
+                send(("result", work_id, work_function(work_item)))
+            except Exception:
+                send(("error", work_id, traceback.format_exc()))
+            work_done += 1
+    except (EOFError, OSError):
+        # the coordinator closed, there is nothing more to do
+        pass
+    finally:
+        stopped.set()
+        connection.close()
+
+    return work_done
+
+# function to start worker processes on this machine, e.g. to use its cores alongside remote workers or to test the work queue
+# with the fork start method the processes share the caller's configuration, and must be started before the caller starts any threads.
+# args: address - (host, port) of the coordinator, num_workers - number of processes to start
+#       authkey, initializer, initargs - as for run_worker
+# returns: list of started multiprocessing.Process
+def start_local_workers(address, num_workers, authkey=None, initializer=None, initargs=()):
+    authkey = config.COORDINATOR_AUTHKEY if authkey is None else authkey
+    # connect to the coordinator's loopback address even if it listens on all interfaces
+    host, port = address
+    address = ('localhost' if host in ('', '0.0.0.0') else host, port)
+
+    workers = [mp.Process(target=run_worker, args=(address, authkey, initializer, initargs), daemon=True) for _ in range(num_workers)]
+    for worker in workers:
+        worker.start()
+    return workers
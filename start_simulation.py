@@ -1,135 +1,142 @@
 from src import *
+import argparse
 import time
-import copy
 import multiprocessing as mp
 
-# get the half the total number of saves made, for calculating equilibrium density.
-half_saves = int(TIMES_TO_SAVE/2)
-
-# funtion to run monte-carlo simulations for a new starting configuration, for each temperature, c_int, and polymer type.
-# args: config_index (just a unique identifier integer for one of the 10 generated starting configurations)
-# returns: dictionary of results for all configurations.
-def run_single_configuration(config_index):
-        
-    # Initialize a new instance of Brush class
-    original_brush = brush.Brush()
-
-    # initialize a new random number generator for this configuration, using the config_index as the seed.
-    # fixes: all results being the same due to time based-rng having the same values for parallel processes.
-    rng = np.random.default_rng(config_index)
-
-    # Generate new Starting positions
-    original_brush.initialize_positions(rng)
-
-    results = []
-    
-    # Loop through all possible parameter combinations
-    # Run the Monte Carlo for each temperature and interaction constant
-    for temperature in TEMPERATURES:
-        for c_int in C_INTERACTIONS:
-            # Run the Monte Carlo for both types of Brush: block and alternating
-            for is_block in [True, False]:
-
-                # Create a deep copy of the original brush to preserve the initial state
-                brush_copy = copy.deepcopy(original_brush)
-
-                # Set the interaction constant for this simulation
-                brush_copy.c_int = c_int
-
-                # Set the type of polymer, block or alternating for this simulation
-                brush_copy.set_type(is_block)
-
-                # Initialize the energies for this brush.
-                brush_copy.initialize_energies()
-
-                # Run the monte carlo simulation and get the densities
-                densities = run_monte_carlo(brush_copy, temperature, rng)
-
-                # Calculate equilibrium statistics using last 50,000 steps (50 save points)
-                equilibrium_density = np.mean(densities[-half_saves:])
-                equilibrium_variance = np.var(densities[-half_saves:])
-                               
-                results.append({
-                    "c_int" : c_int,
-                    "temperature" : temperature,
-                    "is_block" : is_block,
-                    "densities" : densities,
-                    "equilibrium_density": equilibrium_density,
-                    "equilibrium_variance" : equilibrium_variance
-                })
-                
-                # Print that the simulation is complete
-                print(f"Configuration:{config_index} Interaction Constant:{c_int} Temperature:{temperature} Is block:{is_block}")
-
-    # Return structure:
-    #   {
-    #     "config_index": int,                 # Index identifying the initial configuration
-    #     "results": [{
-    #         "c_int": float,                  # Interaction parameter
-    #         "temperature": float,            # Temperature parameter
-    #         "is_block": bool,                # True for block polymer, False for alternating
-    #         "densities": List[float],        # List of density values at each save point
-    #         "equilibrium_density": float,    # Final equilibrium density
-    #         "equilibrium_variance": float    # Variance in equilibrium density
-    #       },
-    #       ...more results for different parameter sets with the same initial configuration, 12 total...
-    #      ]
-    #   }
-    return {"config_index" : config_index,
-            "results" : results}
-    
-                    
-
-def main():
+# funtion to run the whole parameter sweep on a process pool and export the results
+# every (configuration, temperature, c_int, type) job is scheduled independently, longest first, and collected as it completes.
+# every job has its own random number generator spawned from its parameters, so results do not depend on scheduling order.
+# a restarted sweep continues where it stopped: jobs already in the results stream are skipped. fresh=True starts a new stream instead.
+# args: fresh - if True, overwrite the results stream of an earlier sweep, and without config.RESULT_CACHE, rerun the jobs it finished
+def main(fresh=False):
     # Record the overall start time of simulation
     start_time = time.time()
+
+    # Split the sweep into units of work
+    # normally every parameter variant is an independent job,
+    # batched modes advance all variants of a configuration together, so a whole configuration is one unit of work.
+    # every job result is appended to the results stream as soon as it arrives, and not kept in this process,
+    # so memory stays flat as the sweep grows and the stream can be analysed while the sweep runs (see results_stream.read_results)
+    sweep_jobs = build_jobs(range(config.STARTING_CONFIGURATIONS))
+    batched = config.BATCH_REPLICAS or config.PARALLEL_TEMPERING
+    # refuse options the batched modes would ignore before any work starts
+    check_batched_options()
+    if fresh:
+        # without the cache, results kept by an interrupted run of the same sweep must not be reused either
+        if not config.RESULT_CACHE:
+            result_cache.discard(sweep_jobs)
+        finished = set()
+    else:
+        finished = results_stream.finished_jobs(config.RESULTS_STREAM_FILENAME)
+        if finished:
+            print(f"Resuming the sweep in {config.RESULTS_STREAM_FILENAME}, {len(finished)} jobs already finished")
+
+    # independent job results only depend on the system and code, so the stream is continued by a sweep with more (or fewer) temperatures, interaction constants
+    # or configurations, and only the new jobs run. in the batched modes every result depends on all the variants run with it, so the stream belongs to exactly this sweep.
+    sweep_id = work_queue.fingerprint() if batched else result_cache.system_version()
+    results_writer = results_stream.ResultsWriter(config.RESULTS_STREAM_FILENAME, resume=not fresh, sweep=sweep_id)
+
+    if batched:
+        work_function = run_single_configuration
+        # a configuration is run again unless every one of its jobs is in the stream, only its missing results are written
+        work_items = sorted({job["config_index"] for job in sweep_jobs if results_stream.job_identity(job) not in finished})
+    else:
+        work_function = run_job
+        # only run the jobs without a kept result, from an interrupted run of this sweep or (with the cache) an earlier sweep
+        cached_results, missing_jobs = result_cache.split_cached([job for job in sweep_jobs if results_stream.job_identity(job) not in finished])
+        for result in cached_results:
+            results_writer.write(result)
+        if cached_results:
+            print(f"Reusing {len(cached_results)} finished job results from {config.RESULT_CACHE_FOLDERNAME}")
+
+        # dispatch the most expensive jobs first, so the pool is not left waiting on a long job at the end
+        work_items = sorted(missing_jobs, key=estimate_job_cost, reverse=True)
+
+    # jobs of a configuration are spread over every worker by the longest first dispatch, so build each starting configuration once here and send it to every worker.
+    # a batched unit of work is a whole configuration, which its worker builds itself.
+    configurations = {} if batched else build_configurations(sorted({job["config_index"] for job in work_items}))
     
     # Determine optimal number of processes based on CPU cores
-    # Assign one starting configuration to one CPU core, whichever is less.
+    # Assign one unit of work to one CPU core, whichever is less.
     num_system_cpu = mp.cpu_count()
-    num_processes = min(STARTING_CONFIGURATIONS, num_system_cpu)
-    print(f"Starting parallel simulation with {num_processes}/{num_system_cpu} CPU cores...")
+    num_processes = max(1, min(len(work_items), num_system_cpu))
+    print(f"Starting parallel simulation of {len(work_items)} {'configurations' if batched else 'jobs'} with {num_processes}/{num_system_cpu} CPU cores...")
     
-    # Create a process pool to handle parallel processing
-    with mp.Pool(processes=num_processes) as pool:
-
-        # Initialize list to store all dictionaries of simulation results
-        all_results = []
-
-        # .map assigns a configuration number to each processor, and runs 1 configuration on each processor for the number of starting configurations there are
-        # e.g, run_single_configuration(1), run_single_configuration(2)... run_single_configuration(STARTING_CONFIGURATIONS-1) 1 to each processor.
-        # remaining tasks wait in a queue 
-        # return from run_single_configuration is stored the list of all_results
-        # all_results: List[Dict]
-        # [{
-        #     "config_index": int,
-        #     "results": [{
-        #         "c_int": float,
-        #         "temperature": float,
-        #         "is_block": bool,                
-        #         "densities": List[float],
-        #         "equilibrium_density": float,
-        #         "equilibrium_variance": float 
-        #     },
-        #     ...more results for different parameter sets with the same initial configuration, 12 total...
-        #    ]
-        #  },
-        # ...more different initial configurations 10 total...
-        # ]
-        for configuration_results in pool.map(run_single_configuration, range(STARTING_CONFIGURATIONS)):
-                all_results.append(configuration_results)
+    # with instrumentation, every worker streams its metrics to a collector in this process through a queue
+    metrics_collector = None
+    metrics_queue = None
+    if config.INSTRUMENTATION:
+        metrics_queue = mp.Queue()
+        metrics_collector = instrumentation.MetricsCollector(metrics_queue, config.METRICS_FILENAME)
+    pool_options = {"initializer": initialize_worker, "initargs": (configurations, metrics_queue)}
+
+    # Create a process pool to handle parallel processing, or a coordinator handing out work to workers on any number of hosts
+    if config.DISTRIBUTED:
+        num_local_workers = num_system_cpu if config.LOCAL_WORKERS is None else config.LOCAL_WORKERS
+        executor = work_queue.Coordinator(work_function, work_items, (config.COORDINATOR_HOST, config.COORDINATOR_PORT), config.COORDINATOR_AUTHKEY,
+                                          num_local_workers, **pool_options)
+        print(f"Coordinator listening on {executor.address} with {num_local_workers} local workers, start more with start_worker.py")
+    else:
+        executor = mp.Pool(processes=num_processes, **pool_options)
+
+    progress = results_stream.Progress(len(work_items))
+    with executor, results_writer:
+
+        # .imap_unordered hands the next unit of work to whichever process becomes free, one at a time (chunksize=1),
+        # and yields results in the order they complete. the coordinator's results() does the same across all its workers.
+        completed_work = executor.results() if config.DISTRIBUTED else executor.imap_unordered(work_function, work_items, chunksize=1)
+        for work_results in completed_work:
+            # a configuration returns a list of job results, a single job returns one result
+            work_results = work_results if batched else [work_results]
+            for result in work_results:
+                if results_stream.job_identity(result) not in finished:
+                    results_writer.write(result)
+
+            # Print that the simulation is complete, with the progress of the sweep and an estimate of the time left
+            progress_line = progress.update()
+            for result in work_results:
+                print(f"{progress_line} Configuration:{result['config_index']} Interaction Constant:{result['c_int']} Temperature:{result['temperature']} Is block:{result['is_block']}")
+
+    # read the finished sweep back from the stream, grouped by configuration in canonical order, independent of completion order
+    # results of configurations beyond STARTING_CONFIGURATIONS, from an earlier run with more of them, are left out
+    sweep_identities = {results_stream.job_identity(job) for job in sweep_jobs}
+    all_results = collect_results(result for result in results_stream.read_results(config.RESULTS_STREAM_FILENAME) if results_stream.job_identity(result) in sweep_identities)
+
+    # keep the cache within its size limit without touching this sweep's results, or without the cache, drop this sweep's results now it has finished
+    if config.RESULT_CACHE:
+        result_cache.evict(config.RESULT_CACHE_MAX_BYTES, sweep_jobs)
+    else:
+        result_cache.discard(sweep_jobs)
                        
     # Calculate total runtime
     total_runtime = time.time() - start_time
     print(f"All Monte Carlo simulations complete. \nTotal simulation runtime: {total_runtime}s")
 
+    # report the aggregated metrics of every run
+    if metrics_collector is not None:
+        metrics_summary = metrics_collector.stop()
+        print(f"Metrics of {metrics_summary['runs']} runs written to {config.METRICS_FILENAME}: "
+              f"{metrics_summary['steps_per_second']:.0f} steps/s per process, "
+              f"time in proposal {metrics_summary['proposal_fraction']:.1%} / energy {metrics_summary['energy_fraction']:.1%} / accept {metrics_summary['accept_fraction']:.1%}, "
+              f"accepted {metrics_summary['acceptance_rate']:.1%}, rejected by surface {metrics_summary['rejected_surface_rate']:.1%} / spring {metrics_summary['rejected_spring_rate']:.1%} / interaction {metrics_summary['rejected_interaction_rate']:.1%}")
+
     # generate graphs and csv file
     print(f"Exporting results to {config.RESULTS_FOLDERNAME}...")
-    plot_and_save_data(all_results)
+    # results_analysis (and matplotlib) is only imported here, so worker processes importing this module stay headless
+    from src import results_analysis
+    results_analysis.plot_and_save_data(all_results)
     print(f"complete.")
 
 if __name__ == "__main__":
     # Enable multiprocessing support for windows
     mp.freeze_support()
-    main() 
-    
\ No newline at end of file
+
+    # choose how worker processes are started. the forkserver imports the simulation modules once, and forks every worker from that small headless process
+    if config.WORKER_START_METHOD is not None:
+        mp.set_start_method(config.WORKER_START_METHOD)
+        if config.WORKER_START_METHOD == 'forkserver':
+            mp.set_forkserver_preload(config.FORKSERVER_PRELOAD)
+
+    parser = argparse.ArgumentParser(description="Run the polymer brush parameter sweep, continuing an interrupted one")
+    parser.add_argument("--fresh", action="store_true", help="start a new sweep, overwriting the results stream of the last one")
+    main(parser.parse_args().fresh)
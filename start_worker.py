@@ -0,0 +1,17 @@
+from src import config, work_queue
+import sys
+
+# funtion to run a worker of a distributed sweep on this host, pulling work from the coordinator started by start_simulation.py with config.DISTRIBUTED
+# the worker must have the same code and config.py as the coordinator, it is turned away otherwise,
+# and the same BRUSH_COORDINATOR_AUTHKEY environment variable, as a coordinator with the default key only accepts workers on its own machine.
+# usage: python start_worker.py [coordinator host] [coordinator port]
+def main():
+    host = sys.argv[1] if len(sys.argv) > 1 else config.COORDINATOR_HOST
+    port = int(sys.argv[2]) if len(sys.argv) > 2 else config.COORDINATOR_PORT
+
+    print(f"Connecting to coordinator at {host}:{port}...")
+    work_done = work_queue.run_worker((host, port), config.COORDINATOR_AUTHKEY)
+    print(f"Worker finished after {work_done} units of work.")
+
+if __name__ == "__main__":
+    main()
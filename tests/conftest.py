@@ -0,0 +1,20 @@
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src import config, sweep
+
+# settings of a brush small enough for a sweep of several jobs to run in seconds, writing nothing to disk unless a test turns it on
+SMALL_SYSTEM = {"NUM_CHAINS": 8, "CHAIN_LEN": 6, "BASE_LEN_X": 4, "BASE_LEN_Y": 4, "DENSITY_VOLUME": 4 * 4 * config.DENSITY_CALC_Z_BOUNDARY,
+                "ITERATIONS_BETWEEN_SAVES": 1000, "TIMES_TO_SAVE": 10, "TARGET_STANDARD_ERROR": None,
+                "CHECKPOINTING": False, "RESULT_CACHE": False, "SAVE_TRAJECTORIES": False, "INSTRUMENTATION": False}
+
+# fixture to run a test with the small system configuration, restoring the configuration afterwards
+@pytest.fixture
+def small_system(monkeypatch):
+    for name, value in SMALL_SYSTEM.items():
+        monkeypatch.setattr(config, name, value)
+    sweep.initialize_configuration.cache_clear()
+    yield
+    sweep.initialize_configuration.cache_clear()
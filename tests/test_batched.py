@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+
+from src import brush, config, monte_carlo, sweep
+
+# fixture to run the batched modes on the small system, with the per-job options they do not support turned off
+@pytest.fixture
+def batched_system(small_system, monkeypatch):
+    monkeypatch.setattr(config, "BATCH_REPLICAS", True)
+    monkeypatch.setattr(config, "TIMES_TO_SAVE", 3)
+
+# function to stack a replica of every c_int and type variant of the first starting configuration
+# args: move_size - move size given to every variant
+# returns: brush.BatchedBrush
+def batched_brush(move_size=1.0):
+    variant_brushes = [sweep.prepare_variant(sweep.initialize_configuration(0), c_int, is_block) for c_int in (1, -0.5) for is_block in (False, True)]
+    for variant_brush in variant_brushes:
+        variant_brush.move_size = move_size
+    return brush.BatchedBrush(variant_brushes)
+
+# test that a batched run keeps the energy caches of every replica consistent with a recalculation from scratch
+def test_batched_energies_match_from_scratch(batched_system, monkeypatch):
+    monkeypatch.setattr(config, "ENERGY_CHECK_INTERVAL", 0)
+    test_brush = batched_brush()
+    initial_positions = test_brush.particle_positions.copy()
+    monte_carlo.run_batched_monte_carlo(test_brush, [0.5, 1, 2, 1], np.random.default_rng(0))
+    assert np.all(np.any(test_brush.particle_positions != initial_positions, axis=(1, 2, 3)))
+
+    spring_energies, surface_energies, interaction_energies, total_energy = test_brush.calc_energies_from_scratch()
+    np.testing.assert_allclose(test_brush.spring_energies, spring_energies, atol=1e-9)
+    np.testing.assert_allclose(test_brush.surface_energies, surface_energies, atol=1e-9)
+    np.testing.assert_allclose(test_brush.interaction_energies, interaction_energies, atol=1e-9)
+    np.testing.assert_allclose(test_brush.total_energy, total_energy, rtol=0, atol=1e-8)
+
+    assert np.all(np.abs(test_brush.check_energy_drift()) < 1e-8)
+    assert np.all(test_brush.max_energy_drift < 1e-8)
+
+# test that the batched moves are drawn with the shared move size of the replicas
+def test_batched_moves_use_move_size(batched_system):
+    test_brush = batched_brush(move_size=0.01)
+    rng = np.random.default_rng(1)
+    for _ in range(50):
+        # at a very high temperature every step moves one particle of every replica
+        initial_positions = test_brush.particle_positions.copy()
+        monte_carlo.run_batched_steps(test_brush, np.full(test_brush.num_replicas, 1e6), rng, 1, False)
+        displacements = np.max(np.abs(test_brush.particle_positions - initial_positions), axis=(1, 2, 3))
+        assert np.all((0 < displacements) & (displacements <= 0.01))
+
+# test that a drifted replica is found and resynchronised by the energy check, leaving the other replicas alone
+def test_batched_energy_check_corrects_drift(batched_system):
+    test_brush = batched_brush()
+    total_energy = test_brush.total_energy.copy()
+    test_brush.total_energy[1] += 1
+
+    with pytest.warns(UserWarning):
+        drift = test_brush.check_energy_drift()
+    assert drift[1] == pytest.approx(1)
+    np.testing.assert_allclose(test_brush.total_energy, total_energy, rtol=0, atol=1e-8)
+
+# test that every option the batched modes would ignore is refused with an error naming it, and that the batched modes run once they are off
+@pytest.mark.parametrize("name, value", [("CHECKPOINTING", True), ("ADAPTIVE_MOVE_SIZE", True), ("MONTE_CARLO_ENGINE", 'checkerboard'),
+                                         ("TARGET_STANDARD_ERROR", 0.01), ("MULTIPLE_TRY_TRIALS", 4), ("MOVE_WEIGHTS", {'single': 0.9, 'pivot': 0.1})])
+def test_unsupported_batched_options_are_refused(batched_system, monkeypatch, name, value):
+    monkeypatch.setattr(config, "C_INTERACTIONS", [1])
+    monkeypatch.setattr(config, "TEMPERATURES", [1])
+    assert len(sweep.run_single_configuration(0)) == 2
+
+    monkeypatch.setattr(config, name, value)
+    with pytest.raises(ValueError, match=f"config.{name}"):
+        sweep.run_single_configuration(0)
@@ -0,0 +1,21 @@
+import json
+import queue
+import numpy as np
+
+from src import config, instrumentation
+
+# test that a collector built without a path writes the configured metrics file and totals the run summaries
+def test_collector_writes_default_metrics_file(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    metrics_queue = queue.Queue()
+    collector = instrumentation.MetricsCollector(metrics_queue)
+
+    run_record = dict.fromkeys(instrumentation.RunMetrics.COUNTERS, 2)
+    run_record.update(type="run", job="test", save_number=0, steps=10, accepted=4)
+    metrics_queue.put(json.dumps(run_record))
+    summary = collector.stop()
+
+    assert summary["runs"] == 1
+    assert np.isclose(summary["acceptance_rate"], 0.4)
+    with open(config.METRICS_FILENAME) as file:
+        assert [json.loads(line)["job"] for line in file] == ["test"]
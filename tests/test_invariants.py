@@ -0,0 +1,188 @@
+import warnings
+import numpy as np
+import pytest
+
+from src import checkpoint, config, monte_carlo, moves, sweep
+
+# function to get a brush of the small system that has been run for a while, so its chains are no longer straight
+# args: c_int, is_block - variant of the brush, saves - save intervals to run it for, seed - seed of the run
+# returns: brush.Brush
+def mixed_brush(c_int=1, is_block=False, saves=2, seed=0):
+    test_brush = sweep.prepare_variant(sweep.initialize_configuration(0), c_int, is_block)
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setattr(config, "TIMES_TO_SAVE", saves)
+        monte_carlo.run_monte_carlo(test_brush, 1, np.random.default_rng(seed))
+    return test_brush
+
+# function to check that the energy caches of a brush match the energies recalculated from its positions
+# args: test_brush - brush.Brush
+# no return value
+def assert_energies_consistent(test_brush):
+    spring_energies, surface_energies, interaction_energies, total_energy = test_brush.calc_energies_from_scratch()
+    np.testing.assert_allclose(test_brush.spring_energies, spring_energies, atol=1e-9)
+    np.testing.assert_allclose(test_brush.surface_energies, surface_energies, atol=1e-9)
+    np.testing.assert_allclose(test_brush.interaction_energies, interaction_energies, atol=1e-9)
+    assert abs(test_brush.total_energy - total_energy) < 1e-8
+
+# test that the cell list candidates of a position include every particle within the interaction radius, as found by a brute-force search
+def test_cell_list_matches_brute_force(small_system):
+    test_brush = mixed_brush()
+    flat_positions = test_brush.particle_positions.reshape(-1, 3)
+    buffer = np.zeros(len(flat_positions), dtype=np.intp)
+
+    rng = np.random.default_rng(1)
+    positions = np.concatenate((flat_positions, rng.uniform(-1, config.BASE_LEN_X + 1, size=(50, 3))))
+    for position in positions:
+        within_radius = set(np.flatnonzero(np.linalg.norm(flat_positions - position, axis=1) < config.R_SIZE).tolist())
+        candidates = test_brush.cell_list.neighbours(position)
+        assert within_radius <= set(candidates.tolist())
+
+        # the buffered lookup gives the same candidates in the same order, without the excluded particle
+        num_candidates = test_brush.cell_list.neighbours_into(position, buffer, exclude=0)
+        np.testing.assert_array_equal(buffer[:num_candidates], candidates[candidates != 0])
+
+    # the union lookup of several positions lists every candidate of each of them once
+    union = test_brush.cell_list.neighbours_union(positions[:5])
+    assert len(union) == len(set(union.tolist()))
+    assert set(union.tolist()) == set(np.concatenate([test_brush.cell_list.neighbours(position) for position in positions[:5]]).tolist())
+
+# test that the per-particle interaction totals and total energy updated by every accepted move match a recalculation from scratch after many steps
+# the periodic energy check is turned off, so no resynchronisation can hide drift
+@pytest.mark.parametrize("c_int, is_block", [(1, False), (-0.5, True)])
+def test_incremental_energies_match_from_scratch(small_system, monkeypatch, c_int, is_block):
+    monkeypatch.setattr(config, "ENERGY_CHECK_INTERVAL", 0)
+    test_brush = mixed_brush(c_int, is_block, saves=5)
+    assert test_brush.accepted_moves > 0
+    assert_energies_consistent(test_brush)
+
+# test that a move rejected early by test_move would also be rejected by the Metropolis test on its full delta_e, and that every other move
+# gets exactly the full delta_e, so the early rejection stages never change an accept/reject decision
+@pytest.mark.parametrize("temperature", [0.2, 1, 5])
+def test_early_rejection_makes_same_decisions(small_system, temperature):
+    test_brush = mixed_brush()
+    rng = np.random.default_rng(2)
+    num_early_rejections = 0
+    for _ in range(2000):
+        chain_idx, particle_idx, move_dir = rng.integers(config.NUM_CHAINS), rng.integers(config.CHAIN_LEN), rng.integers(3)
+        move_magnitude, acceptance_uniform = rng.uniform(-3, 3), rng.random()
+
+        full_delta_e = test_brush.test_move(chain_idx, particle_idx, move_dir, move_magnitude)
+        delta_e = test_brush.test_move(chain_idx, particle_idx, move_dir, move_magnitude, monte_carlo.rejection_threshold(acceptance_uniform, temperature))
+        if delta_e == np.inf:
+            num_early_rejections += 1
+            assert test_brush.pending_move is None
+            assert not acceptance_uniform < np.exp(-full_delta_e / temperature)
+        else:
+            assert delta_e == full_delta_e
+
+    assert num_early_rejections > 0
+
+# test that the delta_e of every collective chain move matches the change of the total energy recalculated from scratch once the move is applied,
+# and that the energy caches stay consistent after the moves are accepted
+@pytest.mark.parametrize("move_type", sorted(moves.PROPOSALS))
+def test_segment_move_delta_e_matches_from_scratch(small_system, move_type):
+    test_brush = mixed_brush()
+    rng = np.random.default_rng(3)
+    num_accepted = 0
+    for _ in range(200):
+        proposal = moves.PROPOSALS[move_type](test_brush, rng)
+        if proposal is None:
+            continue
+
+        delta_e = test_brush.test_segment_move(*proposal)
+        # moves into the surface are left out, their +1e9 would hide the rounding of the other terms
+        if delta_e > 1e3:
+            continue
+
+        old_total_energy = test_brush.calc_energies_from_scratch()[3]
+        test_brush.accept_segment_move()
+        num_accepted += 1
+        assert delta_e == pytest.approx(test_brush.calc_energies_from_scratch()[3] - old_total_energy, abs=1e-8)
+
+    assert num_accepted > 0
+    assert_energies_consistent(test_brush)
+
+# test that the multiple-try energies of every trial position match the single move delta_e of the same position,
+# and that the energy caches stay consistent over a multiple-try run
+def test_multiple_try_energies_consistent(small_system, monkeypatch):
+    monkeypatch.setattr(config, "ENERGY_CHECK_INTERVAL", 0)
+    test_brush = mixed_brush()
+    rng = np.random.default_rng(4)
+    for _ in range(200):
+        chain_idx, particle_idx = rng.integers(config.NUM_CHAINS), rng.integers(config.CHAIN_LEN)
+        move_directions, move_magnitudes = rng.integers(0, 3, size=4), rng.uniform(-1, 1, size=4)
+        trial_positions = monte_carlo.displaced_positions(test_brush.particle_positions[chain_idx, particle_idx], move_directions, move_magnitudes)
+
+        trial_delta_es = test_brush.test_trial_positions(chain_idx, particle_idx, trial_positions)
+        single_delta_es = [test_brush.test_move(chain_idx, particle_idx, move_dir, move_magnitude) for move_dir, move_magnitude in zip(move_directions, move_magnitudes)]
+        np.testing.assert_allclose(trial_delta_es, single_delta_es, rtol=1e-9, atol=1e-9)
+
+    accepted_moves = test_brush.accepted_moves
+    with monkeypatch.context() as patch:
+        patch.setattr(config, "TIMES_TO_SAVE", 3)
+        monte_carlo.run_monte_carlo(test_brush, 1, np.random.default_rng(5), multiple_tries=4)
+    assert test_brush.accepted_moves > accepted_moves
+    assert_energies_consistent(test_brush)
+
+# exception raised by a test to stop a run, standing in for a crash or a killed job
+class Interrupted(Exception):
+    pass
+
+# test that a run interrupted after a checkpoint and resumed from it gives exactly the densities, positions, energy and rng state of an uninterrupted run
+@pytest.mark.parametrize("engine", [monte_carlo.run_monte_carlo, monte_carlo.run_checkerboard_monte_carlo])
+def test_checkpoint_resume_is_bit_identical(small_system, monkeypatch, tmp_path, engine):
+    monkeypatch.setattr(config, "TIMES_TO_SAVE", 6)
+    monkeypatch.setattr(config, "CHECKPOINT_INTERVAL", 2)
+    new_brush = lambda: sweep.prepare_variant(sweep.initialize_configuration(0), 1, False)
+
+    expected_brush, expected_rng = new_brush(), np.random.default_rng(6)
+    expected_densities = engine(expected_brush, 1, expected_rng)
+
+    # interrupt the run just after its second checkpoint, in the middle of the run
+    save_checkpoint = checkpoint.save_checkpoint
+    def interrupting_save_checkpoint(path, save_number, *args):
+        save_checkpoint(path, save_number, *args)
+        if save_number == 4:
+            raise Interrupted
+    checkpoint_path = str(tmp_path / "run.checkpoint")
+    with monkeypatch.context() as patch:
+        patch.setattr(checkpoint, "save_checkpoint", interrupting_save_checkpoint)
+        with pytest.raises(Interrupted):
+            engine(new_brush(), 1, np.random.default_rng(6), checkpoint_path=checkpoint_path)
+
+    # the resumed run starts from a fresh brush and a differently seeded rng, so it only matches if everything it continues with comes from the checkpoint
+    resumed_brush, resumed_rng = new_brush(), np.random.default_rng(7)
+    resumed_densities = engine(resumed_brush, 1, resumed_rng, checkpoint_path=checkpoint_path)
+
+    np.testing.assert_array_equal(resumed_densities, expected_densities)
+    np.testing.assert_array_equal(resumed_brush.particle_positions, expected_brush.particle_positions)
+    np.testing.assert_array_equal(resumed_brush.interaction_energies, expected_brush.interaction_energies)
+    assert resumed_brush.total_energy == expected_brush.total_energy
+    assert resumed_rng.bit_generator.state == expected_rng.bit_generator.state
+
+# test that the energy caches updated by the batched moves of the checkerboard engine match a recalculation from scratch after many sub-sweeps
+@pytest.mark.parametrize("c_int, is_block", [(1, False), (-0.5, True)])
+def test_checkerboard_energies_match_from_scratch(small_system, monkeypatch, c_int, is_block):
+    monkeypatch.setattr(config, "ENERGY_CHECK_INTERVAL", 0)
+    monkeypatch.setattr(config, "TIMES_TO_SAVE", 5)
+    test_brush = sweep.prepare_variant(sweep.initialize_configuration(0), c_int, is_block)
+    initial_positions = test_brush.particle_positions.copy()
+    monte_carlo.run_checkerboard_monte_carlo(test_brush, 1, np.random.default_rng(8))
+    assert np.all(np.any(test_brush.particle_positions != initial_positions, axis=2))
+    assert_energies_consistent(test_brush)
+
+# test that the energy drift tolerance scales with the precision: the rounding drift of float32 and float64 runs stays below it without any
+# resynchronisation, while a drift far above rounding is still found and corrected
+@pytest.mark.parametrize("precision", [np.float32, np.float64])
+def test_energy_drift_tolerance_scales_with_precision(small_system, monkeypatch, precision):
+    monkeypatch.setattr(config, "PRECISION", precision)
+    monkeypatch.setattr(config, "ENERGY_CHECK_INTERVAL", 1)
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        test_brush = mixed_brush(saves=10)
+    assert test_brush.particle_positions.dtype == precision
+
+    test_brush.total_energy += 1
+    with pytest.warns(UserWarning, match="energy drift"):
+        test_brush.check_energy_drift()
+    assert abs(test_brush.total_energy - test_brush.calc_energies_from_scratch()[3]) < 1e-8
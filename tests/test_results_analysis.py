@@ -0,0 +1,20 @@
+import importlib
+import matplotlib
+import numpy as np
+
+from src import results_analysis
+
+# test that importing the analysis module leaves the matplotlib backend chosen by the user alone, and that graphs still render to files without a display
+def test_graphs_render_without_changing_backend(tmp_path, monkeypatch):
+    monkeypatch.setattr(matplotlib, "rcParams", matplotlib.rcParams.copy())
+    matplotlib.use('svg')
+    importlib.reload(results_analysis)
+    assert matplotlib.get_backend() == 'svg'
+
+    plots = [{"filename": str(tmp_path / f"graph_{i}.png"), "title": "graph", "lines": [(np.arange(3), np.arange(3) / 3, "density")],
+              "equilibration_step": 1 if i else None, "text": "text"} for i in range(2)]
+    results_analysis.render_plots(plots, processes=1)
+    for plot in plots:
+        with open(plot["filename"], 'rb') as file:
+            assert file.read(8) == b'\x89PNG\r\n\x1a\n'
+    assert matplotlib.get_backend() == 'svg'
@@ -0,0 +1,46 @@
+import re
+import multiprocessing as mp
+import pytest
+
+import start_simulation
+from src import config, results_stream
+
+pytestmark = pytest.mark.skipif(mp.get_start_method() != 'fork', reason="pool workers must be forked to share the test configuration")
+
+# fixture to run whole sweeps of the small system in a temporary folder, with few and short jobs and no per-configuration graphs
+@pytest.fixture
+def small_main(small_system, monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    for name, value in {"TIMES_TO_SAVE": 2, "STARTING_CONFIGURATIONS": 1, "C_INTERACTIONS": [1], "PLOT_CONFIGURATION_GRAPHS": False, "PLOT_PROCESSES": 1}.items():
+        monkeypatch.setattr(config, name, value)
+
+# function to run a sweep and find how many jobs it ran
+# args: capsys - pytest output capture, fresh - passed to start_simulation.main
+# returns: number of jobs the sweep started
+def run_sweep(capsys, fresh=False):
+    start_simulation.main(fresh)
+    return int(re.search(r"simulation of (\d+) jobs", capsys.readouterr().out).group(1))
+
+# test that a sweep extended by one temperature continues the results stream without flags, and only runs the new jobs
+def test_extended_sweep_only_runs_new_jobs(small_main, capsys, monkeypatch):
+    monkeypatch.setattr(config, "TEMPERATURES", [0.5, 1])
+    assert run_sweep(capsys) == 4
+    first_results = {results_stream.job_identity(result): result["densities"].tolist() for result in results_stream.read_results(config.RESULTS_STREAM_FILENAME)}
+
+    monkeypatch.setattr(config, "TEMPERATURES", [0.5, 1, 2])
+    assert run_sweep(capsys) == 2
+
+    results = {results_stream.job_identity(result): result["densities"].tolist() for result in results_stream.read_results(config.RESULTS_STREAM_FILENAME)}
+    assert len(results) == 6
+    assert all(results[identity] == densities for identity, densities in first_results.items())
+
+    # a rerun of the same sweep has nothing left to run, and a fresh one runs every job again
+    assert run_sweep(capsys) == 0
+    assert run_sweep(capsys, fresh=True) == 6
+
+# test that a results stream of a different system is never continued
+def test_changed_system_is_refused_without_fresh(small_main, capsys, monkeypatch):
+    run_sweep(capsys)
+    monkeypatch.setattr(config, "K_SPRING", config.K_SPRING * 2)
+    with pytest.raises(ValueError):
+        run_sweep(capsys)
@@ -0,0 +1,29 @@
+import numpy as np
+import pytest
+
+from src import config, monte_carlo, sweep, trajectory
+
+# test that a run stopping early keeps only the frames it wrote, the last being the final state of the brush
+@pytest.mark.parametrize("engine", [monte_carlo.run_monte_carlo, monte_carlo.run_checkerboard_monte_carlo])
+def test_early_stop_truncates_trajectory(small_system, monkeypatch, tmp_path, engine):
+    monkeypatch.setattr(config, "TIMES_TO_SAVE", 40)
+    monkeypatch.setattr(config, "MIN_SAVES_BEFORE_STOPPING", 5)
+    path = str(tmp_path / "trajectory.npy")
+
+    test_brush = sweep.prepare_variant(sweep.initialize_configuration(0), 1, True)
+    densities = engine(test_brush, 1, np.random.default_rng(0), trajectory_path=path, target_error=1.0)
+    saves_run = (len(densities) - 1) // monte_carlo.samples_per_save_interval(monte_carlo.density_sample_interval())
+    assert saves_run < config.TIMES_TO_SAVE
+
+    frames = trajectory.load_trajectory(path)
+    assert frames.shape == (saves_run + 1, config.NUM_CHAINS, config.CHAIN_LEN, 3)
+    np.testing.assert_array_equal(frames[-1], test_brush.particle_positions)
+
+# test that cutting a trajectory down keeps the first frames unchanged
+def test_truncate_frames_keeps_first_frames(tmp_path):
+    path = str(tmp_path / "frames.npy")
+    frames = np.random.default_rng(0).random((1000, 2, 3, 3))
+    np.save(path, frames)
+
+    trajectory.truncate_frames(path, 7)
+    np.testing.assert_array_equal(trajectory.load_trajectory(path), frames[:7])
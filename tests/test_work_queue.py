@@ -0,0 +1,72 @@
+import os
+import signal
+import time
+import multiprocessing as mp
+import numpy as np
+import pytest
+
+from src import config, results_stream, sweep, work_queue
+
+# local workers are forked, so they run with the configuration of the test process
+pytestmark = pytest.mark.skipif(mp.get_start_method() != 'fork', reason="local workers must be forked to share the test configuration")
+
+# fixture to run a test with a small sweep, with jobs long enough to kill a worker in the middle of one
+@pytest.fixture
+def small_sweep(small_system, monkeypatch):
+    monkeypatch.setattr(config, "HEARTBEAT_INTERVAL", 0.2)
+    monkeypatch.setattr(config, "WORKER_CONNECT_TIMEOUT", 10)
+    return sweep.build_jobs([0])[:4]
+
+# function to wait until a condition holds
+# args: condition - callable returning a bool, timeout - seconds to wait before failing
+# no return value
+def wait_for(condition, timeout=30):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out waiting for the coordinator"
+        time.sleep(0.01)
+
+# function to index results by the job they belong to
+# args: results - iterable of result dictionaries
+# returns: dict of job_identity: densities
+def densities_by_job(results):
+    return {results_stream.job_identity(result): result["densities"] for result in results}
+
+# test that the job of a worker killed mid-job is requeued and run by another worker, giving exactly the results of the process pool path
+def test_killed_worker_work_is_requeued_and_results_match_pool(small_sweep):
+    jobs = small_sweep
+    with mp.Pool(2) as pool:
+        expected = densities_by_job(pool.imap_unordered(sweep.run_job, jobs, chunksize=1))
+
+    with work_queue.Coordinator(sweep.run_job, jobs, ('localhost', 0)) as coordinator:
+        # start one worker, and kill it while it is running a job
+        doomed_worker, = work_queue.start_local_workers(coordinator.address, 1)
+        wait_for(lambda: any(worker["work_ids"] for worker in list(coordinator.workers.values())))
+        with coordinator.lock:
+            killed_work_ids = set().union(*(worker["work_ids"] for worker in coordinator.workers.values()))
+        os.kill(doomed_worker.pid, signal.SIGKILL)
+        doomed_worker.join()
+
+        # the coordinator notices the connection closing and puts the killed job back in the queue
+        wait_for(lambda: killed_work_ids <= set(coordinator.pending))
+
+        workers = work_queue.start_local_workers(coordinator.address, 2)
+        results = list(coordinator.results())
+
+    for worker in workers:
+        worker.join(timeout=10)
+
+    assert len(results) == len(jobs)
+    actual = densities_by_job(results)
+    assert actual.keys() == expected.keys()
+    for identity, densities in expected.items():
+        np.testing.assert_array_equal(actual[identity], densities)
+
+# test that the publicly known default key is only accepted on the loopback interface
+def test_default_authkey_is_refused_beyond_loopback():
+    with pytest.raises(ValueError):
+        work_queue.Coordinator(sweep.run_job, [], ('0.0.0.0', 0), config.DEFAULT_COORDINATOR_AUTHKEY)
+
+    assert work_queue.is_loopback('localhost')
+    assert work_queue.is_loopback('127.0.0.1')
+    assert not work_queue.is_loopback('0.0.0.0')